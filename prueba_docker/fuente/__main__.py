@@ -0,0 +1,10 @@
+# fuente/__main__.py
+# python -m fuente ... (ver corrida.py)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corrida import main
+
+sys.exit(main())
@@ -0,0 +1,579 @@
+# fuente/benchmark.py
+"""
+Benchmark por etapas de carga_data.py y etl.py con datos sintéticos.
+
+Genera un CSV con las mismas particularidades que data/raw/data_prueba_tecnica.csv
+(fechas YYYYMMDD y con sufijo .0, company_id de longitud incorrecta, variantes
+de nombre con acentos o errores de tipeo, status inválidos, montos enormes, ids
+nulos y repetidos), lo carga en una base PostgreSQL desechable y mide cada etapa.
+Con --companias se fija el número de compañías (por defecto, una cada
+FILAS_POR_COMPANIA filas).
+
+Cada medición se agrega como una línea JSON al archivo de salida (por defecto
+data/benchmark/benchmark.jsonl); con --comparar
+se contrasta contra una corrida anterior y se señalan las regresiones.
+
+Con --motor arrow se miden las etapas del motor Arrow de etl.py. Con
+--verificar-motores no se mide: se corren los dos motores sobre los mismos
+datos y se comprueba que el catálogo, los charges y las alertas sean idénticos.
+
+Uso:
+    python fuente/benchmark.py --filas 100000 1000000
+    python fuente/benchmark.py --filas 100000 --comparar data/benchmark/base.jsonl
+    python fuente/benchmark.py --filas 100000 --motor arrow
+    python fuente/benchmark.py --filas 1000000 --companias 20000
+    python fuente/benchmark.py --filas 100000 1000000 --verificar-motores
+"""
+import argparse
+import binascii
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INIT_SQL = os.path.join(BASE_DIR, "init", "01_init.sql")
+
+# Bajo data/, ignorado por git, para que medir no deje cambios en el árbol
+SALIDA_POR_DEFECTO = os.path.join(BASE_DIR, "data", "benchmark", "benchmark.jsonl")
+BD_BENCHMARK = os.getenv("BENCH_DB_NAME", "charges_benchmark")
+
+# Filas por bloque al escribir el CSV sintético; acota la memoria del generador
+FILAS_POR_BLOQUE = 1_000_000
+
+# Sin --companias se genera una compañía por cada tantas filas (1.000 con 100.000
+# filas), para que el catálogo y la corrección de nombres pesen como en producción
+FILAS_POR_COMPANIA = 100
+
+# Una etapa es regresión si sus filas/s caen más de esta fracción respecto de la base
+TOLERANCIA = 0.10
+
+ETAPAS = [
+    "carga_csv",
+    "leer_raw",
+    "transformar",
+    "limpiar_nombres_empresas",
+    "limpiar_charges",
+    "load_companies",
+    "load_charges",
+]
+
+# Distribución de status del archivo real, más los valores basura que trae
+STATUS = {
+    "paid": 0.589, "voided": 0.208, "pending_payment": 0.188, "refunded": 0.0093,
+    "charged_back": 0.0021, "pre_authorized": 0.0018, "expired": 0.0008,
+    "partially_refunded": 0.0001, "p&0x3fid": 0.0001, "0xFFFF": 0.0001,
+}
+
+SILABAS = ["mi", "pa", "sa", "je", "fy", "mue", "bles", "chi", "dos", "tec", "no", "ma", "ri", "lu", "ca"]
+
+
+#FUNCIONES DEL GENERADOR DE DATOS SINTÉTICOS
+def _hex40(rng, n):
+    # n identificadores hexadecimales de 40 caracteres, como los SHA-1 del archivo real
+    crudo = binascii.hexlify(rng.bytes(20 * n))
+    return np.frombuffer(crudo, dtype="S40").astype(str)
+
+
+def generar_companias(rng, n_companias):
+    nombres = set()
+    while len(nombres) < n_companias:
+        partes = rng.choice(SILABAS, size=rng.integers(2, 5))
+        nombre = "".join(partes).capitalize()
+        if rng.random() < 0.4:
+            nombre += " " + "".join(rng.choice(SILABAS, size=2))
+        nombres.add(nombre)
+
+    return pd.DataFrame({
+        "company_id": _hex40(rng, n_companias),
+        "name": sorted(nombres),
+    })
+
+
+def companias_por_defecto(filas):
+    return max(2, filas // FILAS_POR_COMPANIA)
+
+
+def _errata(rng, nombre):
+    # Un error de tipeo: letra cambiada, omitida, repetida o dos letras invertidas
+    if len(nombre) < 3:
+        return nombre
+    i = int(rng.integers(1, len(nombre) - 1))
+    error = rng.integers(4)
+    if error == 0:
+        return nombre[:i] + rng.choice(SILABAS)[0] + nombre[i + 1:]
+    if error == 1:
+        return nombre[:i] + nombre[i + 1:]
+    if error == 2:
+        return nombre[:i] + nombre[i] + nombre[i:]
+    return nombre[:i - 1] + nombre[i] + nombre[i - 1] + nombre[i + 1:]
+
+
+def _variantes_nombre(rng, nombres):
+    # Mismas compañías escritas distinto: mayúsculas, acentos, basura 0xFFFF, vacío,
+    # errores de tipeo
+    nombres = nombres.copy()
+    n = len(nombres)
+    sorteo = rng.random(n)
+
+    mayusculas = sorteo < 0.002
+    nombres[mayusculas] = np.char.upper(nombres[mayusculas].astype(str))
+
+    acentos = (sorteo >= 0.002) & (sorteo < 0.004)
+    tabla = str.maketrans({"a": "á", "e": "é", "i": "í", "o": "ó", "u": "ú"})
+    nombres[acentos] = [nombre.translate(tabla) for nombre in nombres[acentos]]
+
+    basura = (sorteo >= 0.004) & (sorteo < 0.0042)
+    nombres[basura] = [nombre[:rng.integers(3, 6)] + "0xFFFF" for nombre in nombres[basura]]
+
+    vacios = (sorteo >= 0.0042) & (sorteo < 0.0045)
+    nombres[vacios] = ""
+
+    erratas = (sorteo >= 0.0045) & (sorteo < 0.0085)
+    nombres[erratas] = [_errata(rng, nombre) for nombre in nombres[erratas]]
+    return nombres
+
+
+def _montos(rng, n):
+    # Montos con 1 o 2 decimales, artefactos de flotante y algunos enormes o ilegibles
+    valores = np.round(np.exp(rng.uniform(0, np.log(20_000), n)), 2)
+    montos = pd.Series(valores).map(repr).to_numpy(dtype=object)
+
+    sorteo = rng.random(n)
+    artefactos = sorteo < 0.0004
+    montos[artefactos] = [f"{v + 1e-12:.15g}" for v in valores[artefactos]]
+
+    enormes = (sorteo >= 0.0004) & (sorteo < 0.0006)
+    montos[enormes] = [f"{rng.integers(10**10, 10**18)}{rng.integers(0, 99)}.{rng.integers(0, 99)}"
+                       for _ in range(enormes.sum())]
+
+    ilegibles = (sorteo >= 0.0006) & (sorteo < 0.0007)
+    montos[ilegibles] = "3.0e213231213123"
+    return montos
+
+
+def _fechas(rng, n, inicio, dias):
+    fechas = inicio + rng.integers(0, dias, n).astype("timedelta64[D]")
+    textos = np.datetime_as_string(fechas, unit="D").astype(object)
+
+    sorteo = rng.random(n)
+    compactas = sorteo < 0.0002
+    textos[compactas] = [t.replace("-", "") for t in textos[compactas]]
+
+    flotantes = (sorteo >= 0.0002) & (sorteo < 0.0003)
+    textos[flotantes] = [t.replace("-", "") + ".0" for t in textos[flotantes]]
+
+    con_hora = (sorteo >= 0.0003) & (sorteo < 0.0004)
+    textos[con_hora] = [t + "T%02d:%02d:%02d" % tuple(rng.integers(0, [24, 60, 60]))
+                        for t in textos[con_hora]]
+    return fechas, textos
+
+
+def generar_bloque(rng, companias, n, ids_previos):
+    # Reparto sesgado, como en el archivo real donde una compañía concentra casi todo
+    pesos = 1.0 / np.arange(1, len(companias) + 1) ** 1.5
+    indices = rng.choice(len(companias), size=n, p=pesos / pesos.sum())
+
+    ids = _hex40(rng, n).astype(object)
+    sorteo = rng.random(n)
+    ids[sorteo < 0.0003] = ""
+    repetidos = (sorteo >= 0.0003) & (sorteo < 0.0005)
+    origen = np.concatenate([ids_previos, ids[(sorteo >= 0.0005)][:1000]])
+    ids[repetidos] = rng.choice(origen, size=repetidos.sum())
+
+    company_id = companias["company_id"].to_numpy(dtype=object)[indices]
+    sorteo = rng.random(n)
+    company_id[sorteo < 0.0004] = ""
+    malos = (sorteo >= 0.0004) & (sorteo < 0.0005)
+    company_id[malos] = [c[:rng.integers(1, 39)] if rng.random() < 0.5 else "*******"
+                         for c in company_id[malos]]
+
+    fechas, created_at = _fechas(rng, n, np.datetime64("2019-01-01"), 365)
+    pagadas = rng.random(n) < 0.6
+    paid_at = np.full(n, "", dtype=object)
+    paid_at[pagadas] = np.datetime_as_string(
+        fechas[pagadas] + rng.integers(0, 5, pagadas.sum()).astype("timedelta64[D]"), unit="D"
+    )
+
+    nombres = companias["name"].to_numpy(dtype=object)[indices]
+
+    return pd.DataFrame({
+        "id": ids,
+        "name": _variantes_nombre(rng, nombres),
+        "company_id": company_id,
+        "amount": _montos(rng, n),
+        "status": rng.choice(list(STATUS), size=n, p=np.array(list(STATUS.values())) / sum(STATUS.values())),
+        "created_at": created_at,
+        "paid_at": paid_at,
+    })
+
+
+def generar_csv(ruta, filas, semilla=42, n_companias=None):
+    """
+    Escribe un CSV sintético de `filas` filas y `n_companias` compañías (por
+    defecto companias_por_defecto), por bloques. Con la misma semilla, las
+    mismas filas y las mismas compañías el archivo es idéntico byte a byte.
+    """
+    rng = np.random.default_rng(semilla)
+    companias = generar_companias(rng, n_companias or companias_por_defecto(filas))
+
+    ids_previos = np.array([], dtype=object)
+    with open(ruta, "w", encoding="utf-8", newline="") as f:
+        for inicio in range(0, filas, FILAS_POR_BLOQUE):
+            n = min(FILAS_POR_BLOQUE, filas - inicio)
+            bloque = generar_bloque(rng, companias, n, ids_previos)
+            ids_previos = bloque["id"].to_numpy()[:1000]
+
+            # El archivo real termina sus líneas en \r\r\n
+            bloque.to_csv(f, header=inicio == 0, index=False, lineterminator="\r\r\n")
+
+
+#FUNCIONES DE MEDICIÓN
+def rss_actual():
+    """Memoria residente del proceso en bytes (Linux); None si no se puede leer."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MedidorEtapa:
+    """
+    Context manager que mide el tiempo de pared de una etapa y el pico de
+    memoria residente, muestreando el RSS en un hilo mientras corre.
+    """
+
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self.segundos = None
+        self.rss_inicio = None
+        self.rss_pico = None
+        self._fin = threading.Event()
+
+    def _muestrear(self):
+        while not self._fin.wait(self.intervalo):
+            rss = rss_actual()
+            if rss is not None:
+                self.rss_pico = max(self.rss_pico or 0, rss)
+
+    def __enter__(self):
+        self.rss_inicio = self.rss_pico = rss_actual()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self._inicio
+        self._fin.set()
+        self._hilo.join()
+        rss = rss_actual()
+        if rss is not None:
+            self.rss_pico = max(self.rss_pico or 0, rss)
+        return False
+
+
+def _mb(valor):
+    return None if valor is None else round(valor / 1024 / 1024, 1)
+
+
+def contexto_ejecucion():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "ejecucion": uuid.uuid4().hex[:12],
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+        "tipos_compactos": os.getenv("ETL_TIPOS_COMPACTOS", "0") == "1",
+    }
+
+
+#FUNCIONES DE LA BASE DESECHABLE
+def recrear_base(nombre):
+    import psycopg2
+    from utils import db_config
+
+    db_config.cerrar_pool()
+
+    admin = psycopg2.connect(host=db_config.DB_HOST, port=db_config.DB_PORT, dbname="postgres",
+                             user=db_config.DB_USER, password=db_config.DB_PASS)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{nombre}"')
+            cur.execute(f'CREATE DATABASE "{nombre}"')
+    finally:
+        admin.close()
+
+    with db_config.conexion() as (conn, cur), open(INIT_SQL, encoding="utf-8") as f:
+        cur.execute(f.read())
+
+
+def eliminar_base(nombre):
+    import psycopg2
+    from utils import db_config
+
+    db_config.cerrar_pool()
+
+    admin = psycopg2.connect(host=db_config.DB_HOST, port=db_config.DB_PORT, dbname="postgres",
+                             user=db_config.DB_USER, password=db_config.DB_PASS)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{nombre}"')
+    finally:
+        admin.close()
+
+
+#FUNCION QUE CORRE TODAS LAS ETAPAS PARA UN TAMAÑO
+def preparar_datos(filas, semilla, directorio, n_companias):
+    """Genera el CSV sintético si no existe y recrea la base desechable. Retorna la ruta del CSV."""
+    ruta_csv = os.path.join(directorio, f"sintetico_{filas}_{n_companias}_{semilla}.csv")
+    if not os.path.exists(ruta_csv):
+        print(f"Generando {filas:,} filas de {n_companias:,} compañías (semilla {semilla})...")
+        generar_csv(ruta_csv, filas, semilla, n_companias)
+
+    recrear_base(BD_BENCHMARK)
+    return ruta_csv
+
+
+def medir_etapas(filas, semilla, directorio, n_companias, detalle=False, motor="pandas"):
+    """
+    Genera el CSV, recrea la base desechable y mide cada etapa en orden,
+    con el motor indicado. Retorna una lista de dicts {etapa, filas,
+    companias, motor, segundos, filas_por_segundo, rss_inicio_mb,
+    rss_pico_mb}; las etapas que producen un DataFrame (o una tabla Arrow)
+    agregan bytes_por_fila.
+    """
+    import carga_data
+    import etl
+    import motor_arrow
+
+    ruta_csv = preparar_datos(filas, semilla, directorio, n_companias)
+
+    # Cada etapa recibe la salida de la anterior
+    datos = {}
+    if motor == "arrow":
+        etapas = {
+            "leer_raw": lambda: datos.update(raw=motor_arrow.traer_raw_arrow()),
+            "transformar": lambda: datos.update(df=motor_arrow.transformar_arrow(datos.pop("raw"))),
+            "limpiar_nombres_empresas": lambda: datos.update(
+                companies=motor_arrow.limpiar_nombres_empresas_arrow(datos["df"])),
+            "limpiar_charges": lambda: datos.update(
+                charges=motor_arrow.transformar_y_limpiar_arrow(datos.pop("df"), datos["companies"])),
+        }
+    else:
+        etapas = {
+            "leer_raw": lambda: datos.update(raw=etl.traer_raw_df()),
+            "transformar": lambda: datos.update(df=etl.transformar(datos.pop("raw"))),
+            "limpiar_nombres_empresas": lambda: datos.update(companies=etl.limpiar_nombres_empresas(datos["df"])),
+            "limpiar_charges": lambda: datos.update(charges=etl.limpiar_charges(datos.pop("df"), datos["companies"])),
+        }
+    etapas.update({
+        "carga_csv": lambda: carga_data.load_csv_with_copy(ruta_csv),
+        "load_companies": lambda: etl.load_companies(datos["companies"]),
+        "load_charges": lambda: etl.load_charges(datos["charges"], motor=motor),
+    })
+
+    # DataFrame que deja cada etapa, para medir cuánta memoria ocupa por fila
+    salidas = {"leer_raw": "raw", "transformar": "df", "limpiar_charges": "charges"}
+
+    resultados = []
+    for etapa in ETAPAS:
+        salida = contextlib.nullcontext() if detalle else contextlib.redirect_stdout(io.StringIO())
+        with salida, MedidorEtapa() as medidor:
+            etapas[etapa]()
+
+        resultados.append({
+            "etapa": etapa,
+            "filas": filas,
+            "companias": n_companias,
+            "motor": motor,
+            "segundos": round(medidor.segundos, 4),
+            "filas_por_segundo": round(filas / medidor.segundos) if medidor.segundos else None,
+            "rss_inicio_mb": _mb(medidor.rss_inicio),
+            "rss_pico_mb": _mb(medidor.rss_pico),
+        })
+        if etapa in salidas:
+            df = datos[salidas[etapa]]
+            nbytes = df.nbytes if hasattr(df, "num_rows") else df.memory_usage(deep=True).sum()
+            resultados[-1]["bytes_por_fila"] = round(nbytes / max(len(df), 1), 1)
+        print(f"  {etapa:<26} {medidor.segundos:>9.3f} s {resultados[-1]['filas_por_segundo'] or 0:>12,} filas/s"
+              f"   RSS pico {resultados[-1]['rss_pico_mb']} MB")
+
+    return resultados
+
+
+#FUNCIONES QUE VERIFICAN QUE LOS DOS MOTORES DEN EL MISMO RESULTADO
+def _valores(df):
+    # Mismos valores con cualquier dtype: texto, categóricas y nulos pasan a objetos y None
+    df = df.copy()
+    for col, tipo in df.dtypes.items():
+        if isinstance(tipo, (pd.CategoricalDtype, pd.StringDtype)) or tipo == object:
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+    return df
+
+
+def _diferencia(nombre, esperado, obtenido):
+    try:
+        pd.testing.assert_frame_equal(_valores(esperado), _valores(obtenido), check_dtype=False)
+    except AssertionError as e:
+        return f"{nombre}: {e}"
+    return None
+
+
+def verificar_motores(filas, semilla, directorio, n_companias):
+    """
+    Corre la transformación y la validación con los dos motores sobre los
+    mismos datos crudos (sin cargar charges) y compara el catálogo, los
+    charges válidos, las alertas y los charges deduplicados. Retorna la
+    lista de diferencias (vacía si los resultados son idénticos).
+    """
+    import carga_data
+    import etl
+    import motor_arrow
+
+    carga_data.load_csv_with_copy(preparar_datos(filas, semilla, directorio, n_companias))
+
+    df = etl.transformar(etl.traer_raw_df())
+    companies = etl.limpiar_nombres_empresas(df)
+    validos, alertas = etl.validar_charges(df, companies)
+
+    tabla = motor_arrow.transformar_arrow(motor_arrow.traer_raw_arrow())
+    companies_arrow = motor_arrow.limpiar_nombres_empresas_arrow(tabla)
+    validos_arrow, alertas_arrow = motor_arrow.clasificar_charges_arrow(
+        motor_arrow.reparar_company_id_arrow(tabla, companies_arrow))
+
+    diferencias = [
+        _diferencia("catálogo", companies, companies_arrow),
+        _diferencia("charges válidos", validos, validos_arrow),
+        _diferencia("alertas", alertas, alertas_arrow),
+        _diferencia("charges deduplicados", etl.deduplicar_charges(validos), etl.deduplicar_charges(validos_arrow)),
+    ]
+    return [d for d in diferencias if d]
+
+
+#FUNCION QUE COMPARA CONTRA UNA CORRIDA ANTERIOR
+def comparar(resultados, archivo_base, tolerancia=TOLERANCIA):
+    """
+    Compara filas/s por (etapa, filas, compañías, semilla, motor) contra la
+    última medición equivalente de archivo_base (las mediciones sin motor son
+    del motor pandas). Retorna la lista de regresiones.
+    """
+    base = {}
+    with open(archivo_base, encoding="utf-8") as f:
+        for linea in f:
+            if linea.strip():
+                registro = json.loads(linea)
+                base[(registro["etapa"], registro["filas"], registro.get("companias"),
+                      registro["semilla"], registro.get("motor", "pandas"))] = registro
+
+    regresiones = []
+    for r in resultados:
+        anterior = base.get((r["etapa"], r["filas"], r["companias"], r["semilla"], r["motor"]))
+        if not anterior or not anterior.get("filas_por_segundo") or not r["filas_por_segundo"]:
+            continue
+
+        cambio = r["filas_por_segundo"] / anterior["filas_por_segundo"] - 1
+        marca = "REGRESIÓN" if cambio < -tolerancia else ""
+        print(f"  {r['etapa']:<26} {r['filas']:>10,} filas  {cambio:+7.1%}  {marca}")
+        if marca:
+            regresiones.append({**r, "cambio": cambio})
+
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del ETL con datos sintéticos")
+    parser.add_argument("--filas", type=int, nargs="+", default=[100_000],
+                        help="tamaños a medir (p. ej. 100000 1000000 10000000)")
+    parser.add_argument("--companias", type=int,
+                        help=f"compañías distintas en los datos (por defecto, una cada {FILAS_POR_COMPANIA} filas)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=SALIDA_POR_DEFECTO, help="archivo JSON lines donde agregar resultados")
+    parser.add_argument("--comparar", help="JSON lines de una corrida anterior")
+    parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+    parser.add_argument("--directorio", help="dónde guardar los CSV sintéticos (por defecto, uno temporal)")
+    parser.add_argument("--conservar-base", action="store_true", help="no eliminar la base desechable al terminar")
+    parser.add_argument("--detalle", action="store_true", help="mostrar la salida de cada etapa")
+    parser.add_argument("--motor", choices=["pandas", "arrow"], default=os.getenv("ETL_MOTOR", "pandas"),
+                        help="motor de transformación a medir")
+    parser.add_argument("--verificar-motores", action="store_true",
+                        help="en lugar de medir, comprobar que los dos motores den resultados idénticos")
+    args = parser.parse_args(argv)
+
+    # La base desechable se fija antes de importar db_config, que lee la configuración al importarse
+    os.environ["DB_NAME"] = BD_BENCHMARK
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    contexto = contexto_ejecucion()
+    directorio = args.directorio or tempfile.mkdtemp(prefix="benchmark_etl_")
+    os.makedirs(directorio, exist_ok=True)
+
+    resultados = []
+    directorio_previo = os.getcwd()
+    try:
+        # Con ETL_ALERTAS=csv las alertas del ETL se escriben en el directorio actual
+        os.chdir(directorio)
+        for filas in args.filas:
+            n_companias = args.companias or companias_por_defecto(filas)
+            if args.verificar_motores:
+                print(f"Verificando los motores con {filas:,} filas")
+                salida = contextlib.nullcontext() if args.detalle else contextlib.redirect_stdout(io.StringIO())
+                with salida:
+                    diferencias = verificar_motores(filas, args.semilla, directorio, n_companias)
+                for diferencia in diferencias:
+                    print(f"  DIFERENCIA en {diferencia}")
+                if diferencias:
+                    return 1
+                print("  pandas y arrow: catálogo, charges y alertas idénticos")
+                continue
+
+            print(f"Midiendo {filas:,} filas de {n_companias:,} compañías (motor {args.motor})")
+            for r in medir_etapas(filas, args.semilla, directorio, n_companias, args.detalle, args.motor):
+                resultados.append({**contexto, "semilla": args.semilla, **r})
+    finally:
+        os.chdir(directorio_previo)
+        if not args.conservar_base:
+            eliminar_base(BD_BENCHMARK)
+
+    if args.verificar_motores:
+        return 0
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.salida)), exist_ok=True)
+    with open(args.salida, "a", encoding="utf-8") as f:
+        for r in resultados:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    print(f"Resultados agregados a {args.salida}")
+
+    if args.comparar:
+        regresiones = comparar(resultados, args.comparar, args.tolerancia)
+        if regresiones:
+            print(f"{len(regresiones)} etapa(s) con regresión mayor a {args.tolerancia:.0%}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,10 @@
 # fuente/carga_data.py
-import pandas as pd
+import hashlib
 import os
+import re
 
-from utils.db_config import DatabaseConnection
+from utils.db_config import conexion
+from utils.metricas import anotar, instrumentar
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RAW_DATA_PATH = os.path.join(BASE_DIR, "data", "raw", "data_prueba_tecnica.csv")
@@ -21,94 +23,406 @@ CONF_TABLA = {
     "paid_at": "VARCHAR(250)"
 }
 
-#FUNCIÓN QUE CREA LA TABLA CRUDA EN LA BASE
-def crear_tabla_raw(db: DatabaseConnection):
-    conn, cur = db.connect()
-    if conn is None:
-        raise RuntimeError("No se pudo conectar a la base de datos")
+# Columnas de control de ingesta: cada COPY recibe un lote_id nuevo, que se
+# toma del parámetro de sesión etl.lote_id fijado durante la carga
+COLUMNAS_INGESTA = {
+    "lote_id": "BIGINT DEFAULT NULLIF(current_setting('etl.lote_id', true), '')::BIGINT",
+    "cargado_en": "TIMESTAMP DEFAULT now()"
+}
+
+# Registro de lotes cargados; la huella del archivo evita cargar dos veces el mismo CSV
+TABLA_INGESTAS = "ingestas"
+
+# Cada carga toma este bloqueo compartido hasta su commit (varias cargas pueden
+# correr a la vez) y etl.py lo toma exclusivo para leer el último lote: así no
+# queda atrás un lote de id menor que se confirme después de esa lectura
+SQL_BLOQUEO_INGESTA = f"SELECT pg_advisory_xact_lock_shared(hashtext('{SCHEMA_NAME}.{TABLA_INGESTAS}'))"
+
+# Si es 1, la tabla cruda es UNLOGGED (sin WAL) y cada COPY pasa por una tabla
+# de staging, desde la que se agregan las filas junto con sus columnas tipadas
+RAW_TIPADA = os.getenv("CARGA_RAW_TIPADA", "0") == "1"
+
+# Sombra tipada de la tabla cruda: lo que la base pudo convertir sin ambigüedad.
+# estado_parseo marca con un bit (1 amount, 2 created_at, 4 paid_at) cada valor
+# no nulo que quedó solo en texto; es nulo en las filas cargadas sin tipar
+COLUMNAS_TIPADAS = {
+    "amount_tipado": "NUMERIC",
+    "created_at_tipado": "TIMESTAMP",
+    "paid_at_tipado": "TIMESTAMP",
+    "estado_parseo": "SMALLINT"
+}
+
+# Fechas sin ambigüedad: YYYY-MM-DD, con hora opcional (hasta microsegundos), y
+# YYYYMMDD, con o sin el sufijo .0 de los flotantes. pg_input_is_valid descarta
+# fechas imposibles (20190231) sin abortar la carga. Cada función es una sola
+# expresión, para que PostgreSQL la incorpore a la consulta en lugar de llamarla
+# fila por fila (así es varias veces más rápida)
+SQL_FUNCIONES_TIPADO = rf"""
+CREATE OR REPLACE FUNCTION {SCHEMA_NAME}.fecha_tipada(valor TEXT) RETURNS TIMESTAMP
+LANGUAGE sql STABLE AS $$
+    SELECT CASE
+        WHEN valor ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}$' AND pg_input_is_valid(valor, 'date')
+        THEN valor::TIMESTAMP
+        WHEN valor ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}[T ][0-9]{{2}}:[0-9]{{2}}:[0-9]{{2}}(\.[0-9]{{1,6}})?$'
+             AND pg_input_is_valid(valor, 'timestamp')
+        THEN valor::TIMESTAMP
+        WHEN valor ~ '^[0-9]{{8}}(\.0)?$' AND pg_input_is_valid(left(valor, 8), 'date')
+        THEN left(valor, 8)::TIMESTAMP
+    END
+$$;
 
+CREATE OR REPLACE FUNCTION {SCHEMA_NAME}.amount_tipado(valor TEXT) RETURNS NUMERIC
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN valor ~ '^-?[0-9]+(\.[0-9]+)?$' THEN valor::NUMERIC END
+$$;
+"""
+
+# Tabla de staging del COPY en modo tipado; temporal, así que tampoco escribe WAL
+TABLA_STAGING_RAW = "stg_data_raw"
+
+SQL_STAGING_RAW = """
+    CREATE TEMP TABLE {tabla} (
+        {columnas}
+    ) ON COMMIT DROP
+"""
+
+# Agrega las filas de staging, en el orden del archivo, con su sombra tipada.
+# OFFSET 0 impide que el subquery se disuelva en la consulta externa: sin él,
+# cada conversión se evaluaría dos veces (valor y estado_parseo)
+SQL_AGREGAR_TIPADAS = f"""
+    INSERT INTO {SCHEMA_NAME}.{TABLE_NAME} ({{columnas}}, {", ".join(COLUMNAS_TIPADAS)})
+    SELECT t.*,
+           (CASE WHEN t.amount IS NOT NULL AND t.amount_tipado IS NULL THEN 1 ELSE 0 END
+          | CASE WHEN t.created_at IS NOT NULL AND t.created_at_tipado IS NULL THEN 2 ELSE 0 END
+          | CASE WHEN t.paid_at IS NOT NULL AND t.paid_at_tipado IS NULL THEN 4 ELSE 0 END)::SMALLINT
+    FROM (
+        SELECT s.*,
+               {SCHEMA_NAME}.amount_tipado(s.amount) AS amount_tipado,
+               {SCHEMA_NAME}.fecha_tipada(s.created_at) AS created_at_tipado,
+               {SCHEMA_NAME}.fecha_tipada(s.paid_at) AS paid_at_tipado
+        FROM {TABLA_STAGING_RAW} s
+        OFFSET 0
+    ) t
+"""
+
+# Valores del lote que quedaron solo en texto, por columna
+SQL_SIN_TIPAR = f"""
+    SELECT COUNT(*) FILTER (WHERE estado_parseo & 1 <> 0),
+           COUNT(*) FILTER (WHERE estado_parseo & 2 <> 0),
+           COUNT(*) FILTER (WHERE estado_parseo & 4 <> 0)
+    FROM {SCHEMA_NAME}.{TABLE_NAME}
+    WHERE lote_id = %s
+"""
+
+#FUNCIÓN QUE CREA LA TABLA CRUDA EN LA BASE
+def crear_tabla_raw(tipada: bool = RAW_TIPADA):
+    """
+    Crea (o completa) la tabla cruda. Con tipada=True la tabla se crea
+    UNLOGGED, o se pasa a UNLOGGED si ya existía, y se le agregan las
+    columnas tipadas; nunca se vuelve a LOGGED sola (ALTER TABLE ... SET
+    LOGGED). Sin tipada la tabla no tiene columnas tipadas, salvo que las
+    haya recibido en una carga tipada anterior.
+    """
     try:
+        columnas_control = {**COLUMNAS_INGESTA, **(COLUMNAS_TIPADAS if tipada else {})}
         column_defs = [
             f'"{col}" {tipo}'
-            for col, tipo in CONF_TABLA.items()
+            for col, tipo in {**CONF_TABLA, **columnas_control}.items()
         ]
 
         column_defs_str = ",\n    ".join(column_defs)
 
         create_sql = f"""
-        CREATE TABLE IF NOT EXISTS {SCHEMA_NAME}.{TABLE_NAME} (
+        CREATE {"UNLOGGED " if tipada else ""}TABLE IF NOT EXISTS {SCHEMA_NAME}.{TABLE_NAME} (
             {column_defs_str}
         );
         """
 
-        cur.execute(create_sql)
-        conn.commit()
+        with conexion() as (conn, cur):
+            cur.execute(create_sql)
+
+            # Tablas creadas antes de existir el control de ingesta o la sombra tipada
+            for col, tipo in columnas_control.items():
+                cur.execute(f'ALTER TABLE {SCHEMA_NAME}.{TABLE_NAME} ADD COLUMN IF NOT EXISTS "{col}" {tipo}')
+
+            if tipada:
+                cur.execute(SQL_FUNCIONES_TIPADO)
+                if not tabla_raw_unlogged(cur):
+                    # Reescribe la tabla una vez; desde ahí las cargas no escriben WAL
+                    cur.execute(f"ALTER TABLE {SCHEMA_NAME}.{TABLE_NAME} SET UNLOGGED")
+                    print(f"Tabla {SCHEMA_NAME}.{TABLE_NAME} pasada a UNLOGGED.")
+
+            # La tabla solo crece por lotes, así que un índice BRIN basta para filtrar por lote_id
+            cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {TABLE_NAME}_lote_id_idx
+                ON {SCHEMA_NAME}.{TABLE_NAME} USING brin (lote_id);
+
+            CREATE TABLE IF NOT EXISTS {SCHEMA_NAME}.{TABLA_INGESTAS} (
+                lote_id     BIGSERIAL PRIMARY KEY,
+                archivo     TEXT NOT NULL,
+                huella      CHAR(64) NOT NULL,
+                filas       BIGINT,
+                cargado_en  TIMESTAMP NOT NULL DEFAULT now()
+            );
+
+            CREATE INDEX IF NOT EXISTS {TABLA_INGESTAS}_huella_idx
+                ON {SCHEMA_NAME}.{TABLA_INGESTAS} (huella);
+            """)
 
         print(f"Tabla {SCHEMA_NAME}.{TABLE_NAME} creada o verificada.")
 
     except Exception as e:
-        conn.rollback()
         print(f"Error al crear tabla: {e}")
         raise
-    finally:
-        db.close()
+
+def tabla_raw_unlogged(cur) -> bool:
+    cur.execute(
+        "SELECT relpersistence = 'u' FROM pg_class WHERE oid = %s::regclass",
+        (f"{SCHEMA_NAME}.{TABLE_NAME}",)
+    )
+    return cur.fetchone()[0]
+
+
+# Valores que pandas.read_csv interpreta como nulos por defecto
+VALORES_NULOS_PANDAS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+    "n/a", "nan", "null"
+}
+
+# Tamaño de los bloques que se envían al servidor durante el COPY
+TAMANO_BLOQUE_COPY = 1024 * 1024
+
+
+#CLASE AUXILIAR: ENTREGA EL ARCHIVO A COPY POR BLOQUES, UNIFICANDO SALTOS DE LÍNEA Y NULOS
+class LectorCSVLineas:
+    """
+    Envuelve un archivo CSV abierto en modo binario y lo entrega a COPY
+    bloque por bloque, siempre cortado al final de una línea.
+
+    El CSV de origen termina cada línea en \\r\\r\\n, que pandas leía como
+    una línea en blanco extra y que COPY rechaza. Aquí cualquier secuencia
+    de \\r/\\n fuera de comillas se reduce a un solo \\n, lo que además
+    descarta las líneas en blanco (igual que pandas). Los saltos de línea
+    dentro de un campo entre comillas se conservan.
+
+    Con normalizar_nulos=True los campos que pandas.read_csv consideraría
+    nulos ("NA", "null", "NaN", ..., con o sin comillas) se entregan vacíos,
+    y COPY los carga como NULL.
+    """
+
+    _SALTOS = re.compile(rb"[\r\n]+")
+    # Un valor nulo entre separadores; el separador de adelante se captura y se conserva
+    _NULOS = re.compile(
+        rb"([,\n])(?:"
+        + rb"|".join(re.escape(valor.encode()) for valor in sorted(VALORES_NULOS_PANDAS, key=len, reverse=True) if valor)
+        + rb")(?![^,\n])"
+    )
+    _NULOS_BYTES = {valor.encode() for valor in VALORES_NULOS_PANDAS}
+
+    def __init__(self, archivo, normalizar_nulos=True):
+        self._archivo = archivo
+        self._normalizar_nulos = normalizar_nulos
+        self._resto = b""
+        self._tras_salto = True
+
+    def read(self, size=-1):
+        while True:
+            bloque = self._archivo.read(size)
+            datos, self._resto = self._resto + bloque, b""
+            if not datos:
+                return b""
+
+            # Separado por comillas: las partes pares quedan fuera de los campos entre comillas
+            partes = datos.split(b'"')
+            if bloque:
+                # Se entrega hasta el último salto fuera de comillas; la línea incompleta espera al bloque siguiente
+                partes, self._resto = self._cortar_en_ultima_linea(partes)
+                if not partes:
+                    continue
+
+            bloque = self._normalizar(partes)
+            # Un salto partido entre dos bloques no debe generar una línea vacía
+            if self._tras_salto:
+                bloque = bloque.lstrip(b"\n")
+            if bloque:
+                self._tras_salto = bloque.endswith(b"\n")
+                return bloque
+
+    @staticmethod
+    def _cortar_en_ultima_linea(partes):
+        for i in range(len(partes) - 1 - (len(partes) - 1) % 2, -1, -2):
+            fin = max(partes[i].rfind(b"\n"), partes[i].rfind(b"\r")) + 1
+            if fin:
+                resto = b'"'.join([partes[i][fin:]] + partes[i + 1:])
+                return partes[:i] + [partes[i][:fin]], resto
+        return [], b'"'.join(partes)
+
+    def _normalizar(self, partes):
+        for i in range(0, len(partes), 2):
+            partes[i] = self._SALTOS.sub(b"\n", partes[i])
+            if self._normalizar_nulos:
+                # El bloque empieza al inicio de una línea: su primer campo va precedido de un \n implícito
+                partes[i] = self._NULOS.sub(rb"\1", b"\n" + partes[i] if i == 0 else partes[i])
+                if i == 0:
+                    partes[0] = partes[0][1:]
+
+        if self._normalizar_nulos:
+            # Un campo entre comillas que es todo un valor nulo queda como "" (NULL por FORCE_NULL)
+            for i in range(1, len(partes) - 1, 2):
+                if partes[i] in self._NULOS_BYTES and self._campo_completo(partes, i):
+                    partes[i] = b""
+
+        return b'"'.join(partes)
+
+    @staticmethod
+    def _campo_completo(partes, i):
+        antes, despues = partes[i - 1], partes[i + 1]
+        empieza = antes.endswith((b",", b"\n")) or (i == 1 and not antes)
+        termina = despues.startswith((b",", b"\n")) or (i + 2 == len(partes) and not despues)
+        return empieza and termina
+
+
+#FUNCIÓN QUE CALCULA LA HUELLA (SHA-256) DEL ARCHIVO, LEYÉNDOLO POR BLOQUES
+def huella_archivo(ruta: str) -> str:
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE_COPY), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
 
 #FUNCIÓN QUE SUBE LOS DATOS DEL CSV A LA TABLA, USANDO COPY
-def load_csv_with_copy(db: DatabaseConnection, csv_path: str):
+@instrumentar()
+def load_csv_with_copy(csv_path: str, normalizar_nulos: bool = True, forzar: bool = False,
+                       tipada: bool = RAW_TIPADA):
+    """
+    Envía el CSV directamente a la tabla cruda con COPY FROM STDIN.
+
+    El archivo se transmite por bloques de TAMANO_BLOQUE_COPY, sin cargarlo en
+    pandas ni escribir archivos temporales, por lo que la memoria usada es
+    constante. El número de filas cargadas se toma del resultado del COPY.
+
+    Con normalizar_nulos=True (por defecto) los valores que pandas trata como
+    nulos ("NA", "null", "NaN", ...) se cargan como NULL, igual que con la
+    antigua lectura vía pandas.read_csv; con False se cargan como texto. Los
+    campos vacíos, con o sin comillas, siempre se cargan como NULL.
+
+    Cada carga se registra como un lote en data_raw.ingestas y sus filas
+    quedan marcadas con ese lote_id; así etl.py puede procesar solo los
+    lotes nuevos. Si el mismo archivo (misma huella SHA-256) ya fue cargado,
+    no se vuelve a cargar, salvo que forzar sea True.
+
+    Con tipada=True (CARGA_RAW_TIPADA=1) la tabla cruda es UNLOGGED: el COPY
+    va a una tabla temporal y desde ahí las filas se agregan a la tabla
+    cruda con amount y las fechas convertidas por la base, cuando no hay
+    ambigüedad, y su estado_parseo. Ninguna de las dos escribe WAL. Como
+    PostgreSQL vacía las tablas UNLOGGED tras una caída, un archivo ya
+    registrado cuyo lote no tiene filas se vuelve a cargar en el mismo lote.
+
+    Retorna el número de filas cargadas (0 si el archivo ya estaba cargado).
+    """
 
     if not os.path.exists(csv_path):
         raise FileNotFoundError(f"No se encuentra el archivo: {csv_path}")
 
     # Crear tabla
-    crear_tabla_raw(db)
+    crear_tabla_raw(tipada)
 
-    df = pd.read_csv(
-        csv_path,
-        dtype=str,
-    )
-
-    temp_csv = "temp_load.csv"
-    df.to_csv(temp_csv, index=False, encoding='utf-8', sep=',', na_rep='')
+    columnas = ", ".join(f'"{col}"' for col in CONF_TABLA)
+    huella = huella_archivo(csv_path)
 
-    conn, cur = db.connect()
     try:
-        with open(temp_csv, 'r', encoding='utf-8') as f:
-            copy_sql = f"""
-            COPY {SCHEMA_NAME}.{TABLE_NAME}
-            FROM STDIN
-            WITH (
-                FORMAT CSV,
-                HEADER TRUE,
-                DELIMITER ',',
-                NULL ''
-            );
-            """
-            cur.copy_expert(copy_sql, f)
+        with conexion() as (conn, cur):
+            cur.execute(SQL_BLOQUEO_INGESTA)
+            cur.execute(
+                f"SELECT lote_id FROM {SCHEMA_NAME}.{TABLA_INGESTAS} WHERE huella = %s",
+                (huella,)
+            )
+            previo = cur.fetchone()
+            perdido = previo is not None and not forzar and lote_perdido(cur, previo[0])
+            if previo and not forzar and not perdido:
+                print(f"El archivo ya fue cargado en el lote {previo[0]}; no se vuelve a cargar.")
+                return 0
+
+            if perdido:
+                lote_id = previo[0]
+                print(f"El lote {lote_id} no tiene filas (la tabla UNLOGGED se vació tras una caída); "
+                      "se vuelve a cargar.")
+            else:
+                # Lote nuevo; las filas del COPY toman su lote_id del parámetro de sesión
+                cur.execute(
+                    f"INSERT INTO {SCHEMA_NAME}.{TABLA_INGESTAS} (archivo, huella) VALUES (%s, %s) RETURNING lote_id",
+                    (os.path.basename(csv_path), huella)
+                )
+                lote_id = cur.fetchone()[0]
+            cur.execute("SELECT set_config('etl.lote_id', %s, true)", (str(lote_id),))
 
-        conn.commit()
-        print(f"Datos cargados exitosamente en {SCHEMA_NAME}.{TABLE_NAME}")
-        print(f"Filas insertadas ≈ {len(df):,}")
+            destino = f"{SCHEMA_NAME}.{TABLE_NAME}"
+            if tipada:
+                destino = TABLA_STAGING_RAW
+                cur.execute(SQL_STAGING_RAW.format(
+                    tabla=TABLA_STAGING_RAW,
+                    columnas=",\n        ".join(f'"{col}" {tipo}' for col, tipo in CONF_TABLA.items())
+                ))
+
+            with open(csv_path, 'rb') as f:
+                origen = LectorCSVLineas(f, normalizar_nulos)
+                copy_sql = f"""
+                COPY {destino} ({columnas})
+                FROM STDIN
+                WITH (
+                    FORMAT CSV,
+                    HEADER TRUE,
+                    DELIMITER ',',
+                    NULL '',
+                    FORCE_NULL ({columnas})
+                );
+                """
+                cur.copy_expert(copy_sql, origen, size=TAMANO_BLOQUE_COPY)
+                filas = cur.rowcount
+                anotar(bytes_copy=os.path.getsize(csv_path), filas_salida=filas, lote_id=lote_id)
+
+            if tipada:
+                cur.execute(SQL_AGREGAR_TIPADAS.format(columnas=columnas))
+                filas = cur.rowcount
+                cur.execute(SQL_SIN_TIPAR, (lote_id,))
+                sin_amount, sin_created_at, sin_paid_at = cur.fetchone()
+                anotar(sin_tipar={"amount": sin_amount, "created_at": sin_created_at, "paid_at": sin_paid_at})
+                if sin_amount or sin_created_at or sin_paid_at:
+                    print(f"Valores que quedaron solo en texto: amount {sin_amount:,}, "
+                          f"created_at {sin_created_at:,}, paid_at {sin_paid_at:,}")
+
+            cur.execute(
+                f"UPDATE {SCHEMA_NAME}.{TABLA_INGESTAS} SET filas = %s WHERE lote_id = %s",
+                (filas, lote_id)
+            )
+
+        print(f"Datos cargados exitosamente en {SCHEMA_NAME}.{TABLE_NAME} (lote {lote_id})")
+        print(f"Filas insertadas: {filas:,}")
+
+        return filas
 
     except Exception as e:
-        conn.rollback()
         print(f"Error durante COPY: {e}")
         raise
-    finally:
-        db.close()
-        if os.path.exists(temp_csv):
-            os.remove(temp_csv)
 
 
-def main():
-    db = DatabaseConnection()
-    conn, cur = db.connect()
+def lote_perdido(cur, lote_id) -> bool:
+    """True si la tabla cruda es UNLOGGED y no le quedan filas del lote."""
+    if not tabla_raw_unlogged(cur):
+        return False
+    cur.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {SCHEMA_NAME}.{TABLE_NAME} WHERE lote_id = %s)", (lote_id,))
+    return cur.fetchone()[0]
 
 
+def main():
     try:
-        load_csv_with_copy(db, RAW_DATA_PATH)
+        load_csv_with_copy(RAW_DATA_PATH, forzar=os.getenv("CARGA_FORZAR", "0") == "1")
     except Exception as e:
         print(f"Error en el proceso principal: {e}")
 
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
\ No newline at end of file
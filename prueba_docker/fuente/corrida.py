@@ -0,0 +1,460 @@
+# fuente/corrida.py
+"""
+Punto de entrada único del ETL, con checkpoints para reanudar una corrida:
+
+    python -m fuente correr                          # carga_raw, transformar y cargar
+    python -m fuente correr --etapas transformar,cargar --tamano-chunk 100000
+    python -m fuente correr --simular                # qué se correría, sin tocar la base
+    python -m fuente estado                          # corridas y sus checkpoints
+
+(desde prueba_docker/; también `python fuente/corrida.py ...`)
+
+Etapas, en orden:
+
+    carga_raw    CSV → data_raw (carga_data.load_csv_with_copy)
+    transformar  catálogo de compañías → dbo.companies, y charges transformados
+                 y validados (con sus alertas) → archivo Arrow de la corrida
+    cargar       charges de transformar → dbo.charges, y avanza la marca de agua
+
+Al terminar cada etapa se escribe un checkpoint en
+data/checkpoints/<corrida>/estado.json. Si una corrida falla, la siguiente
+invocación con las mismas etapas y opciones la retoma desde la primera
+etapa sin terminar; --desde-cero empieza una corrida nueva y --corrida
+retoma una en particular.
+
+Con --tamano-chunk, transformar solo carga el catálogo y cargar recorre
+la tabla cruda por chunks (transformar → limpiar → load_charges), con un
+checkpoint por chunk: al reanudar, la lectura sigue después de la última
+fila del último chunk cargado, y las versiones de los id ya cargados (ver
+etl.VersionesCharges) se recuperan de su bitácora.
+
+Con --motor arrow, transformar lee y valida con pyarrow en lugar de pandas
+(ver etl.limpiar_en_memoria) y cargar arma el CSV de COPY con pyarrow.
+
+Este módulo solo importa la biblioteca estándar; pandas, psycopg2 y el
+ETL se importan al correr una etapa, así que --help, --simular y estado
+responden al instante. El pipeline y la transacción única de etl.py no se
+usan aquí: un checkpoint solo tiene sentido si lo anterior ya se confirmó.
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import closing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORIO_CHECKPOINTS = os.getenv("ETL_CHECKPOINTS_DIR", os.path.join(BASE_DIR, "data", "checkpoints"))
+
+ETAPAS = ["carga_raw", "transformar", "cargar"]
+
+ARCHIVO_ESTADO = "estado.json"
+ARCHIVO_BLOQUEO = ".bloqueo"
+
+# Entrada de cache_columnar, dentro del directorio de la corrida, con la salida de transformar
+SALIDA_TRANSFORMAR = "charges"
+
+# Versiones de los id cargados en modo por chunks (etl.VersionesCharges)
+BITACORA_VERSIONES = "versiones_charges.bin"
+
+
+class ErrorEtapa(Exception):
+    pass
+
+
+#FUNCIONES DE LOS CHECKPOINTS
+def ruta_corrida(corrida):
+    return os.path.join(DIRECTORIO_CHECKPOINTS, corrida)
+
+
+def ahora():
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def guardar_estado(estado):
+    """Escribe el estado.json de la corrida de forma atómica."""
+    estado["actualizada"] = ahora()
+    ruta = ruta_corrida(estado["corrida"])
+    os.makedirs(ruta, exist_ok=True)
+
+    descriptor, temporal = tempfile.mkstemp(prefix=".estado_", dir=ruta)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, os.path.join(ruta, ARCHIVO_ESTADO))
+
+
+def leer_estado(corrida):
+    try:
+        with open(os.path.join(ruta_corrida(corrida), ARCHIVO_ESTADO), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def listar_corridas():
+    """Ids de las corridas con checkpoint, de la más antigua a la más reciente."""
+    if not os.path.isdir(DIRECTORIO_CHECKPOINTS):
+        return []
+    return sorted(
+        nombre for nombre in os.listdir(DIRECTORIO_CHECKPOINTS)
+        if not nombre.startswith(".") and os.path.isfile(os.path.join(ruta_corrida(nombre), ARCHIVO_ESTADO))
+    )
+
+
+def corrida_pendiente(etapas, opciones):
+    """La corrida sin terminar más reciente, si tiene las mismas etapas y opciones."""
+    for corrida in reversed(listar_corridas()):
+        estado = leer_estado(corrida)
+        if estado is None or estado["estado"] in ("completa", "abandonada"):
+            continue
+        if estado["etapas"] == etapas and estado["opciones"] == opciones:
+            return estado
+        return None
+    return None
+
+
+def nueva_corrida(etapas, opciones):
+    return {
+        "corrida": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}",
+        "creada": ahora(),
+        "estado": "nueva",
+        "etapas": etapas,
+        "opciones": opciones,
+        "completadas": {},
+    }
+
+
+def bloquear():
+    """
+    Impide dos corridas a la vez (retomarían el mismo checkpoint). El
+    bloqueo se libera solo al terminar el proceso.
+    """
+    os.makedirs(DIRECTORIO_CHECKPOINTS, exist_ok=True)
+    archivo = open(os.path.join(DIRECTORIO_CHECKPOINTS, ARCHIVO_BLOQUEO), "w")
+    try:
+        fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        archivo.close()
+        raise ErrorEtapa("Ya hay una corrida en curso")
+    return archivo
+
+
+def limpiar_salidas(estado):
+    # Los checkpoints intermedios pueden ser grandes; de una corrida completa solo queda estado.json
+    ruta = ruta_corrida(estado["corrida"])
+    shutil.rmtree(os.path.join(ruta, SALIDA_TRANSFORMAR), ignore_errors=True)
+    if os.path.exists(os.path.join(ruta, BITACORA_VERSIONES)):
+        os.remove(os.path.join(ruta, BITACORA_VERSIONES))
+
+
+#FUNCIONES DE CADA ETAPA
+def etapa_carga_raw(estado):
+    import carga_data
+
+    opciones = estado["opciones"]
+    filas = carga_data.load_csv_with_copy(opciones["archivo"] or carga_data.RAW_DATA_PATH,
+                                          forzar=opciones["forzar"])
+    return {"filas": filas}
+
+
+def etapa_transformar(estado):
+    import etl
+    from utils import cache_columnar
+
+    opciones = estado["opciones"]
+    etl.preparar_esquema()
+
+    # El rango y la marca quedan fijos para el resto de la corrida
+    desde_lote, hasta_lote = etl.rango_lotes_pendientes(opciones["reconstruir"])
+    estado["rango"] = [desde_lote, hasta_lote]
+    estado["marca"] = etl.leer_marca()
+
+    if desde_lote is not None and desde_lote == hasta_lote:
+        print("No hay lotes nuevos en data_raw; nada que procesar.")
+        return {"sin_lotes_nuevos": True}
+
+    if opciones["tamano_chunk"]:
+        # Los charges se transforman chunk por chunk en cargar
+        if etl.cargar_catalogo(desde_lote, hasta_lote) is None:
+            raise ErrorEtapa("Falló la carga del catálogo de compañías")
+        return {}
+
+    df_charges = etl.limpiar_en_memoria(desde_lote, hasta_lote, opciones["catalogo_en_sql"],
+                                        motor=opciones.get("motor", "pandas"))
+    if df_charges is None:
+        raise ErrorEtapa("Falló la carga del catálogo de compañías")
+
+    if not cache_columnar.guardar(SALIDA_TRANSFORMAR, {"charges": df_charges},
+                                  directorio=ruta_corrida(estado["corrida"])):
+        raise ErrorEtapa("No se pudo guardar el checkpoint de transformar")
+
+    return {"filas": len(df_charges)}
+
+
+def etapa_cargar(estado):
+    import etl
+    from utils import cache_columnar
+
+    if estado["completadas"]["transformar"].get("sin_lotes_nuevos"):
+        return {"sin_lotes_nuevos": True}
+
+    # Si otra corrida avanzó la marca desde transformar, estos datos ya no son los pendientes
+    if etl.leer_marca() != estado["marca"]:
+        raise ErrorEtapa("La marca de agua cambió desde la etapa transformar (¿otra corrida del ETL?); "
+                         "empezar de nuevo con --desde-cero")
+
+    etl.preparar_esquema()
+    if estado["opciones"]["tamano_chunk"]:
+        info = cargar_por_chunks(estado)
+    else:
+        frames = cache_columnar.leer(SALIDA_TRANSFORMAR, directorio=ruta_corrida(estado["corrida"]))
+        if frames is None:
+            raise ErrorEtapa("No se encontró la salida de la etapa transformar")
+        if etl.load_charges(frames["charges"], motor=estado["opciones"].get("motor", "pandas")) is None:
+            raise ErrorEtapa("Falló la carga de charges")
+        info = {"filas": len(frames["charges"])}
+
+    etl.guardar_marca(estado["rango"][1])
+    return info
+
+
+def filenode_raw():
+    # Cambia si la tabla cruda se reescribe (VACUUM FULL, CLUSTER) y las filas cambian de ctid
+    import etl
+
+    with etl.conexion() as (conn, cursor):
+        cursor.execute("SELECT pg_relation_filenode('data_raw.data_prueba_tecnica_raw')")
+        return cursor.fetchone()[0]
+
+
+def cargar_por_chunks(estado):
+    """
+    Transforma, valida y carga la tabla cruda por chunks, como
+    etl.main_por_chunks, con un checkpoint después de cada chunk cargado.
+    """
+    import etl
+    from utils import metricas
+
+    ruta_bitacora = os.path.join(ruta_corrida(estado["corrida"]), BITACORA_VERSIONES)
+    chunks = estado.setdefault("chunks", {"completados": 0, "ultimo_ctid": None, "filas": 0, "bitacora": 0})
+
+    filenode = filenode_raw()
+    if chunks.get("filenode") not in (None, filenode):
+        print("La tabla cruda se reescribió desde el último checkpoint; se vuelve a leer desde el principio.")
+        chunks.update(completados=0, ultimo_ctid=None, filas=0, bitacora=0)
+    chunks["filenode"] = filenode
+
+    # Lo que el chunk fallido alcanzó a anotar en la bitácora no llegó a cargarse
+    if os.path.exists(ruta_bitacora):
+        os.truncate(ruta_bitacora, chunks["bitacora"])
+
+    if chunks["completados"]:
+        print(f"Retomando después del chunk {chunks['completados']} ({chunks['filas']:,} filas ya cargadas)")
+
+    desde_lote, hasta_lote = estado["rango"]
+    catalogo = etl.obtener_indice_empresas()
+    versiones = etl.VersionesCharges.desde_bitacora(ruta_bitacora)
+
+    lector = etl.iterar_raw_chunks(estado["opciones"]["tamano_chunk"], desde_lote, hasta_lote,
+                                   posiciones=True, desde_ctid=chunks["ultimo_ctid"])
+    with closing(lector):
+        for chunk in lector:
+            numero = chunks["completados"] + 1
+            with metricas.etapa("chunk", filas_entrada=len(chunk), chunk=numero):
+                df_charges = etl.transformar_y_limpiar(chunk, catalogo, versiones=versiones)
+                if etl.load_charges(df_charges, motor=estado["opciones"].get("motor", "pandas")) is None:
+                    raise ErrorEtapa(f"Falló la carga del chunk {numero}")
+
+            chunks.update(completados=numero, ultimo_ctid=chunk.attrs["ultimo_ctid"],
+                          filas=chunks["filas"] + len(chunk),
+                          bitacora=os.path.getsize(ruta_bitacora) if os.path.exists(ruta_bitacora) else 0)
+            guardar_estado(estado)
+
+    return {"chunks": chunks["completados"], "filas": chunks["filas"]}
+
+
+FUNCIONES_ETAPAS = {
+    "carga_raw": etapa_carga_raw,
+    "transformar": etapa_transformar,
+    "cargar": etapa_cargar,
+}
+
+
+#FUNCIONES DE LOS COMANDOS
+def describir(estado):
+    print(f"Corrida {estado['corrida']} ({estado['estado']}, creada {estado['creada']})")
+    opciones = ", ".join(f"{clave}={valor}" for clave, valor in estado["opciones"].items())
+    print(f"   Opciones: {opciones}")
+    for etapa in estado["etapas"]:
+        hecha = estado["completadas"].get(etapa)
+        if hecha is not None:
+            detalle = ", ".join(f"{clave}={valor}" for clave, valor in hecha.items() if clave != "fin")
+            print(f"   {etapa:<12} completada {hecha['fin']}  {detalle}")
+        elif etapa == "cargar" and estado.get("chunks", {}).get("completados"):
+            chunks = estado["chunks"]
+            print(f"   {etapa:<12} a medias: {chunks['completados']} chunks, {chunks['filas']:,} filas")
+        else:
+            print(f"   {etapa:<12} pendiente")
+    if estado.get("error"):
+        print(f"   Último error: {estado['error']}")
+
+
+def leer_etapas(texto):
+    etapas = [etapa.strip() for etapa in texto.split(",") if etapa.strip()]
+    desconocidas = [etapa for etapa in etapas if etapa not in ETAPAS]
+    if desconocidas:
+        raise argparse.ArgumentTypeError(f"etapas desconocidas: {', '.join(desconocidas)} "
+                                         f"(válidas: {', '.join(ETAPAS)})")
+    return [etapa for etapa in ETAPAS if etapa in etapas]
+
+
+def correr(args):
+    etapas = args.etapas
+    if "cargar" in etapas and "transformar" not in etapas:
+        print("La etapa cargar necesita la salida de transformar en la misma corrida.")
+        return 2
+
+    opciones = {
+        "archivo": args.archivo,
+        "forzar": args.forzar,
+        "reconstruir": args.reconstruir,
+        "tamano_chunk": args.tamano_chunk,
+        "catalogo_en_sql": args.catalogo_en_sql,
+        "motor": args.motor,
+    }
+
+    if args.corrida:
+        estado = leer_estado(args.corrida)
+        if estado is None or estado["estado"] == "completa":
+            print(f"No hay una corrida sin terminar con id {args.corrida}")
+            return 2
+    else:
+        estado = None if args.desde_cero else corrida_pendiente(etapas, opciones)
+        if estado is None:
+            estado = nueva_corrida(etapas, opciones)
+
+    describir(estado)
+    if args.simular:
+        return 0
+
+    try:
+        bloqueo = bloquear()
+    except ErrorEtapa as e:
+        print(e)
+        return 1
+
+    # Con --desde-cero la corrida anterior sin terminar ya no se retoma
+    if args.desde_cero:
+        anterior = corrida_pendiente(etapas, opciones)
+        if anterior is not None:
+            anterior["estado"] = "abandonada"
+            guardar_estado(anterior)
+            limpiar_salidas(anterior)
+
+    from utils import metricas
+
+    estado["estado"] = "en_curso"
+    estado.pop("error", None)
+    guardar_estado(estado)
+
+    try:
+        for etapa in estado["etapas"]:
+            if etapa in estado["completadas"]:
+                print(f"→ Etapa {etapa}: ya completada, se omite")
+                continue
+
+            print(f"→ Etapa {etapa}")
+            inicio = time.perf_counter()
+            with metricas.etapa(f"corrida_{etapa}", corrida=estado["corrida"]):
+                info = FUNCIONES_ETAPAS[etapa](estado)
+            estado["completadas"][etapa] = {"fin": ahora(), "segundos": round(time.perf_counter() - inicio, 3),
+                                            **info}
+            guardar_estado(estado)
+
+    except BaseException as e:
+        estado["estado"] = "fallida"
+        estado["error"] = f"{type(e).__name__}: {e}"
+        guardar_estado(estado)
+        print(f"Corrida {estado['corrida']} detenida en un checkpoint: {estado['error']}")
+        print("   Volver a correr el mismo comando para retomarla.")
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        return 1
+
+    finally:
+        if "etl" in sys.modules:
+            sys.modules["etl"].cerrar_ejecutor()
+        bloqueo.close()
+
+    estado["estado"] = "completa"
+    guardar_estado(estado)
+    limpiar_salidas(estado)
+    print(f"Corrida {estado['corrida']} completa")
+    return 0
+
+
+def mostrar_estado(args):
+    if args.corrida:
+        estado = leer_estado(args.corrida)
+        if estado is None:
+            print(f"No existe la corrida {args.corrida}")
+            return 2
+        describir(estado)
+        return 0
+
+    corridas = listar_corridas()[-args.ultimas:]
+    if not corridas:
+        print(f"No hay corridas en {DIRECTORIO_CHECKPOINTS}")
+    for corrida in corridas:
+        estado = leer_estado(corrida)
+        if estado is not None:
+            describir(estado)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m fuente",
+                                     description="ETL de charges por etapas, con checkpoints para reanudar")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p_correr = comandos.add_parser("correr", help="corre (o retoma) las etapas del ETL")
+    p_correr.add_argument("--etapas", type=leer_etapas, default=list(ETAPAS),
+                          help=f"etapas separadas por coma, de entre {','.join(ETAPAS)} (por defecto, todas)")
+    p_correr.add_argument("--tamano-chunk", type=int, default=int(os.getenv("ETL_TAMANO_CHUNK", "0")),
+                          help="procesar la tabla cruda por chunks de este tamaño, con un checkpoint por chunk")
+    p_correr.add_argument("--archivo", help="CSV para carga_raw (por defecto, data/raw/data_prueba_tecnica.csv)")
+    p_correr.add_argument("--forzar", action="store_true", default=os.getenv("CARGA_FORZAR", "0") == "1",
+                          help="cargar el CSV aunque ya se haya cargado")
+    p_correr.add_argument("--reconstruir", action="store_true", default=os.getenv("ETL_RECONSTRUIR", "0") == "1",
+                          help="reprocesar toda la tabla cruda, no solo los lotes nuevos")
+    p_correr.add_argument("--catalogo-en-sql", action="store_true",
+                          help="calcular el catálogo de compañías con una agregación en PostgreSQL")
+    p_correr.add_argument("--motor", choices=["pandas", "arrow"], default=os.getenv("ETL_MOTOR", "pandas"),
+                          help="motor de transformación del modo en memoria")
+    p_correr.add_argument("--desde-cero", action="store_true",
+                          help="no retomar la corrida sin terminar; empezar una nueva")
+    p_correr.add_argument("--corrida", help="id de la corrida a retomar")
+    p_correr.add_argument("--simular", action="store_true",
+                          help="mostrar qué se correría y desde dónde, sin correr nada")
+    p_correr.set_defaults(funcion=correr)
+
+    p_estado = comandos.add_parser("estado", help="muestra las corridas y sus checkpoints")
+    p_estado.add_argument("--corrida", help="id de una corrida")
+    p_estado.add_argument("--ultimas", type=int, default=5, help="cuántas corridas mostrar")
+    p_estado.set_defaults(funcion=mostrar_estado)
+
+    args = parser.parse_args(argv)
+
+    # Igual que al correr fuente/etl.py: los módulos del ETL se importan desde fuente/
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    return args.funcion(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,71 @@
 # fuente/etl.py
+import hashlib
+import io
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import multiprocessing
+import queue
 import re
+import sys
+import threading
+import time
 import unicodedata
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import closing, nullcontext
+from functools import lru_cache
 
-from utils.db_config import DatabaseConnection
+from utils import cache_columnar, indice_empresas, metricas
+from utils.metricas import anotar, depurar, etapa, instrumentar, sumar
+from utils.particiones_charges import (asegurar_particiones, fusionar_charges, hora_local, meses_charges,
+                                       particionar_charges)
+from utils.db_config import DB_HOST, DB_NAME, DB_PORT, conexion, transaccion_unica, transaccion_unica_activa
+
+# Filas por bloque en el modo por chunks; 0 procesa toda la tabla en memoria
+TAMANO_CHUNK = int(os.getenv("ETL_TAMANO_CHUNK", "0"))
+
+# Si es 1, se ignora la marca de agua y se reprocesa toda la tabla cruda
+RECONSTRUIR = os.getenv("ETL_RECONSTRUIR", "0") == "1"
+
+# Si es 1, toda la corrida (catálogo, charges y marca de agua) se hace en una sola transacción
+TRANSACCION_UNICA = os.getenv("ETL_TRANSACCION_UNICA", "0") == "1"
+
+# Procesos para transformar y validar charges; con 1 todo corre en el proceso principal
+TRABAJADORES = int(os.getenv("ETL_TRABAJADORES", "1"))
+
+# Conexiones con las que se copian los charges a staging en paralelo; con 1 se usa una sola
+CONEXIONES_CARGA = int(os.getenv("ETL_CONEXIONES_CARGA", "1"))
+
+# Si es 1, la lectura, la transformación y la carga de chunks se solapan en un pipeline
+EN_PIPELINE = os.getenv("ETL_PIPELINE", "0") == "1"
+
+# Chunks que pueden esperar entre una etapa del pipeline y la siguiente
+PROFUNDIDAD_COLA = int(os.getenv("ETL_PROFUNDIDAD_COLA", "2"))
+
+# Si es 1, las corridas completas en memoria guardan y reutilizan los datos limpios en caché
+USAR_CACHE = os.getenv("ETL_CACHE", "0") == "1"
+
+# Si es 1, las filas crudas se leen con dtypes compactos (categorías, texto Arrow, float64)
+TIPOS_COMPACTOS = os.getenv("ETL_TIPOS_COMPACTOS", "0") == "1"
+
+# Similitud mínima (trigramas) para corregir un company_id con un nombre parecido; 1 = solo exacto
+UMBRAL_SIMILITUD = float(os.getenv("ETL_UMBRAL_SIMILITUD", "0.8"))
+
+# Motor del modo en memoria: "pandas" o "arrow" (ver motor_arrow.py)
+MOTOR = os.getenv("ETL_MOTOR", "pandas")
+MOTORES = ("pandas", "arrow")
+
+# Si es 1 y la tabla cruda tiene la sombra tipada, se leen los valores ya convertidos (ver QUERY_RAW_TIPADA)
+LEER_TIPADA = os.getenv("ETL_LEER_TIPADA", "0") == "1"
 
 #FUNCION AUXILIAR PARA NORMALIZAR NOMBRES
+# La caché vive mientras viva el proceso: se comparte entre chunks y corridas
+TAMANO_CACHE_NOMBRES = 100_000
+
+
+@lru_cache(maxsize=TAMANO_CACHE_NOMBRES)
 def normalizar_nombre(nombre):
     if pd.isna(nombre) or not isinstance(nombre, str):
         return ""
@@ -19,62 +79,384 @@ def normalizar_nombre(nombre):
     return nombre.strip()
 
 
-#FUNCION PARA TRAER LOS DATOS EN df
-def traer_raw_df():
-    db = DatabaseConnection()
-    conn, cursor = db.connect()
+def normalizar_nombres(serie):
+    """
+    Aplica normalizar_nombre a una columna, una sola vez por nombre distinto.
 
-    if not conn:
-        print("No se pudo establecer conexión")
-        return None
+    Los nombres distintos se obtienen con factorize. Los que son ASCII puro
+    (el caso habitual) se normalizan en bloque con el accessor .str, ya que
+    para ellos la descomposición NFD no cambia nada. El resto pasa por
+    normalizar_nombre, que está cacheada. Al final el resultado se expande
+    a todas las filas con los códigos del factorize.
+    """
+    codigos, unicos = pd.factorize(serie)
+    unicos = pd.Series(unicos, dtype=object)
+
+    es_texto = unicos.map(lambda v: isinstance(v, str)).astype(bool)
+    es_ascii = unicos.map(lambda v: isinstance(v, str) and v.isascii()).astype(bool)
+
+    normalizados = pd.Series("", index=unicos.index, dtype=object)
+    normalizados[es_ascii] = (
+        unicos[es_ascii]
+        .str.lower()
+        .str.strip()
+        .str.replace(r'[^a-z0-9\s]', '', regex=True)
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+    normalizados[es_texto & ~es_ascii] = unicos[es_texto & ~es_ascii].map(normalizar_nombre)
 
-    try:
-        query = 'SELECT * FROM "data_raw"."data_prueba_tecnica_raw"'
-        df = pd.read_sql(query, conn)
+    # Los nulos tienen código -1, que apunta a la cadena vacía agregada al final
+    valores = np.append(normalizados.to_numpy(dtype=object), "")
+    return pd.Series(valores.take(codigos), index=serie.index, name=serie.name, dtype=object)
 
-        print(f"Número de filas devueltas: {len(df)}")
 
-        df = df.rename(columns={
-            df.columns[1]: "nameCompany",
-            df.columns[2]: "idCompany",
-            df.columns[3]: "amount",
-            df.columns[4]: "status",
-            df.columns[5]: "created_at",
-            df.columns[6]: "updated_at"
-        })
+#FUNCIONES AUXILIARES PARA LIMPIAR FECHAS
+# Formatos ISO que se parsean en bloque con un formato explícito
+FORMATOS_FECHA_ISO = [
+    (r"[0-9]{4}-[0-9]{2}-[0-9]{2}", "%Y-%m-%d"),
+    (r"[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]{1,9})?", "ISO8601"),
+]
 
-        return df
 
-    finally:
-        db.close()
+@lru_cache(maxsize=100_000)
+def _fecha_inferida(valor):
+    # Formato desconocido: pandas infiere el formato valor por valor
+    return pd.to_datetime(valor, errors="coerce")
 
-#FUNCIÓN PARA TRANSFORMAR LOS TIPOS DE DATO Y RENOMBRAR
-def transformar(df):
+
+def limpiar_fechas(serie):
+    """
+    Convierte una columna de fechas en texto a datetime, de forma vectorizada.
+
+    Se trabaja sobre los valores distintos de la columna: cada uno se limpia
+    (espacios, sufijo .0 de los flotantes tipo 20190121.0) y se clasifica en
+    YYYYMMDD, fecha ISO, timestamp ISO u otro. Cada clase se parsea con una
+    sola llamada a pd.to_datetime con formato explícito; solo los valores
+    que no encajan en ninguna clase (o que fallan con el formato ISO) pasan
+    por la inferencia de pandas, cacheada entre llamadas.
+
+    El resultado es idéntico al de aplicar la limpieza celda por celda:
+    mismos valores, mismos NaT y mismo dtype.
+    """
+    codigos, unicos = pd.factorize(serie)
+
+    textos = pd.Series(unicos, dtype=object).map(str).str.strip()
+    textos = textos.where(~textos.str.endswith(".0"), textos.str[:-2])
+
+    parseadas = pd.Series(None, index=textos.index, dtype=object)
+    pendientes = pd.Series(True, index=textos.index)
+
+    # Caso YYYYMMDD (8 dígitos)
+    es_compacta = (textos.str.len() == 8) & textos.str.isdigit()
+    parseadas[es_compacta] = pd.to_datetime(textos[es_compacta], format="%Y%m%d", errors="coerce")
+    pendientes &= ~es_compacta
+
+    # Casos ISO; lo que no se pueda parsear con el formato explícito se deja a la inferencia
+    for patron, formato in FORMATOS_FECHA_ISO:
+        es_clase = pendientes & textos.str.fullmatch(patron)
+        valores = pd.to_datetime(textos[es_clase], format=formato, errors="coerce")
+        valores = valores[valores.notna()]
+        parseadas[valores.index] = valores
+        pendientes[valores.index] = False
+
+    # Caso ISO o estándar con formato a inferir
+    parseadas[pendientes] = textos[pendientes].map(_fecha_inferida)
+
+    # pandas decide el dtype sobre los valores distintos, igual que lo haría sobre la columna
+    valores = parseadas.tolist()
+    if (codigos == -1).any():
+        valores.append(None)
+    inferidas = pd.Series(valores)
+
+    if pd.api.types.is_datetime64_dtype(inferidas):
+        resultado = inferidas.array[:len(unicos)].take(codigos, allow_fill=True)
+        return pd.Series(resultado, index=serie.index, name=serie.name)
+
+    return pd.Series(
+        [valores[c] if c >= 0 else None for c in codigos],
+        index=serie.index,
+        name=serie.name,
+        dtype=object if inferidas.dtype == object else None
+    )
+
+
+def combinar_fechas_tipadas(serie, tipadas):
+    """
+    limpiar_fechas de una columna de la que QUERY_RAW_TIPADA ya entregó
+    convertidas algunas filas (tipadas: datetime64, NaT en las demás). Solo
+    se parsea el texto de las demás y el resultado es el mismo que el de
+    limpiar_fechas sobre la columna completa: mismos valores, NaT y dtype.
+    """
+    hay = tipadas.notna().to_numpy()
+    if not hay.any():
+        return limpiar_fechas(serie)
+
+    resto = limpiar_fechas(serie[~hay])
+
+    # Como en limpiar_fechas, el dtype sale de todos los valores: si el resto
+    # también es datetime sin zona (o nulo) queda datetime64; si no, object
+    if pd.api.types.is_datetime64_dtype(resto) or resto.isna().all():
+        valores = tipadas.to_numpy(copy=True)
+        valores[~hay] = resto.to_numpy(dtype="datetime64[ns]")
+        return pd.Series(valores, index=serie.index, name=serie.name)
+
+    valores = tipadas.astype(object).to_numpy()
+    valores[~hay] = resto.to_numpy(dtype=object)
+    return pd.Series(valores, index=serie.index, name=serie.name, dtype=object)
+
+
+def combinar_montos_tipados(serie, tipados):
+    # pd.to_numeric del texto, salvo en las filas que QUERY_RAW_TIPADA ya entregó como float64
+    montos = pd.to_numeric(serie, errors='coerce')
+    hay = tipados.notna()
+    if not hay.any():
+        return montos
+    return tipados.where(hay, montos.astype("float64")).rename(serie.name)
+
+
+#FUNCION PARA TRAER LOS DATOS EN df
+# Solo las columnas de texto que se transforman: psycopg2 crea un objeto de Python
+# por celda, y uno de fecha (cargado_en, las columnas tipadas) cuesta más que el texto
+QUERY_RAW = 'SELECT id, name, company_id, amount, status, created_at, paid_at FROM "data_raw"."data_prueba_tecnica_raw"'
+
+# Igual, con la posición física de cada fila (ver iterar_raw_chunks)
+QUERY_RAW_POSICIONES = 'SELECT id, name, company_id, amount, status, created_at, paid_at, ctid FROM "data_raw"."data_prueba_tecnica_raw"'
+
+# Con la sombra tipada de carga_data.py (CARGA_RAW_TIPADA=1) y ETL_LEER_TIPADA=1
+# se leen los valores que la base ya convirtió y el texto solo viaja en las filas por convertir en
+# pandas: las marcadas en estado_parseo, las cargadas sin tipar (estado_parseo
+# nulo) y las que pandas no convertiría igual:
+# - amount: se usa el tipado solo en los decimales de hasta 15 dígitos (ver
+#   PATRON_MONTO_SIMPLE), los que float8 y pd.to_numeric redondean igual. Los
+#   enteros quedan en texto porque solos darían int64, y el cero porque NUMERIC
+#   no guarda el signo de -0.0.
+# - fechas: se entregan en microsegundos desde 1970 (un entero cuesta menos que
+#   un datetime de Python) si caben en datetime64[ns]; fuera de ese rango
+#   pandas las deja en NaT.
+# Cada condición decide dos columnas, el texto y el valor tipado, así que
+# PostgreSQL la evalúa dos veces; calcularla una sola vez en un LATERAL con
+# OFFSET 0 resultó más lento. Aun así, con 200.000 filas leer y transformar
+# tarda ~1,6 s contra ~0,8 s leyendo el texto: por eso es opcional.
+_MONTO_TIPADO = (r"(r.estado_parseo & 1 = 0 AND r.amount_tipado <> 0 AND scale(r.amount_tipado) > 0"
+                 r" AND length(ltrim(r.amount, '-')) <= 16)")
+_FECHA_TIPADA = ("(r.estado_parseo & {bit} = 0"
+                 " AND r.{col}_tipado >= '1677-09-22' AND r.{col}_tipado < '2262-04-11')")
+_CREATED_AT_TIPADO = _FECHA_TIPADA.format(bit=2, col="created_at")
+_PAID_AT_TIPADO = _FECHA_TIPADA.format(bit=4, col="paid_at")
+
+
+def _columna_tipada(condicion, columna, tipado):
+    # El texto de `columna` y su valor tipado: cada uno es nulo donde se usa el otro
+    return (f"CASE WHEN {condicion} THEN NULL ELSE r.{columna} END AS {columna}",
+            f"CASE WHEN {condicion} THEN {tipado} END AS {columna}_tipado")
+
+
+_AMOUNT = _columna_tipada(_MONTO_TIPADO, "amount", "r.amount_tipado::float8")
+_CREATED_AT = _columna_tipada(_CREATED_AT_TIPADO, "created_at",
+                              "(extract(epoch FROM r.created_at_tipado) * 1000000)::bigint")
+_PAID_AT = _columna_tipada(_PAID_AT_TIPADO, "paid_at",
+                           "(extract(epoch FROM r.paid_at_tipado) * 1000000)::bigint")
+
+# Las columnas *_tipado son nulas donde viaja el texto (ver transformar)
+QUERY_RAW_TIPADA = f"""
+    SELECT r.id, r.name, r.company_id, {_AMOUNT[0]}, r.status, {_CREATED_AT[0]}, {_PAID_AT[0]},
+           {_AMOUNT[1]}, {_CREATED_AT[1]}, {_PAID_AT[1]}{{posiciones}}
+    FROM "data_raw"."data_prueba_tecnica_raw" r
+"""
+
+
+def raw_tipada(cursor):
+    """True si la tabla cruda tiene la sombra tipada de carga_data.py."""
+    cursor.execute("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'data_raw' AND table_name = 'data_prueba_tecnica_raw'
+              AND column_name = 'estado_parseo'
+        )
+    """)
+    return cursor.fetchone()[0]
+
+
+def consulta_raw(cursor, posiciones=False):
+    # QUERY_RAW (o QUERY_RAW_POSICIONES), o su versión tipada si se pidió y la tabla la admite
+    if LEER_TIPADA and raw_tipada(cursor):
+        return QUERY_RAW_TIPADA.format(posiciones=", r.ctid" if posiciones else "")
+    return QUERY_RAW_POSICIONES if posiciones else QUERY_RAW
+
+
+def filtro_lotes(desde_lote=None, hasta_lote=None):
+    """
+    Condición SQL (y sus parámetros) que selecciona las filas crudas de los
+    lotes en (desde_lote, hasta_lote]. Sin desde_lote se incluyen también las
+    filas cargadas antes de existir el control de lotes (lote_id nulo).
+    """
+    if desde_lote is not None:
+        return "lote_id > %s AND lote_id <= %s", (desde_lote, hasta_lote)
+    if hasta_lote is not None:
+        return "(lote_id IS NULL OR lote_id <= %s)", (hasta_lote,)
+    return "TRUE", ()
+
+
+def renombrar_columnas_raw(df):
     df = df.rename(columns={
-        "nameCompany": "company_name",
-        "idCompany": "company_id"
+        df.columns[1]: "nameCompany",
+        df.columns[2]: "idCompany",
+        df.columns[3]: "amount",
+        df.columns[4]: "status",
+        df.columns[5]: "created_at",
+        df.columns[6]: "updated_at"
     })
 
-    # -------- LIMPIEZA FUERTE DE FECHAS --------
-    def limpiar_fecha(valor):
-        if pd.isna(valor):
-            return None
+    # Columnas de QUERY_RAW_TIPADA: float64 y datetime64, NaN/NaT donde viaja el texto
+    if "amount_tipado" in df:
+        df = df.rename(columns={"paid_at_tipado": "updated_at_tipado"})
+        df["amount_tipado"] = pd.to_numeric(df["amount_tipado"]).astype("float64")
+        for col in ["created_at_tipado", "updated_at_tipado"]:
+            df[col] = pd.to_datetime(pd.to_numeric(df[col]), unit="us")
+
+    return df
 
-        valor = str(valor).strip()
 
-        # Quitar .0 si viene como float tipo 20190121.0
-        if valor.endswith(".0"):
-            valor = valor[:-2]
+#FUNCIONES PARA LEER LAS COLUMNAS CRUDAS CON DTYPES COMPACTOS
+# Columnas con pocos valores distintos, que se guardan como categóricas
+COLUMNAS_CATEGORICAS_RAW = ["nameCompany", "idCompany", "status", "created_at", "updated_at"]
 
-        # Caso YYYYMMDD (8 dígitos)
-        if len(valor) == 8 and valor.isdigit():
-            return pd.to_datetime(valor, format="%Y%m%d", errors="coerce")
+# Filas por bloque al leer toda la tabla con dtypes compactos
+TAMANO_BLOQUE_COMPACTO = 100_000
+
+
+def compactar_raw(df):
+    """
+    Cambia los dtypes de un DataFrame crudo (ya renombrado) por otros que
+    ocupan menos memoria, sin cambiar sus valores:
+
+    - id: texto respaldado por Arrow, un solo buffer en lugar de un objeto
+      de Python por fila.
+    - nombre, company_id, status y las fechas en texto: categóricas, cada
+      valor distinto se guarda una vez y cada fila lleva solo un código.
+    - amount: float64, con la misma conversión que aplica transformar.
+
+    transformar, la validación y las cargas conservan estos dtypes (las
+    fechas pasan a datetime64 en transformar).
+    """
+    df = df.astype({
+        "id": pd.StringDtype("pyarrow"),
+        **{col: "category" for col in COLUMNAS_CATEGORICAS_RAW},
+    })
+    df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
+    return df
 
-        # Caso ISO o estándar
-        return pd.to_datetime(valor, errors="coerce")
 
-    df["created_at"] = df["created_at"].apply(limpiar_fecha)
-    df["updated_at"] = df["updated_at"].apply(limpiar_fecha)
+def concatenar_compactos(bloques):
+    """
+    pd.concat de bloques compactados por separado. Las categóricas se
+    llevan antes a las mismas categorías; si no, concat las volvería object.
+    Modifica los bloques recibidos.
+    """
+    for col, tipo in bloques[0].dtypes.items():
+        if isinstance(tipo, pd.CategoricalDtype):
+            categorias = pd.Index(np.concatenate(
+                [bloque[col].cat.categories.to_numpy(dtype=object) for bloque in bloques]
+            )).unique()
+            for bloque in bloques:
+                bloque[col] = bloque[col].cat.set_categories(categorias)
+
+    return pd.concat(bloques, ignore_index=True)
+
+
+@instrumentar()
+def traer_raw_df(desde_lote=None, hasta_lote=None, compactos=TIPOS_COMPACTOS):
+    if compactos:
+        # Por bloques: nunca están todas las filas en memoria como objetos de Python
+        bloques = list(iterar_raw_chunks(TAMANO_BLOQUE_COMPACTO, desde_lote, hasta_lote, compactos=True))
+        if bloques:
+            df = concatenar_compactos(bloques)
+            depurar(f"Número de filas devueltas: {len(df)}")
+            return df
+
+    with conexion() as (conn, cursor):
+        condicion, params = filtro_lotes(desde_lote, hasta_lote)
+        df = pd.read_sql(f"{consulta_raw(cursor)} WHERE {condicion}", conn, params=params)
+
+    depurar(f"Número de filas devueltas: {len(df)}")
+
+    df = renombrar_columnas_raw(df)
+    return compactar_raw(df) if compactos else df
+
+
+#FUNCION PARA TRAER LOS DATOS POR BLOQUES, CON UN CURSOR DEL LADO DEL SERVIDOR
+def iterar_raw_chunks(tamano_chunk=100_000, desde_lote=None, hasta_lote=None,
+                      compactos=TIPOS_COMPACTOS, posiciones=False, desde_ctid=None):
+    """
+    Generador que lee la tabla cruda con un cursor con nombre (server-side)
+    y entrega DataFrames de hasta `tamano_chunk` filas, con las mismas
+    columnas (y dtypes) que traer_raw_df. En memoria solo vive un bloque a
+    la vez.
+
+    Con posiciones=True las filas se leen en orden físico (ctid) y cada
+    chunk lleva en attrs["ultimo_ctid"] la posición de su última fila; con
+    desde_ctid se retoma la lectura después de esa posición (ver corrida.py).
+    Las filas no cambian de posición mientras la tabla no se reescriba
+    (VACUUM FULL, CLUSTER).
+    """
+    with conexion() as (conn, auxiliar), conn.cursor(name="raw_por_chunks") as cursor:
+        cursor.itersize = tamano_chunk
+        condicion, params = filtro_lotes(desde_lote, hasta_lote)
+        consulta = f"{consulta_raw(auxiliar, posiciones)} WHERE {condicion}"
+        if posiciones:
+            # Un seq scan sincronizado puede empezar a mitad de la tabla; sin él, tanto el
+            # seq scan como el TID range scan de desde_ctid recorren la tabla en orden físico
+            auxiliar.execute("SET LOCAL synchronize_seqscans = off")
+            if desde_ctid is not None:
+                consulta += " AND ctid > %s::tid"
+                params = (*params, desde_ctid)
+        cursor.execute(consulta, params)
+
+        numero = 0
+        while True:
+            # La medición termina antes del yield: no incluye el proceso del chunk
+            with etapa("leer_chunk", chunk=numero + 1) as medicion:
+                filas = cursor.fetchmany(tamano_chunk)
+                medicion.campos["filas_salida"] = len(filas)
+                if not filas:
+                    break
+
+                numero += 1
+                columnas = [col[0] for col in cursor.description]
+                df = pd.DataFrame(filas, columns=columnas)
+
+            depurar(f"Chunk {numero}: {len(df)} filas")
+
+            ultimo_ctid = df.pop("ctid").iloc[-1] if posiciones else None
+            df = renombrar_columnas_raw(df)
+            if compactos:
+                df = compactar_raw(df)
+            if posiciones:
+                df.attrs["ultimo_ctid"] = ultimo_ctid
+            yield df
+
+#FUNCIÓN PARA TRANSFORMAR LOS TIPOS DE DATO Y RENOMBRAR
+NOMBRES_COLUMNAS = {
+    "nameCompany": "company_name",
+    "idCompany": "company_id"
+}
+
+
+@instrumentar()
+def transformar(df):
+    df = df.rename(columns=NOMBRES_COLUMNAS)
+
+    # Con QUERY_RAW_TIPADA parte de las filas ya viene convertida; solo se parsea el resto
+    if "amount_tipado" in df:
+        df["created_at"] = combinar_fechas_tipadas(df["created_at"], df.pop("created_at_tipado"))
+        df["updated_at"] = combinar_fechas_tipadas(df["updated_at"], df.pop("updated_at_tipado"))
+        df["amount"] = combinar_montos_tipados(df["amount"], df.pop("amount_tipado"))
+        return df
+
+    # -------- LIMPIEZA FUERTE DE FECHAS --------
+    df["created_at"] = limpiar_fechas(df["created_at"])
+    df["updated_at"] = limpiar_fechas(df["updated_at"])
 
     # Conversión numérica
     df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
@@ -83,6 +465,7 @@ def transformar(df):
 
 
 #FUNCION QUE LIMPIA Y ESTANDARIZA LOS NOMBRES DE COMPAÑIAS, DESDE EL DATAFRAME
+@instrumentar()
 def limpiar_nombres_empresas(df: pd.DataFrame) -> pd.DataFrame:
     """
     Parameters
@@ -106,24 +489,38 @@ def limpiar_nombres_empresas(df: pd.DataFrame) -> pd.DataFrame:
     # Mantener solo las filas donde company_id tiene 40 caracteres
     df = df[df["company_id"].str.len() == 40]
 
-    #Función auxiliar para obtener el nombre más representativo por grupo
-    def get_most_common_name(group):
-        if group["company_name"].isna().all():
-            return None
-        # Modo (el más frecuente)
-        moda = group["company_name"].mode()
-        if not moda.empty:
-            return moda.iloc[0]
-        # Si no hay moda (todos valores únicos o nulos), tomamos el primero no nulo
-        no_nulos = group["company_name"].dropna()
-        return no_nulos.iloc[0] if not no_nulos.empty else None
-
-    #Agrupamos y obtenemos un nombre por company_id
+    # Se cuenta cada par (company_id, company_name) no nulo.
+    # observed=True: con columnas categóricas solo cuentan los pares que existen
+    conteos = (
+        df.groupby(["company_id", "company_name"], observed=True, dropna=True)
+        .size()
+        .rename("n")
+        .reset_index()
+    )
+
+    return catalogo_desde_conteos(conteos, df["company_id"].unique())
+
+
+def catalogo_desde_conteos(conteos, company_ids):
+    """
+    Arma el catálogo a partir de los conteos de cada par (company_id,
+    company_name) y de todos los company_id válidos (incluidos los que solo
+    tienen nombres nulos, que quedan como 'Desconocido').
+    """
+    # Nombre más representativo por compañía: el más frecuente y, en caso de
+    # empate, el menor alfabéticamente (mismo criterio que Series.mode().iloc[0])
+    conteos = (
+        conteos
+        .astype({"company_id": object, "company_name": object})
+        .sort_values(["company_id", "n", "company_name"],
+                     ascending=[True, False, True], kind="mergesort")
+        .drop_duplicates("company_id")
+    )
+
     df_companies_clean = (
-        df.groupby("company_id", as_index=False)
-        .apply(lambda g: pd.Series({
-            "company_name": get_most_common_name(g)
-        }))
+        pd.DataFrame({"company_id": pd.Series(company_ids, dtype=object)})
+        .sort_values("company_id", kind="mergesort")
+        .merge(conteos[["company_id", "company_name"]], on="company_id", how="left")
         .reset_index(drop=True)
     )
 
@@ -132,282 +529,1654 @@ def limpiar_nombres_empresas(df: pd.DataFrame) -> pd.DataFrame:
 
     return df_companies_clean
 
-def limpiar_charges(df, df_companies):
+# Mismo catálogo que limpiar_nombres_empresas, calculado dentro de PostgreSQL
+# sobre la tabla cruda. COLLATE "C" ordena por código de carácter, como Python.
+# {filtro} restringe las filas crudas que se consideran.
+SQL_CATALOGO_EMPRESAS = """
+    WITH crudos AS (
+        SELECT company_id, name AS company_name
+        FROM data_raw.data_prueba_tecnica_raw
+        WHERE LENGTH(company_id) = 40
+          AND {filtro}
+    ),
+    conteos AS (
+        SELECT company_id, company_name, COUNT(*) AS n
+        FROM crudos
+        WHERE company_name IS NOT NULL
+        GROUP BY company_id, company_name
+    )
+    SELECT DISTINCT ON (ids.company_id COLLATE "C")
+        ids.company_id,
+        COALESCE(c.company_name, 'Desconocido') AS company_name
+    FROM (SELECT DISTINCT company_id FROM crudos) ids
+    LEFT JOIN conteos c
+        ON c.company_id = ids.company_id
+    ORDER BY ids.company_id COLLATE "C", c.n DESC NULLS LAST, c.company_name COLLATE "C"
+"""
+
+
+#FUNCION QUE CONSTRUYE EL CATÁLOGO DE COMPAÑÍAS DIRECTAMENTE EN LA BASE
+@instrumentar()
+def traer_catalogo_empresas(desde_lote=None, hasta_lote=None):
+    """
+    Construye el catálogo de compañías con una agregación en PostgreSQL,
+    sin traer las filas crudas a Python. El resultado es el mismo que
+    limpiar_nombres_empresas(transformar(traer_raw_df())).
+
+    Con desde_lote solo se incluyen las compañías que aparecen en los lotes
+    nuevos, pero su nombre se elige con toda su historia (hasta hasta_lote),
+    igual que en una corrida completa.
+    """
+    with conexion() as (conn, _):
+        historia, params = filtro_lotes(None, hasta_lote)
+        if desde_lote is not None:
+            nuevos, params_nuevos = filtro_lotes(desde_lote, hasta_lote)
+            historia += f"""
+          AND company_id IN (
+              SELECT company_id FROM data_raw.data_prueba_tecnica_raw WHERE {nuevos}
+          )"""
+            params += params_nuevos
+
+        df = pd.read_sql(SQL_CATALOGO_EMPRESAS.format(filtro=historia), conn, params=params)
+
+    print(f"Compañías en el catálogo: {len(df)}")
+    return df
+
+
+#FUNCION QUE TRAE EL CATÁLOGO YA CARGADO EN dbo.companies
+@instrumentar()
+def traer_companies_db():
+    with conexion() as (conn, _):
+        return pd.read_sql("SELECT company_id, company_name FROM dbo.companies", conn)
+
+
+#FUNCIONES DEL ÍNDICE DE NOMBRES DE COMPAÑÍAS (CORRECCIÓN DE company_id)
+# En dbo.etl_marcas, la versión de dbo.companies: el id de la última transacción que la cambió
+PROCESO_CATALOGO = "companies"
+
+SQL_VERSION_CATALOGO = """
+    WITH anterior AS (
+        SELECT ultimo_lote FROM dbo.etl_marcas WHERE proceso = %(proceso)s FOR UPDATE
+    )
+    INSERT INTO dbo.etl_marcas (proceso, ultimo_lote)
+    VALUES (%(proceso)s, txid_current())
+    ON CONFLICT (proceso) DO UPDATE
+    SET ultimo_lote = EXCLUDED.ultimo_lote,
+        actualizado_en = now()
+    RETURNING COALESCE((SELECT ultimo_lote FROM anterior), 0), ultimo_lote
+"""
+
+_indice_empresas = None
+
+
+def indexar_catalogo(df_companies):
+    """IndiceEmpresas de un DataFrame con company_id y company_name."""
+    return indice_empresas.IndiceEmpresas.construir(
+        df_companies["company_id"], normalizar_nombres(df_companies["company_name"]), UMBRAL_SIMILITUD
+    )
+
+
+def ruta_indice_empresas():
+    # Un archivo por base de datos, junto a la caché columnar
+    clave = cache_columnar.clave_cache(DB_HOST, DB_PORT, DB_NAME)
+    return os.path.join(cache_columnar.CACHE_DIR, f"indice_empresas_{clave[:16]}.pkl")
+
+
+def version_catalogo():
+    with conexion() as (conn, cursor):
+        cursor.execute("SELECT ultimo_lote FROM dbo.etl_marcas WHERE proceso = %s", (PROCESO_CATALOGO,))
+        fila = cursor.fetchone()
+    return fila[0] if fila else 0
+
+
+@instrumentar()
+def obtener_indice_empresas():
+    """
+    Índice de nombres sincronizado con dbo.companies completa.
+
+    Se reutiliza el del proceso o el guardado en disco si su versión es la
+    de la base; si no, se construye leyendo dbo.companies y se guarda. Como
+    la versión es el id de la transacción que cambió el catálogo, un cambio
+    revertido nunca coincide con un índice guardado.
+    """
+    global _indice_empresas
+
+    version = version_catalogo()
+    indice = _indice_empresas
+    if indice is None or indice.version != version:
+        indice = indice_empresas.cargar(ruta_indice_empresas(), version_codigo())
+
+    if indice is None or indice.version != version:
+        indice = indexar_catalogo(traer_companies_db())
+        indice.version = version
+        indice = indice_empresas.guardar(indice, ruta_indice_empresas(), version_codigo())
+        anotar(indice="construido")
+        print(f"Índice de compañías construido: {len(indice)} compañías")
+
+    indice.umbral = UMBRAL_SIMILITUD
+    _indice_empresas = indice
+    return indice
+
+
+def actualizar_indice_empresas(df_companies, version_anterior, version_nueva):
+    """
+    Aplica al índice guardado las compañías recién cargadas (en el mismo
+    orden que el merge, así gana la última aparición de cada id). Solo si
+    el índice estaba en la versión anterior; si no, se reconstruirá completo
+    la próxima vez que se pida.
+    """
+    global _indice_empresas
+
+    indice = _indice_empresas
+    if indice is None or indice.version != version_anterior:
+        indice = indice_empresas.cargar(ruta_indice_empresas(), version_codigo())
+    if indice is None or indice.version != version_anterior:
+        _indice_empresas = None
+        return
+
+    indice.actualizar(df_companies["company_id"], normalizar_nombres(df_companies["company_name"]))
+    indice.version = version_nueva
+    _indice_empresas = indice_empresas.guardar(indice, ruta_indice_empresas(), version_codigo())
+
+
+# ------------------------------------------------------
+# REGLAS DE VALIDACIÓN DE CHARGES
+# ------------------------------------------------------
+# Lista de status válidos
+STATUS_VALIDOS = {
+    'expired', 'paid', 'voided', 'pending_payment',
+    'partially_refunded', 'pre_authorized', 'charged_back', 'refunded'
+}
+
+MAX_DECIMAL_16_2 = 99999999999999.99
+
+# Destino de las alertas para revisión manual: "tabla" (dbo.charge_alerts), "csv" o "ambos"
+DESTINO_ALERTAS = os.getenv("ETL_ALERTAS", "tabla")
+
+# Archivo donde se acumulan las alertas con ETL_ALERTAS=csv, y sus columnas
+ARCHIVO_ALERTAS = "alertas_charges_invalidos.csv"
+COLUMNAS_ALERTAS = [
+    "id", "company_name", "company_id", "amount", "status",
+    "created_at", "updated_at", "motivo", "company_name_norm"
+]
+
+
+def company_id_valido(serie):
+    # Un company_id es válido si no es nulo y tiene 40 caracteres. Se mide
+    # cada valor distinto una sola vez: hay pocas compañías y muchas filas.
+    codigos, unicos = pd.factorize(serie)
+    validos = np.append(pd.Series(unicos, dtype=object).str.len().eq(40).to_numpy(), False)
+    return pd.Series(validos.take(codigos), index=serie.index)
+
+
+def _motivo_company_id(df):
+    return np.where(
+        df["company_id"].isna(),
+        "company_id inválido y nombre no encontrado en catálogo",
+        "company_id inválido (longitud ≠ 40)"
+    )
+
+
+def _motivo_amount(df):
+    amount = df["amount"]
+    # Solo se formatean los montos de las filas que incumplen la regla. Como objetos:
+    # si todos son nulos, map deja float64 y no se podría concatenar con el texto
+    texto = amount.map(lambda a: f"{a:,.2f}", na_action="ignore").astype(object)
+    return np.select(
+        [amount.isna(), amount > MAX_DECIMAL_16_2, amount < -MAX_DECIMAL_16_2],
+        [
+            "amount es nulo o NaN",
+            "amount excede DECIMAL(16,2) (positivo: " + texto + ")",
+            "amount excede DECIMAL(16,2) (negativo: " + texto + ")",
+        ],
+        default="amount inválido"
+    )
+
+
+def _motivo_status(df):
+    status = df["status"]
+    if isinstance(status.dtype, pd.CategoricalDtype):
+        # Los nulos leídos de la base son None; en una categórica pasan a NaN
+        status = status.astype(object).where(status.notna(), None)
+    return "status inválido o desconocido: '" + status.astype(str) + "'"
+
+
+# Reglas en orden de prioridad: si una fila incumple varias, se reporta la
+# primera. Cada regla es (código, filas que la incumplen, texto del motivo).
+# Para agregar una validación basta con agregar una entrada a la lista.
+REGLAS_CHARGES = [
+    ("id_nulo",
+     lambda df: df["id"].isna(),
+     lambda df: "ID de transacción nulo"),
+    ("company_id_invalido",
+     lambda df: ~company_id_valido(df["company_id"]),
+     _motivo_company_id),
+    ("amount_invalido",
+     lambda df: df["amount"].isna() | (df["amount"].abs() > MAX_DECIMAL_16_2),
+     _motivo_amount),
+    ("status_invalido",
+     lambda df: ~df["status"].isin(STATUS_VALIDOS),
+     _motivo_status),
+    ("created_at_nulo",
+     lambda df: df["created_at"].isna(),
+     lambda df: "created_at nulo o inválido"),
+]
+
+
+#FUNCION QUE CORRIGE company_id A PARTIR DEL NOMBRE DE LA COMPAÑÍA
+@instrumentar()
+def reparar_company_id(df, df_companies):
+    """
+    Para las filas con id de transacción y company_id dudoso (nulo o de
+    longitud ≠ 40) busca el nombre normalizado de la compañía en el índice
+    del catálogo y, si lo encuentra, reemplaza el company_id por el del
+    catálogo. La búsqueda es exacta y, si no hay coincidencia, aproximada
+    por trigramas con similitud ≥ UMBRAL_SIMILITUD (ver IndiceEmpresas).
+    Cada nombre distinto se busca una sola vez.
+
+    df_companies es el catálogo (DataFrame) o un IndiceEmpresas ya armado.
+    Si dos compañías comparten nombre normalizado se usa la de menor
+    company_id. Retorna una copia superficial de df; solo la columna
+    company_id es nueva.
+    """
+    dudosos = df["id"].notna() & ~company_id_valido(df["company_id"])
+    if not dudosos.any():
+        return df
+
+    indice = df_companies
+    if not isinstance(indice, indice_empresas.IndiceEmpresas):
+        indice = indexar_catalogo(df_companies)
+
+    posiciones = np.flatnonzero(dudosos.to_numpy())
+    codigos, nombres = pd.factorize(normalizar_nombres(df["company_name"].iloc[posiciones]))
+    resueltos = np.array(indice.resolver(nombres) + [None], dtype=object)
+    encontrados = resueltos.take(codigos)
+    mask_encontrado = pd.notna(encontrados)
+    anotar(dudosos=len(posiciones), corregidos=int(mask_encontrado.sum()))
+
+    company_id = _asignar_posiciones(df["company_id"], posiciones[mask_encontrado],
+                                     encontrados[mask_encontrado])
+
+    df = df.copy(deep=False)
+    df["company_id"] = company_id
+    return df
+
+
+def _asignar_posiciones(serie, posiciones, valores):
+    # Copia de los valores de serie con `valores` en `posiciones`. Una
+    # columna categórica sigue siéndolo: se le agregan las categorías nuevas
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        nuevas = pd.Index(pd.unique(valores)).difference(serie.cat.categories)
+        serie = serie.cat.add_categories(nuevas)
+        serie.iloc[posiciones] = valores
+        return serie.array
+
+    arreglo = serie.to_numpy(dtype=object, copy=True)
+    arreglo[posiciones] = valores
+    return arreglo
+
+
+#FUNCION QUE VALIDA LOS CHARGES EN UNA SOLA PASADA
+def validar_charges(df, df_companies):
+    """
+    Corrige company_id por nombre y evalúa todas las REGLAS_CHARGES a la vez.
+
+    Cada fila recibe el código de la primera regla que incumple (0 si no
+    incumple ninguna) y el DataFrame se parte una sola vez en válidos y
+    alertas, conservando el índice y el orden original. Los textos de
+    'motivo' solo se construyen para las filas con alerta.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, pd.DataFrame]
+        (charges válidos, alertas con columnas 'motivo', 'regla' y
+        'company_name_norm')
+    """
+    return clasificar_charges(reparar_company_id(df, df_companies))
+
+
+@instrumentar()
+def clasificar_charges(df):
+    """
+    Evalúa REGLAS_CHARGES sobre charges con company_id ya corregido y parte
+    el DataFrame en (válidos, alertas). Ver validar_charges.
+    """
+    mascaras = [condicion(df).to_numpy(dtype=bool) for _, condicion, _ in REGLAS_CHARGES]
+    return partir_charges(df, mascaras)
+
+
+def partir_charges(df, mascaras):
+    """
+    Parte df en (válidos, alertas) a partir de la máscara de filas que
+    incumplen cada regla de REGLAS_CHARGES, en el mismo orden.
+    """
+    codigos = np.select(mascaras, list(range(1, len(REGLAS_CHARGES) + 1)), default=0)
+
+    df_validos = df.take(np.flatnonzero(codigos == 0))
+    anotar_rechazos(codigos)
+
+    # Alertas ordenadas por regla y, dentro de cada regla, por orden de llegada
+    posiciones = np.flatnonzero(codigos)
+    posiciones = posiciones[np.argsort(codigos[posiciones], kind="stable")]
+    df_alertas = df.take(posiciones)
+    codigos_alerta = codigos[posiciones]
+
+    motivo = np.empty(len(df_alertas), dtype=object)
+    for numero, (_, _, redactar) in enumerate(REGLAS_CHARGES, start=1):
+        mask = codigos_alerta == numero
+        if mask.any():
+            motivo[mask] = redactar(df_alertas[mask])
+
+    nombres_reglas = np.array([codigo for codigo, _, _ in REGLAS_CHARGES])
+    df_alertas = df_alertas.assign(
+        motivo=motivo,
+        regla=pd.Categorical.from_codes(codigos_alerta - 1, categories=nombres_reglas)
+    )
+
+    # Para las filas sin compañía se deja el nombre normalizado que se buscó
+    mask_company = (df_alertas["regla"] == "company_id_invalido").to_numpy()
+    company_name_norm = pd.Series(np.nan, index=df_alertas.index, dtype=object)
+    if mask_company.any():
+        company_name_norm[mask_company] = normalizar_nombres(df_alertas.loc[mask_company, "company_name"])
+    df_alertas["company_name_norm"] = company_name_norm
+
+    return df_validos, df_alertas
+
+
+def anotar_rechazos(codigos):
+    # Filas rechazadas por cada regla, en el registro de métricas de la etapa en curso
+    if metricas.activas():
+        conteos = np.bincount(codigos, minlength=len(REGLAS_CHARGES) + 1)[1:]
+        anotar(rechazadas_por_regla={codigo: int(n) for (codigo, _, _), n in zip(REGLAS_CHARGES, conteos)})
+
+
+#FUNCION QUE REGISTRA LAS ALERTAS PARA REVISIÓN MANUAL
+@instrumentar()
+def guardar_alertas(df_alertas, archivo=ARCHIVO_ALERTAS, destino=DESTINO_ALERTAS):
+    """
+    Envía las alertas a dbo.charge_alerts (ver load_alerts), al archivo CSV
+    o a ambos, según `destino`. Se llama una vez por chunk, así las alertas
+    salen a medida que se procesan.
+    """
+    if df_alertas.empty:
+        return
+
+    if destino in ("tabla", "ambos"):
+        load_alerts(df_alertas)
+
+    if destino in ("csv", "ambos"):
+        escribir_alertas_csv(df_alertas, archivo)
+
+
+def escribir_alertas_csv(df_alertas, archivo=ARCHIVO_ALERTAS):
+    header = not pd.io.common.file_exists(archivo)
+
+    # El archivo conserva siempre las mismas columnas, en el mismo orden
+    df_alertas.reindex(columns=COLUMNAS_ALERTAS).to_csv(
+        archivo,
+        mode='a',
+        header=header,
+        index=False,
+        encoding='utf-8'
+    )
+
+    print(f"→ Alertas actualizadas en: {archivo}")
+    print(f"   Registros agregados esta vez: {len(df_alertas)}")
+
+
+#FUNCIONES PARA DEDUPLICAR CHARGES POR id
+def _nanosegundos(serie):
+    # Fecha como int64 (ns desde 1970) para comparar versiones; NaT queda como el mínimo
+    if not pd.api.types.is_datetime64_any_dtype(serie.dtype):
+        serie = pd.to_datetime(serie, errors="coerce", utc=True)
+    if getattr(serie.dtype, "tz", None) is not None:
+        serie = serie.dt.tz_convert(None)
+    return serie.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+class VersionesCharges:
+    """
+    Versión (updated_at, created_at) más reciente de cada id visto en chunks
+    anteriores, para deduplicar entre chunks sin guardar los id: solo el
+    hash de 64 bits de cada id, en arreglos de numpy ordenados por hash
+    (24 bytes por id). Dos id distintos con el mismo hash se confundirían;
+    con 10 millones de id la probabilidad es del orden de 1 en 400.000.
+
+    Con `bitacora` (una ruta) cada versión registrada se agrega también al
+    archivo, para reconstruir el estado al reanudar una corrida por chunks
+    (ver desde_bitacora).
+    """
+
+    REGISTRO = np.dtype([("hash", "<u8"), ("actualizado", "<i8"), ("creado", "<i8")])
+
+    def __init__(self, bitacora=None):
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.actualizado = np.zeros(0, dtype=np.int64)
+        self.creado = np.zeros(0, dtype=np.int64)
+        self.bitacora = bitacora
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @classmethod
+    def desde_bitacora(cls, ruta):
+        """Versiones guardadas en la bitácora `ruta`, que se sigue usando."""
+        versiones = cls(bitacora=ruta)
+        if not os.path.exists(ruta):
+            return versiones
+
+        with open(ruta, "rb") as f:
+            datos = f.read()
+        # Un registro a medias (corte durante la escritura) se descarta
+        registros = np.frombuffer(datos[:len(datos) - len(datos) % cls.REGISTRO.itemsize], dtype=cls.REGISTRO)
+
+        # La versión registrada de un id nunca baja: vale la última de cada hash
+        registros = registros[np.argsort(registros["hash"], kind="stable")]
+        ultimos = np.append(registros["hash"][1:] != registros["hash"][:-1], True)
+        registros = registros[ultimos]
+
+        versiones.hashes = registros["hash"].copy()
+        versiones.actualizado = registros["actualizado"].copy()
+        versiones.creado = registros["creado"].copy()
+        return versiones
+
+    def _anotar_bitacora(self, hashes, actualizado, creado):
+        registros = np.empty(len(hashes), dtype=self.REGISTRO)
+        registros["hash"], registros["actualizado"], registros["creado"] = hashes, actualizado, creado
+        with open(self.bitacora, "ab") as f:
+            f.write(registros.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def registrar(self, hashes, actualizado, creado):
+        """
+        Recibe los charges de un chunk, ya sin id repetidos, y retorna la
+        máscara de los que hay que cargar: los id nuevos y los que son al
+        menos tan recientes como la versión vista antes (en un empate gana
+        el chunk posterior). Guarda la versión de los que se cargan.
+        """
+        posiciones = np.searchsorted(self.hashes, hashes)
+        vistos = np.zeros(len(hashes), dtype=bool)
+        en_rango = posiciones < len(self.hashes)
+        vistos[en_rango] = self.hashes[posiciones[en_rango]] == hashes[en_rango]
+
+        previas = posiciones[vistos]
+        act, cre = actualizado[vistos], creado[vistos]
+        mas_recientes = (act > self.actualizado[previas]) | (
+            (act == self.actualizado[previas]) & (cre >= self.creado[previas])
+        )
+        self.actualizado[previas[mas_recientes]] = act[mas_recientes]
+        self.creado[previas[mas_recientes]] = cre[mas_recientes]
+
+        # Los id nuevos se intercalan en su lugar; np.insert copia los arreglos una sola vez
+        nuevos = np.flatnonzero(~vistos)
+        nuevos = nuevos[np.argsort(hashes[nuevos], kind="stable")]
+        self.hashes = np.insert(self.hashes, posiciones[nuevos], hashes[nuevos])
+        self.actualizado = np.insert(self.actualizado, posiciones[nuevos], actualizado[nuevos])
+        self.creado = np.insert(self.creado, posiciones[nuevos], creado[nuevos])
+
+        cargar = ~vistos
+        cargar[vistos] = mas_recientes
+        if self.bitacora is not None and cargar.any():
+            self._anotar_bitacora(hashes[cargar], actualizado[cargar], creado[cargar])
+        return cargar
+
+
+@instrumentar()
+def deduplicar_charges(df, versiones=None):
+    """
+    Deja una sola fila por id: la más reciente por updated_at, luego por
+    created_at y, si empatan, la última en llegar (un updated_at nulo cuenta
+    como el más antiguo). Las filas que quedan conservan su orden.
+
+    Con `versiones` (VersionesCharges, modo por chunks) también se descartan
+    las filas más antiguas que la versión de su id ya vista en un chunk
+    anterior, y se registran las que quedan.
+    """
+    if df.empty:
+        return df
+
+    codigos, unicos = pd.factorize(df["id"])
+    actualizado = _nanosegundos(df["updated_at"])
+    creado = _nanosegundos(df["created_at"])
+
+    quedan = np.arange(len(df))
+    if len(unicos) < len(df):
+        # Ordenado por id y versión (lexsort es estable: en empate, orden de llegada); gana el último de cada id
+        orden = np.lexsort((creado, actualizado, codigos))
+        codigos_ordenados = codigos[orden]
+        ultimos = np.append(codigos_ordenados[1:] != codigos_ordenados[:-1], True)
+        quedan = np.sort(orden[ultimos])
+    en_lote = len(df) - len(quedan)
+
+    en_chunks = 0
+    if versiones is not None:
+        hashes = pd.util.hash_array(np.asarray(unicos, dtype=object))[codigos[quedan]]
+        cargar = versiones.registrar(hashes, actualizado[quedan], creado[quedan])
+        en_chunks = len(quedan) - int(cargar.sum())
+        quedan = quedan[cargar]
+
+    anotar(duplicados=en_lote, duplicados_chunks_anteriores=en_chunks)
+    if en_lote or en_chunks:
+        print(f"Charges duplicados descartados: {en_lote} repetidos en el lote, "
+              f"{en_chunks} con una versión más reciente en chunks anteriores")
+
+    if len(quedan) == len(df):
+        return df
+    return df.take(quedan)
+
+
+def limpiar_charges(df, df_companies, versiones=None):
     """
     Limpia el dataframe de charges:
     - Elimina y alerta si id es nulo
     - Corrige company_id usando nombre si es posible, sino alerta y elimina
     - Elimina y alerta si amount es inválido para DECIMAL(16,2)
     - Elimina y alerta si status no está en la lista de valores válidos
-    - Genera/actualiza alertas_charges_invalidos.csv
+    - Elimina y alerta si created_at es nulo o no se pudo interpretar
+    - Registra las alertas en dbo.charge_alerts (o en alertas_charges_invalidos.csv,
+      según ETL_ALERTAS)
+    - Deja una sola fila por id, la versión más reciente (ver deduplicar_charges)
+
+    Las validaciones están declaradas en REGLAS_CHARGES y se evalúan en una
+    sola pasada (ver validar_charges).
     """
-    df = df.copy()
-    alertas = []
+    return finalizar_charges(*validar_charges(df, df_companies), versiones)
 
-    # Lista de status válidos (según los valores limpios que mencionaste)
-    STATUS_VALIDOS = {
-        'expired', 'paid', 'voided', 'pending_payment',
-        'partially_refunded', 'pre_authorized', 'charged_back', 'refunded'
-    }
 
-    # ------------------------------------------------------
-    # A. Sin ID → alerta + drop
-    # ------------------------------------------------------
-    mask_sin_id = df["id"].isna()
-    if mask_sin_id.any():
-        sin_id = df[mask_sin_id].copy()
-        sin_id["motivo"] = "ID de transacción nulo"
-        alertas.append(sin_id)
-        df = df[~mask_sin_id].copy()
+@instrumentar()
+def finalizar_charges(df, df_alertas, versiones=None):
+    """
+    Registra las alertas, imprime el resumen, deduplica por id y deja los
+    tipos listos para la carga. Recibe la salida de validar_charges.
+    """
+    if metricas.depurando():
+        invalid_status = df_alertas[df_alertas["regla"] == "status_invalido"]
+        if not invalid_status.empty:
+            print("→ Filas con status inválido detectadas y movidas a alertas:")
+            print(invalid_status["status"].value_counts())
+
+    guardar_alertas(df_alertas)
 
     # ------------------------------------------------------
-    # B. company_id inválido → intentar corregir por nombre
+    # Limpieza final
     # ------------------------------------------------------
-    mask_company_id_valido = (
-            df["company_id"].notna() &
-            (df["company_id"].astype(str).str.len() == 40)
-    )
+    print("Filas válidas:", len(df))
+
+    # Diagnóstico de depuración: en el nivel INFO ni siquiera se cuentan los nulos
+    if metricas.depurando():
+        print("Nulos en id:", df["id"].isna().sum())
+        print("Nulos en company_id:", df["company_id"].isna().sum())
+        print("Nulos en amount:", df["amount"].isna().sum())
+        print("Nulos en status:", df["status"].isna().sum())
+        print("Nulos en created_at:", df["created_at"].isna().sum())
+
+    df = deduplicar_charges(df, versiones)
+
+    df = df.copy(deep=False)
+    # Una columna categórica ya tiene solo textos; astype(str) la volvería object
+    if not isinstance(df["company_id"].dtype, pd.CategoricalDtype):
+        df["company_id"] = df["company_id"].astype(str)
+    df["amount"] = pd.to_numeric(df["amount"], errors='coerce')
 
-    df_validos = df[mask_company_id_valido].copy()
-    df_dudosos = df[~mask_company_id_valido].copy()
+    return df
 
-    if not df_dudosos.empty:
-        df_companies = df_companies.copy()
-        df_companies["company_name_norm"] = df_companies["company_name"].apply(normalizar_nombre)
 
-        df_dudosos = df_dudosos.copy()
-        df_dudosos["company_name_norm"] = df_dudosos["company_name"].apply(normalizar_nombre)
+#FUNCIONES PARA TRANSFORMAR Y VALIDAR EN PARALELO, PARTICIONANDO POR company_id
+_ejecutor = None
+_trabajadores_ejecutor = 0
 
-        df_corregidos = df_dudosos.merge(
-            df_companies[["company_id", "company_name_norm"]],
-            on="company_name_norm",
-            how="left",
-            suffixes=("", "_from_companies")
-        )
 
-        mask_encontrado = df_corregidos["company_id_from_companies"].notna()
-        df_corregidos.loc[mask_encontrado, "company_id"] = \
-            df_corregidos.loc[mask_encontrado, "company_id_from_companies"]
+def obtener_ejecutor(trabajadores, arrancar=False):
+    """
+    Pool de procesos del módulo; se reutiliza entre chunks.
 
-        df_corregidos_validos = df_corregidos[mask_encontrado].drop(
-            columns=["company_name_norm", "company_id_from_companies"]
-        )
+    Con arrancar=True los procesos se crean ya (con fork se crean todos en el
+    primer envío), en lugar de esperar al primer chunk. main_en_pipeline lo
+    usa antes de lanzar sus hilos: un fork con otros hilos corriendo copia los
+    locks que estén tomados en ese momento (métricas, pool de conexiones,
+    psycopg2) y el proceso hijo puede quedar bloqueado para siempre.
+    """
+    global _ejecutor, _trabajadores_ejecutor
 
-        df_no_corregidos = df_corregidos[~mask_encontrado].drop(
-            columns=["company_id_from_companies"]
-        )
-        df_no_corregidos["motivo"] = df_no_corregidos.apply(
-            lambda r: "company_id inválido y nombre no encontrado en catálogo"
-            if pd.isna(r["company_id"])
-            else "company_id inválido (longitud ≠ 40)",
-            axis=1
-        )
-        alertas.append(df_no_corregidos)
+    if _ejecutor is None or _trabajadores_ejecutor != trabajadores:
+        cerrar_ejecutor()
+        # Con fork los procesos heredan el módulo ya cargado, sin volver a importarlo
+        contexto = (multiprocessing.get_context("fork")
+                    if "fork" in multiprocessing.get_all_start_methods() else None)
+        _ejecutor = ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto)
+        _trabajadores_ejecutor = trabajadores
 
-        df = pd.concat([df_validos, df_corregidos_validos], ignore_index=True)
-    else:
-        df = df_validos.copy()
+    if arrancar:
+        _ejecutor.submit(int).result()
 
-    # ------------------------------------------------------
-    # C. Validación de amount para DECIMAL(16,2)
-    # ------------------------------------------------------
-    MAX_DECIMAL_16_2 = 99999999999999.99
+    return _ejecutor
 
-    mask_amount_invalido = (
-            df["amount"].isna() |
-            (df["amount"].abs() > MAX_DECIMAL_16_2)
-    )
 
-    if mask_amount_invalido.any():
-        invalid_amount = df[mask_amount_invalido].copy()
+def cerrar_ejecutor():
+    global _ejecutor, _trabajadores_ejecutor
 
-        def get_motivo_amount(row):
-            if pd.isna(row["amount"]):
-                return "amount es nulo o NaN"
-            elif row["amount"] > MAX_DECIMAL_16_2:
-                return f"amount excede DECIMAL(16,2) (positivo: {row['amount']:,.2f})"
-            elif row["amount"] < -MAX_DECIMAL_16_2:
-                return f"amount excede DECIMAL(16,2) (negativo: {row['amount']:,.2f})"
-            return "amount inválido"
+    if _ejecutor is not None:
+        _ejecutor.shutdown()
+        _ejecutor, _trabajadores_ejecutor = None, 0
 
-        invalid_amount["motivo"] = invalid_amount.apply(get_motivo_amount, axis=1)
-        alertas.append(invalid_amount)
-        df = df[~mask_amount_invalido].copy()
 
-    # ------------------------------------------------------
-    # D. Validación de status
-    # ------------------------------------------------------
-    mask_status_invalido = ~df["status"].isin(STATUS_VALIDOS)
+def _procesar_particion(df):
+    # Corre en un proceso trabajador: company_id ya viene corregido
+    df = transformar(df)
+    df_validos, df_alertas = clasificar_charges(df)
+    tipos = {col: df[col].dtype for col in df.columns}
+    nulas = {col: bool(df[col].isna().all()) for col in df.columns}
+    return df_validos, df_alertas, tipos, nulas
 
-    if mask_status_invalido.any():
-        invalid_status = df[mask_status_invalido].copy()
-        invalid_status["motivo"] = invalid_status["status"].apply(
-            lambda s: f"status inválido o desconocido: '{s}'"
-        )
-        alertas.append(invalid_status)
-        df = df[~mask_status_invalido].copy()
 
-        # Opcional: imprimir conteo rápido para depuración
-        print("→ Filas con status inválido detectadas y movidas a alertas:")
-        print(invalid_status["status"].value_counts())
+def _tipo_comun(tipos, nulas):
+    """
+    dtype que habría tenido una columna de haberse transformado el DataFrame
+    completo, a partir de los dtypes de cada partición. None si no se puede
+    saber (p. ej. fechas con zonas horarias mezcladas).
+    """
+    if len(set(tipos)) == 1:
+        return tipos[0]
 
-    # ------------------------------------------------------
-    # E. Guardar todas las alertas
-    # ------------------------------------------------------
-    if alertas:
-        df_alertas = pd.concat(alertas, ignore_index=True)
+    if all(pd.api.types.is_numeric_dtype(t) for t in tipos):
+        return np.result_type(*tipos)
 
-        if not df_alertas.empty:
-            archivo = "alertas_charges_invalidos.csv"
-            header = not pd.io.common.file_exists(archivo)
+    # Las particiones sin ningún valor no deciden el dtype (p. ej. fechas todas nulas)
+    con_valores = {t for t, nula in zip(tipos, nulas) if not nula}
+    if len(con_valores) == 1:
+        return con_valores.pop()
 
-            df_alertas.to_csv(
-                archivo,
-                mode='a',
-                header=header,
-                index=False,
-                encoding='utf-8'
-            )
+    return None
 
-            print(f"→ Alertas actualizadas en: {archivo}")
-            print(f"   Registros agregados esta vez: {len(df_alertas)}")
 
-    # ------------------------------------------------------
-    # F. Limpieza final
-    # ------------------------------------------------------
+@instrumentar()
+def validar_charges_en_paralelo(df, df_companies, trabajadores=TRABAJADORES):
+    """
+    Mismo resultado que validar_charges(transformar(df), df_companies), con
+    la transformación y las reglas repartidas en `trabajadores` procesos.
+
+    - Los company_id dudosos se corrigen primero en el proceso principal, así
+      el catálogo no se envía a los trabajadores y cada fila ya va a la
+      partición de su compañía definitiva.
+    - Las filas se reparten por hash de company_id.
+    - Los resultados se unen por posición original (válidos) y por regla y
+      posición (alertas), igual que en el camino serial; los dtypes se
+      unifican como si se hubiera transformado todo junto.
+
+    Si las particiones no coinciden en el dtype de alguna columna de forma
+    que no se pueda resolver, se recurre al camino serial.
+    """
+    df = df.rename(columns=NOMBRES_COLUMNAS)
+    indice_original = df.index
+    df = reparar_company_id(df.set_axis(pd.RangeIndex(len(df))), df_companies)
 
-    print("Antes del dropna final:", len(df))
+    particion = pd.util.hash_array(df["company_id"].to_numpy(dtype=object)) % trabajadores
+    partes = [df.take(np.flatnonzero(particion == n)) for n in range(trabajadores)]
+    partes = [parte for parte in partes if len(parte)]
 
-    print("Nulos en id:", df["id"].isna().sum())
-    print("Nulos en company_id:", df["company_id"].isna().sum())
-    print("Nulos en amount:", df["amount"].isna().sum())
-    print("Nulos en status:", df["status"].isna().sum())
-    print("Nulos en created_at:", df["created_at"].isna().sum())
+    if len(partes) <= 1:
+        df_validos, df_alertas = clasificar_charges(transformar(df))
+    else:
+        resultados = list(obtener_ejecutor(trabajadores).map(_procesar_particion, partes))
 
-    df = df.dropna(subset=["id", "company_id", "amount", "status", "created_at"])
-    df["company_id"] = df["company_id"].astype(str)
-    df["amount"] = pd.to_numeric(df["amount"], errors='coerce')
+        objetivos = {}
+        for col in resultados[0][2]:
+            objetivo = _tipo_comun([r[2][col] for r in resultados], [r[3][col] for r in resultados])
+            if objetivo is None:
+                print(f"→ Tipos distintos entre particiones en '{col}'; se valida en serie.")
+                return validar_charges(transformar(df.set_axis(indice_original)), df_companies)
+            objetivos[col] = objetivo
 
-    return df
+        def unir(frames):
+            frames = [f.astype({c: t for c, t in objetivos.items() if f[c].dtype != t}) for f in frames]
+            return pd.concat(frames)
+
+        df_validos = unir([r[0] for r in resultados])
+        df_validos = df_validos.take(np.argsort(df_validos.index.to_numpy(), kind="stable"))
+
+        df_alertas = unir([r[1] for r in resultados])
+        orden = np.lexsort((df_alertas.index.to_numpy(), df_alertas["regla"].cat.codes.to_numpy()))
+        df_alertas = df_alertas.take(orden)
+        anotar_rechazos(df_alertas["regla"].cat.codes.to_numpy() + 1)
+
+    df_validos.index = indice_original.take(df_validos.index.to_numpy())
+    df_alertas.index = indice_original.take(df_alertas.index.to_numpy())
+    return df_validos, df_alertas
+
+
+@instrumentar()
+def transformar_y_limpiar(df, df_companies, trabajadores=TRABAJADORES, versiones=None):
+    """transformar + limpiar_charges, en paralelo si trabajadores > 1."""
+    if trabajadores > 1:
+        return finalizar_charges(*validar_charges_en_paralelo(df, df_companies, trabajadores), versiones)
+
+    return limpiar_charges(transformar(df), df_companies, versiones)
+
+
+#FUNCION QUE LEE, TRANSFORMA Y VALIDA LOS LOTES PENDIENTES EN MEMORIA
+def limpiar_en_memoria(desde_lote=None, hasta_lote=None, catalogo_en_sql=False,
+                       trabajadores=TRABAJADORES, motor=MOTOR):
+    """
+    Modo en memoria: lee las filas crudas de (desde_lote, hasta_lote],
+    carga el catálogo de compañías y transforma y valida los charges con
+    el motor indicado ("pandas" o "arrow"). El motor Arrow no reparte el
+    trabajo en procesos: pyarrow ya usa varios hilos al leer y convertir.
+
+    Retorna los charges listos para load_charges, o None si falló la carga
+    del catálogo.
+    """
+    if motor not in MOTORES:
+        raise ValueError(f"Motor desconocido: {motor!r} (opciones: {', '.join(MOTORES)})")
+
+    if motor == "arrow":
+        import motor_arrow
+
+        try:
+            tabla = motor_arrow.transformar_arrow(motor_arrow.traer_raw_arrow(desde_lote, hasta_lote))
+        except motor_arrow.MotorArrowNoAplica as e:
+            print(f"→ Motor arrow no aplicable ({e}); se usa el motor pandas.")
+        else:
+            catalogo = cargar_catalogo(desde_lote, hasta_lote, None if catalogo_en_sql else tabla)
+            if catalogo is None:
+                return None
+            return motor_arrow.transformar_y_limpiar_arrow(tabla, catalogo)
+
+    df = traer_raw_df(desde_lote, hasta_lote).rename(columns=NOMBRES_COLUMNAS)
+
+    # El catálogo puede calcularse en pandas o directamente en PostgreSQL
+    catalogo = cargar_catalogo(desde_lote, hasta_lote, None if catalogo_en_sql else df)
+    if catalogo is None:
+        return None
+
+    return transformar_y_limpiar(df, catalogo, trabajadores)
 
 
 #FUNCIONES DE CARGA
+COLUMNAS_COMPANIES = ["company_id", "company_name"]
+COLUMNAS_CHARGES = ["id", "company_id", "amount", "status", "created_at", "updated_at"]
+
+# Tabla temporal de staging para companies; se elimina sola al hacer commit.
+# En una transacción única puede seguir viva de un chunk anterior, por eso el DROP
+SQL_STAGING_COMPANIES = """
+    DROP TABLE IF EXISTS stg_companies;
+    CREATE TEMP TABLE stg_companies (
+        orden         BIGINT NOT NULL,
+        company_id    VARCHAR(40),
+        company_name  VARCHAR(130)
+    ) ON COMMIT DROP
+"""
+
+# Solo toca las compañías nuevas o cuyo nombre cambió; las demás no se reescriben
+SQL_MERGE_COMPANIES = """
+    WITH upsert AS (
+        INSERT INTO dbo.companies (company_id, company_name)
+        SELECT DISTINCT ON (company_id)
+            company_id, company_name
+        FROM stg_companies
+        ORDER BY company_id, orden DESC
+        ON CONFLICT (company_id) DO UPDATE
+        SET company_name = EXCLUDED.company_name
+        WHERE dbo.companies.company_name IS DISTINCT FROM EXCLUDED.company_name
+        RETURNING (xmax = 0) AS insertado
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE insertado),
+        COUNT(*) FILTER (WHERE NOT insertado)
+    FROM upsert
+"""
+
+COLUMNAS_STAGING_CHARGES = """
+        orden       BIGINT NOT NULL,
+        id          VARCHAR(40),
+        company_id  VARCHAR(40),
+        amount      NUMERIC(16,2),
+        status      VARCHAR(30),
+        created_at  TIMESTAMP,
+        updated_at  TIMESTAMP
+"""
+
+# Tabla temporal de staging para charges; se elimina sola al hacer commit.
+# En una transacción única puede seguir viva de un chunk anterior, por eso el DROP
+SQL_STAGING_CHARGES = f"""
+    DROP TABLE IF EXISTS stg_charges;
+    CREATE TEMP TABLE stg_charges ({COLUMNAS_STAGING_CHARGES}) ON COMMIT DROP
+"""
+
+# Staging de cada conexión en la carga en paralelo. Las tablas temporales solo las ve
+# su sesión, así que son tablas UNLOGGED normales que se eliminan al terminar la carga.
+# Se llaman dbo.stg_charges_tramo_<pid>_<carga>_<n>, con el pid del backend que la
+# crea: si el proceso muere antes del DROP sus conexiones se cierran, y la próxima
+# corrida elimina las tablas cuyo pid ya no está en pg_stat_activity
+PREFIJO_STAGING_TRAMO = "stg_charges_tramo"
+
+SQL_STAGING_CHARGES_TRAMO = f"""
+    CREATE UNLOGGED TABLE {{tabla}} ({COLUMNAS_STAGING_CHARGES})
+"""
+
+# Tablas de staging de tramos cuyo nombre cumple %(patron)s
+SQL_TABLAS_TRAMO = """
+    SELECT format('%%I.%%I', schemaname, tablename)
+    FROM pg_tables
+    WHERE schemaname = 'dbo'
+      AND tablename ~ %(patron)s
+"""
+
+# Las de backends que ya no existen; %(patron)s captura el pid
+SQL_TABLAS_TRAMO_HUERFANAS = SQL_TABLAS_TRAMO + """
+      AND substring(tablename FROM %(patron)s)::int NOT IN (SELECT pid FROM pg_stat_activity)
+"""
+
+#FUNCION AUXILIAR PARA ENVIAR UN DataFrame A UNA TABLA CON COPY
+def copiar_df(cursor, df, tabla, columnas, filas_por_bloque=100_000, motor=MOTOR):
+    """
+    Envía las columnas indicadas del DataFrame a `tabla` con COPY FROM STDIN.
+
+    El CSV se genera por bloques de `filas_por_bloque` filas, así nunca se
+    tiene en memoria más que un bloque serializado. Los nulos (NaN/NaT/None)
+    se envían como \\N para distinguirlos de cadenas vacías.
+
+    Con motor="arrow" cada bloque se serializa con pyarrow.csv (ver
+    motor_arrow.csv_arrow), sin pasar cada celda por un objeto de Python; ahí los nulos
+    van como campos vacíos sin comillas y el texto siempre entre comillas.
+
+    Retorna el número de filas copiadas según PostgreSQL.
+    """
+    copy_sql = f"""
+        COPY {tabla} ({", ".join(columnas)})
+        FROM STDIN
+        WITH (FORMAT CSV, NULL '{{nulo}}')
+    """
+
+    if motor == "arrow":
+        import motor_arrow
+
+    total = 0
+    for inicio in range(0, len(df), filas_por_bloque):
+        bloque = df.iloc[inicio:inicio + filas_por_bloque]
+
+        buffer = motor_arrow.csv_arrow(bloque[columnas]) if motor == "arrow" else None
+        if buffer is not None:
+            sql = copy_sql.format(nulo="")
+        else:
+            buffer = io.StringIO()
+            bloque[columnas].to_csv(buffer, header=False, index=False, na_rep="\\N")
+            sql = copy_sql.format(nulo="\\N")
+        caracteres = buffer.tell()
+        buffer.seek(0)
+
+        cursor.copy_expert(sql, buffer)
+        total += cursor.rowcount
+        sumar(bytes_copy=caracteres, filas_copy=cursor.rowcount)
+
+    return total
+
+
+@instrumentar()
 def load_companies(df):
+    """
+    Carga el catálogo de compañías en dbo.companies.
 
-    db = DatabaseConnection()
-    conn, cursor = db.connect()
-    if not conn or not cursor:
-        print("No se pudo establecer la conexión")
-        return
+    El catálogo se envía con COPY a una tabla temporal de staging y se
+    fusiona con un solo INSERT ... SELECT ... ON CONFLICT. Solo se reescriben
+    las compañías cuyo nombre cambió (IS DISTINCT FROM), de modo que las que
+    ya están al día no generan versiones nuevas de la fila ni WAL.
 
+    Retorna:
+        tuple[int, int, int] | None: (insertadas, actualizadas, sin cambios)
+    """
     try:
-        # Insertar cada fila del DataFrame
-        for index, row in df.iterrows():
-
-            query = """
-                INSERT INTO dbo.companies (company_id, company_name)
-                VALUES (%s, %s)
-                ON CONFLICT (company_id) DO UPDATE
-                SET company_name = EXCLUDED.company_name
-            """
-            cursor.execute(query, (row['company_id'], row['company_name']))
-
-        conn.commit()
+        df = df[COLUMNAS_COMPANIES].copy()
+        df.insert(0, "orden", range(len(df)))
+
+        with conexion() as (conn, cursor):
+            cursor.execute(SQL_STAGING_COMPANIES)
+            copiar_df(cursor, df, "stg_companies", ["orden"] + COLUMNAS_COMPANIES)
+
+            cursor.execute(SQL_MERGE_COMPANIES)
+            inserted_count, updated_count = cursor.fetchone()
+
+            versiones = None
+            if inserted_count or updated_count:
+                cursor.execute(SQL_VERSION_CATALOGO, {"proceso": PROCESO_CATALOGO})
+                versiones = cursor.fetchone()
+
+        # Ya confirmado el merge, el índice de nombres se actualiza con lo cargado
+        if versiones is not None:
+            actualizar_indice_empresas(df, *versiones)
+
+        unchanged_count = df["company_id"].nunique() - inserted_count - updated_count
+
         print("Datos cargados correctamente en la tabla 'companies'")
+        print(f"   Insertadas: {inserted_count} | Actualizadas: {updated_count} | Sin cambios: {unchanged_count}")
+
+        return inserted_count, updated_count, unchanged_count
 
     except Exception as e:
-        conn.rollback()
         print("Error al cargar los datos:", e)
-    finally:
-        cursor.close()
-        conn.close()
 
-def load_charges(df_charges):
+@instrumentar()
+def load_charges(df_charges, conexiones=CONEXIONES_CARGA, motor=MOTOR):
     """
     Carga el DataFrame de charges limpios en la tabla 'charges' de PostgreSQL.
-    Usa ON CONFLICT para manejar duplicados (actualiza los campos modificables).
+
+    En lugar de un INSERT por fila, los datos se envían con COPY a una tabla
+    temporal de staging y después se fusionan por conjuntos con
+    fusionar_charges: un INSERT ... SELECT ... ON CONFLICT directo en la
+    partición de cada mes presente en el lote. Las particiones que falten se
+    crean antes, en su propia transacción.
+
+    Con conexiones > 1 el COPY se reparte en tramos que se envían a la vez
+    por varias conexiones del pool (ver copiar_charges_en_paralelo). Dentro
+    de una transacción única hay una sola conexión y se copia en serie.
+
+    Si un id viene repetido en el lote se conserva su versión más reciente,
+    con el mismo criterio que deduplicar_charges.
 
     Parámetros:
         df_charges (pd.DataFrame): DataFrame ya limpio con columnas:
             id, company_id, amount, status, created_at, updated_at
+        conexiones (int): conexiones para el COPY a staging
+        motor (str): con "arrow" el CSV de COPY se arma con pyarrow (ver copiar_df)
+
+    Retorna:
+        tuple[int, int] | None: (filas insertadas, filas actualizadas)
     """
-    db = DatabaseConnection()
-    conn, cursor = db.connect()
+    try:
+        df = df_charges[COLUMNAS_CHARGES].copy()
+        for col in ("created_at", "updated_at"):
+            df[col] = hora_local(df[col])
 
-    if not conn or not cursor:
-        print("No se pudo establecer la conexión a la base de datos")
-        return
+        # Orden de llegada, para resolver ids repetidos dentro del lote
+        df.insert(0, "orden", range(len(df)))
+
+        meses = meses_charges(df["created_at"])
+        with conexion() as (conn, cursor):
+            asegurar_particiones(cursor, meses)
+
+        if conexiones > 1 and len(df) > 1 and not transaccion_unica_activa():
+            inserted_count, updated_count = copiar_charges_en_paralelo(df, conexiones, meses, motor)
+        else:
+            with conexion() as (conn, cursor):
+                cursor.execute(SQL_STAGING_CHARGES)
+                copiar_df(cursor, df, "stg_charges", ["orden"] + COLUMNAS_CHARGES, motor=motor)
+
+                inserted_count, updated_count = fusionar_charges(cursor, "stg_charges", meses)
+
+        print(f"Datos cargados correctamente en la tabla 'charges'")
+        print(f"Filas procesadas: {len(df)}")
+        print(f"   Insertadas: {inserted_count} | Actualizadas: {updated_count}")
+
+        return inserted_count, updated_count
+
+    except Exception as e:
+        print("Error al cargar los datos en 'charges':")
+        print(e)
+
+
+#FUNCIONES PARA LA CARGA DE ALERTAS EN dbo.charge_alerts
+COLUMNAS_ALERTAS_TABLA = [
+    "alert_key", "regla", "charge_id", "company_name", "company_id", "amount",
+    "status", "created_at", "updated_at", "motivo", "company_name_norm", "ejecucion"
+]
+
+# Columnas con las que se identifica una alerta cuyo charge no tiene id
+COLUMNAS_HUELLA_ALERTA = ["company_name", "company_id", "amount", "status", "created_at", "updated_at"]
+
+SQL_STAGING_ALERTAS = """
+    DROP TABLE IF EXISTS stg_charge_alerts;
+    CREATE TEMP TABLE stg_charge_alerts
+        (LIKE dbo.charge_alerts INCLUDING DEFAULTS, orden BIGINT NOT NULL)
+        ON COMMIT DROP
+"""
+
+# Una alerta ya registrada (misma alert_key y regla) no se duplica: se actualiza
+# con los datos y la ejecución más recientes y se cuenta cuántas veces apareció
+SQL_MERGE_ALERTAS = f"""
+    WITH upsert AS (
+        INSERT INTO dbo.charge_alerts AS a ({", ".join(COLUMNAS_ALERTAS_TABLA)})
+        SELECT DISTINCT ON (alert_key, regla)
+            {", ".join(COLUMNAS_ALERTAS_TABLA)}
+        FROM stg_charge_alerts
+        ORDER BY alert_key, regla, orden DESC
+        ON CONFLICT (alert_key, regla) DO UPDATE
+        SET {", ".join(f"{col} = EXCLUDED.{col}" for col in COLUMNAS_ALERTAS_TABLA[2:])},
+            ultima_vez = now(),
+            veces = a.veces + 1
+        RETURNING (xmax = 0) AS insertada
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE insertada),
+        COUNT(*) FILTER (WHERE NOT insertada)
+    FROM upsert
+"""
+
+
+def claves_alertas(df_alertas):
+    """
+    alert_key de cada alerta: el id del charge o, si no tiene, una huella
+    del contenido de la fila ("h:" + 16 dígitos hexadecimales), que es la
+    misma en cada corrida para la misma fila cruda.
+    """
+    claves = df_alertas["id"].astype(object).copy()
+    sin_id = claves.isna().to_numpy()
+    if sin_id.any():
+        huellas = pd.util.hash_pandas_object(df_alertas.loc[sin_id, COLUMNAS_HUELLA_ALERTA], index=False)
+        claves[sin_id] = ["h:%016x" % h for h in huellas.to_numpy()]
+    return claves
+
+
+@instrumentar()
+def load_alerts(df_alertas):
+    """
+    Carga las alertas en dbo.charge_alerts con COPY a una tabla temporal de
+    staging y un solo INSERT ... ON CONFLICT (alert_key, regla), igual que
+    load_charges. Cada fila lleva la regla incumplida, el motivo y el id de
+    la ejecución (metricas.EJECUCION), así se puede cruzar con las métricas.
+
+    Si la carga falla se relanza el error: la corrida se detiene antes de
+    cargar los charges y de avanzar la marca de agua, y la próxima corrida
+    vuelve a registrar estas alertas.
+
+    Retorna (alertas nuevas, alertas repetidas).
+    """
+    df = df_alertas.assign(
+        alert_key=claves_alertas(df_alertas),
+        charge_id=df_alertas["id"],
+        ejecucion=metricas.EJECUCION,
+    )
+    df.insert(0, "orden", range(len(df)))
 
     try:
+        with conexion() as (conn, cursor):
+            cursor.execute(SQL_STAGING_ALERTAS)
+            copiar_df(cursor, df, "stg_charge_alerts", ["orden"] + COLUMNAS_ALERTAS_TABLA)
 
-        df = df_charges.copy()
+            cursor.execute(SQL_MERGE_ALERTAS)
+            nuevas, repetidas = cursor.fetchone()
 
-        # Convertir NaT de updated_at a None
-        df['updated_at'] = df['updated_at'].replace({pd.NaT: None})
+    except Exception as e:
+        print("Error al cargar las alertas en 'charge_alerts':", e)
+        raise
 
-        # Insertar cada fila
-        inserted_count = 0
-        updated_count = 0
+    print("→ Alertas registradas en la tabla 'charge_alerts'")
+    print(f"   Nuevas: {nuevas} | Ya registradas: {repetidas}")
 
+    return nuevas, repetidas
 
 
+def _copiar_tramo(carga, numero, df, motor=MOTOR):
+    inicio = time.perf_counter()
+    with etapa("copiar_tramo", filas_entrada=len(df), tramo=numero), conexion() as (conn, cursor):
+        cursor.execute("SELECT pg_backend_pid()")
+        tabla = f"dbo.{PREFIJO_STAGING_TRAMO}_{cursor.fetchone()[0]}_{carga}_{numero}"
+        cursor.execute(SQL_STAGING_CHARGES_TRAMO.format(tabla=tabla))
+        filas = copiar_df(cursor, df, tabla, ["orden"] + COLUMNAS_CHARGES, motor=motor)
+    return tabla, filas, time.perf_counter() - inicio
 
-        for index, row in df.iterrows():
-            query = """
-                INSERT INTO dbo.charges (
-                    id, company_id, amount, status, created_at, updated_at
-                )
-                VALUES (%s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET
-                    company_id  = EXCLUDED.company_id,
-                    amount      = EXCLUDED.amount,
-                    status      = EXCLUDED.status,
-                    created_at  = EXCLUDED.created_at,
-                    updated_at  = EXCLUDED.updated_at
-            """
-            cursor.execute(query, (
-                row['id'],
-                row['company_id'],
-                row['amount'],
-                row['status'],
-                row['created_at'],
-                row['updated_at']
-            ))
 
+def copiar_charges_en_paralelo(df, conexiones, meses, motor=MOTOR):
+    """
+    Parte df (con su columna 'orden') en `conexiones` tramos, copia cada uno
+    con COPY a su propia tabla de staging por una conexión distinta del pool
+    y después fusiona todos los tramos juntos con fusionar_charges.
 
-            inserted_count += 1
+    Si algún tramo falla no se hace el merge: dbo.charges queda intacta, las
+    tablas de staging se eliminan y el error se relanza. Si el proceso muere
+    antes, las elimina la próxima corrida (ver eliminar_staging_huerfano).
 
-        conn.commit()
+    Retorna (insertadas, actualizadas).
+    """
+    tramos = [df.iloc[posiciones] for posiciones in np.array_split(np.arange(len(df)), conexiones)]
+    tramos = [tramo for tramo in tramos if len(tramo)]
+
+    carga = uuid.uuid4().hex[:12]
+    tablas = []
+
+    try:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(tramos)) as ejecutor:
+            futuros = {
+                ejecutor.submit(_copiar_tramo, carga, numero, tramo, motor): numero
+                for numero, tramo in enumerate(tramos, start=1)
+            }
+            for futuro in as_completed(futuros):
+                tabla, filas, segundos = futuro.result()
+                tablas.append(tabla)
+                print(f"   Tramo {futuros[futuro]}/{len(tramos)}: {filas} filas en {segundos:.2f} s")
+
+        print(f"   COPY en paralelo: {len(df)} filas en {time.perf_counter() - inicio:.2f} s")
+
+        origen = " UNION ALL ".join(f"SELECT * FROM {tabla}" for tabla in tablas)
+        with conexion() as (conn, cursor):
+            return fusionar_charges(cursor, f"({origen}) AS stg_charges", meses)
+
+    finally:
+        # Por nombre: si un tramo falló, los que terminaron después no están en `tablas`
+        eliminar_tablas(SQL_TABLAS_TRAMO, {"patron": f"^{PREFIJO_STAGING_TRAMO}_[0-9]+_{carga}_[0-9]+$"})
 
-        print(f"Datos cargados correctamente en la tabla 'charges'")
-        print(f"Filas procesadas: {len(df)}")
 
+def eliminar_tablas(consulta, params):
+    # Elimina las tablas que lista `consulta`; retorna sus nombres
+    try:
+        with conexion() as (conn, cursor):
+            cursor.execute(consulta, params)
+            tablas = [fila[0] for fila in cursor.fetchall()]
+            if tablas:
+                cursor.execute(f"DROP TABLE IF EXISTS {', '.join(tablas)}")
+        return tablas
     except Exception as e:
-        if conn:
-            conn.rollback()
-        print("Error al cargar los datos en 'charges':")
-        print(e)
+        print(f"No se pudieron eliminar las tablas de staging: {e}")
+        return []
+
+
+def eliminar_staging_huerfano():
+    """
+    Elimina las tablas de staging de tramos que dejó una carga en paralelo
+    cuyo proceso murió (su backend ya no existe). Las de cargas en curso,
+    de este u otro proceso, no se tocan.
+    """
+    tablas = eliminar_tablas(SQL_TABLAS_TRAMO_HUERFANAS, {"patron": f"^{PREFIJO_STAGING_TRAMO}_([0-9]+)_"})
+    if tablas:
+        print(f"Tablas de staging huérfanas eliminadas: {len(tablas)}")
+
+
+#FUNCIONES PARA EL PROCESAMIENTO INCREMENTAL (MARCA DE AGUA POR LOTE DE INGESTA)
+PROCESO_ETL = "charges"
+
+SQL_TABLA_MARCAS = """
+    CREATE TABLE IF NOT EXISTS dbo.etl_marcas (
+        proceso         VARCHAR(50) PRIMARY KEY,
+        ultimo_lote     BIGINT NOT NULL,
+        actualizado_en  TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+# Alertas de charges rechazados, para revisión manual (ver load_alerts)
+SQL_TABLA_ALERTAS = """
+    CREATE TABLE IF NOT EXISTS dbo.charge_alerts (
+        alert_key          TEXT NOT NULL,
+        regla              VARCHAR(30) NOT NULL,
+        charge_id          TEXT,
+        company_name       TEXT,
+        company_id         TEXT,
+        amount             DOUBLE PRECISION,
+        status             TEXT,
+        created_at         TIMESTAMP,
+        updated_at         TIMESTAMP,
+        motivo             TEXT NOT NULL,
+        company_name_norm  TEXT,
+        ejecucion          VARCHAR(32) NOT NULL,
+        primera_vez        TIMESTAMP NOT NULL DEFAULT now(),
+        ultima_vez         TIMESTAMP NOT NULL DEFAULT now(),
+        veces              INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (alert_key, regla)
+    );
+
+    CREATE INDEX IF NOT EXISTS charge_alerts_regla_ultima_vez_idx
+        ON dbo.charge_alerts (regla, ultima_vez);
+
+    CREATE INDEX IF NOT EXISTS charge_alerts_ejecucion_idx
+        ON dbo.charge_alerts (ejecucion);
+"""
+
+# Totales diarios por compañía materializados; los mantiene fusionar_charges.
+# La vista conserva sus columnas, pero ya no agrega dbo.charges en cada consulta.
+# Como en 01_init.sql; preparar_esquema solo lo corre si la tabla no existe
+SQL_TOTALES_DIARIOS = """
+    CREATE TABLE dbo.daily_company_totals (
+        company_id        VARCHAR(40) NOT NULL REFERENCES dbo.companies (company_id),
+        transaction_date  DATE NOT NULL,
+        total_amount      NUMERIC NOT NULL,
+        charges_count     BIGINT NOT NULL,
+        PRIMARY KEY (company_id, transaction_date)
+    );
+
+    CREATE INDEX daily_company_totals_transaction_date_idx
+        ON dbo.daily_company_totals (transaction_date);
+
+    CREATE OR REPLACE FUNCTION dbo.recalcular_daily_company_totals()
+    RETURNS void
+    LANGUAGE sql
+    AS $$
+        DELETE FROM dbo.daily_company_totals;
+
+        INSERT INTO dbo.daily_company_totals (
+            company_id, transaction_date, total_amount, charges_count
+        )
+        SELECT company_id, created_at::date, SUM(amount), COUNT(*)
+        FROM dbo.charges
+        GROUP BY company_id, created_at::date;
+    $$;
+
+    CREATE OR REPLACE VIEW vistas.daily_company_totals AS
+    SELECT
+        c.company_name,
+        t.transaction_date,
+        SUM(t.total_amount) AS total_amount
+    FROM dbo.daily_company_totals t
+    JOIN dbo.companies c
+        ON t.company_id = c.company_id
+    GROUP BY
+        c.company_name,
+        t.transaction_date;
+"""
+
+#FUNCION QUE CREA LAS TABLAS AUXILIARES DEL ETL EN BASES CREADAS ANTES DE ELLAS
+@instrumentar()
+def preparar_esquema():
+    with conexion() as (conn, cursor):
+        cursor.execute(SQL_TABLA_MARCAS)
+        cursor.execute(SQL_TABLA_ALERTAS)
+
+        # Primera vez: se crean los totales y se llenan con los charges que ya
+        # existían. Va antes de particionar, porque la vista vieja lee dbo.charges
+        cursor.execute("SELECT to_regclass('dbo.daily_company_totals') IS NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute(SQL_TOTALES_DIARIOS)
+            cursor.execute("SELECT dbo.recalcular_daily_company_totals()")
+            print("Totales diarios materializados a partir de dbo.charges")
+
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('dbo.charges')")
+        if cursor.fetchone()[0] == "r":
+            particionar_charges(cursor)
+
+    eliminar_staging_huerfano()
+
+
+def rango_lotes_pendientes(reconstruir=False):
+    """
+    Retorna (desde_lote, hasta_lote): los lotes de data_raw por procesar son
+    los de lote_id en (desde_lote, hasta_lote].
+
+    desde_lote es la marca de agua de la última corrida exitosa; es None en
+    la primera corrida o si se pide reconstruir, y entonces se procesa todo.
+    hasta_lote es el último lote cargado al empezar: lo que llegue durante
+    la corrida queda para la siguiente. Si ninguna fila cruda tiene lote_id
+    (tabla vacía o filas cargadas antes del control de lotes) es 0, así la
+    marca queda en 0 y esas filas no se vuelven a procesar: los lotes
+    empiezan en 1.
+
+    Antes de leerlo se espera a que terminen las cargas en curso, con el
+    bloqueo que toma carga_data.py en cada una: los lote_id se asignan al
+    empezar la carga, así que una carga lenta con un id menor que se
+    confirmara después quedaría detrás de la marca y no se procesaría nunca.
+    Mientras dura la lectura, las cargas nuevas esperan (en una transacción
+    única, hasta el final de la corrida) y reciben ids mayores.
+    """
+    marca = leer_marca()
+    with conexion() as (conn, cursor):
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('data_raw.ingestas'))")
+        cursor.execute("SELECT COALESCE(MAX(lote_id), 0) FROM data_raw.data_prueba_tecnica_raw")
+        hasta_lote = cursor.fetchone()[0]
+
+    desde_lote = None if reconstruir else marca
+    if hasta_lote == 0 and desde_lote is None:
+        print("data_raw no tiene lotes de ingesta (lote_id nulo); se procesa completa "
+              "y la marca de agua queda en el lote 0.")
+    return desde_lote, hasta_lote
+
+
+def leer_marca():
+    """Último lote procesado por el ETL, o None si nunca corrió."""
+    with conexion() as (conn, cursor):
+        cursor.execute("SELECT ultimo_lote FROM dbo.etl_marcas WHERE proceso = %s", (PROCESO_ETL,))
+        marca = cursor.fetchone()
+    return None if marca is None else marca[0]
 
 
+def guardar_marca(hasta_lote):
+    with conexion() as (conn, cursor):
+        cursor.execute("""
+            INSERT INTO dbo.etl_marcas (proceso, ultimo_lote)
+            VALUES (%s, %s)
+            ON CONFLICT (proceso) DO UPDATE SET
+                ultimo_lote    = EXCLUDED.ultimo_lote,
+                actualizado_en = now()
+        """, (PROCESO_ETL, hasta_lote))
+
+    print(f"Marca de agua actualizada: lote {hasta_lote}")
+
+
+def cargar_catalogo(desde_lote, hasta_lote, df=None, df_companies=None):
+    """
+    Calcula y carga el catálogo de compañías. Retorna el índice de nombres
+    (IndiceEmpresas) con el que se corrigen los company_id, o None si algo
+    falló.
+
+    - Corrida completa: catálogo de todas las filas crudas, en pandas (o
+      Arrow) si se pasa df (o una tabla Arrow) o, si no, con la agregación
+      en PostgreSQL. Si ya se calculó (df_companies), se carga ese.
+    - Corrida incremental: solo se recalculan las compañías de los lotes
+      nuevos (con toda su historia).
+
+    En ambos casos el índice cubre dbo.companies completa, que incluye las
+    compañías de corridas anteriores; se guarda entre corridas y se
+    actualiza con lo que carga load_companies (ver obtener_indice_empresas).
+    """
+    if df_companies is not None:
+        pass
+    elif desde_lote is None and isinstance(df, pa.Table):
+        import motor_arrow
+
+        df_companies = motor_arrow.limpiar_nombres_empresas_arrow(df)
+    elif desde_lote is None and df is not None:
+        df_companies = limpiar_nombres_empresas(df)
+    else:
+        df_companies = traer_catalogo_empresas(desde_lote, hasta_lote)
+
+    if df_companies is None or load_companies(df_companies) is None:
+        return None
+
+    return obtener_indice_empresas()
+
+
+def main(catalogo_en_sql=False, tamano_chunk=TAMANO_CHUNK, reconstruir=RECONSTRUIR,
+         una_transaccion=TRANSACCION_UNICA, trabajadores=TRABAJADORES, en_pipeline=EN_PIPELINE,
+         usar_cache=USAR_CACHE, motor=MOTOR):
+    """
+    Corre el ETL. Con una_transaccion todas las etapas comparten una conexión
+    del pool y una sola transacción: o se confirma la corrida completa
+    (incluida la marca de agua) o no queda nada a medias. Con trabajadores > 1
+    la transformación y validación de charges se reparte en procesos. Con
+    en_pipeline la tabla cruda se procesa por chunks solapando lectura,
+    transformación y carga (ver main_en_pipeline). Con usar_cache las
+    corridas completas en memoria reutilizan los datos limpios de la caché
+    columnar (ver datos_limpios). Con motor="arrow" el modo en memoria lee,
+    transforma y valida con pyarrow (ver limpiar_en_memoria).
+    """
+    try:
+        with transaccion_unica() if una_transaccion else nullcontext():
+            ejecutar_etl(catalogo_en_sql, tamano_chunk, reconstruir, trabajadores, en_pipeline,
+                         usar_cache, motor)
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        cerrar_ejecutor()
 
 
+@instrumentar("etl")
+def ejecutar_etl(catalogo_en_sql=False, tamano_chunk=TAMANO_CHUNK, reconstruir=RECONSTRUIR,
+                 trabajadores=TRABAJADORES, en_pipeline=EN_PIPELINE, usar_cache=USAR_CACHE,
+                 motor=MOTOR):
 
+    preparar_esquema()
 
-def main():
+    desde_lote, hasta_lote = rango_lotes_pendientes(reconstruir)
+
+    if desde_lote is not None:
+        if desde_lote == hasta_lote:
+            print("No hay lotes nuevos en data_raw; nada que procesar.")
+            return
+        print(f"Procesando lotes {desde_lote + 1} a {hasta_lote}")
+
+    if en_pipeline and transaccion_unica_activa():
+        # Lector y cargador no pueden compartir la única conexión a la vez
+        print("→ En una transacción única los chunks se procesan en serie, sin pipeline.")
+        en_pipeline = False
+
+    if motor == "arrow" and (en_pipeline or tamano_chunk or (usar_cache and desde_lote is None)):
+        print("→ El motor arrow solo transforma en el modo en memoria; los chunks, el pipeline "
+              "y la caché usan pandas (la carga sí arma el CSV de COPY con pyarrow).")
+
+    if en_pipeline:
+        exito = main_en_pipeline(tamano_chunk or 100_000, desde_lote, hasta_lote, trabajadores)
+    elif tamano_chunk:
+        exito = main_por_chunks(tamano_chunk, desde_lote, hasta_lote, trabajadores)
+    elif usar_cache and desde_lote is None:
+        limpios = datos_limpios(hasta_lote)
+        if limpios is None:
+            return
+
+        exito = load_charges(limpios[2]) is not None
+    else:
+        df_charges = limpiar_en_memoria(desde_lote, hasta_lote, catalogo_en_sql, trabajadores, motor)
+        if df_charges is None:
+            return
+
+        exito = load_charges(df_charges, motor=motor) is not None
+
+    # La marca solo avanza si todo se cargó; si no, la próxima corrida repite los lotes
+    if exito:
+        guardar_marca(hasta_lote)
+
+
+def main_por_chunks(tamano_chunk=100_000, desde_lote=None, hasta_lote=None,
+                    trabajadores=TRABAJADORES):
+    """
+    Mismo ETL que ejecutar_etl(), pero leyendo la tabla cruda por bloques: la memoria
+    usada depende de tamano_chunk y no del tamaño de la tabla.
+
+    El catálogo de compañías se calcula primero, completo, con una agregación
+    en PostgreSQL (traer_catalogo_empresas), así la corrección de company_id
+    de cada bloque ve todas las compañías. Luego cada bloque pasa por
+    transformar → limpiar_charges → load_charges. Los id repetidos se
+    resuelven en cada bloque y, con VersionesCharges, entre bloques: un
+    bloque no reemplaza la versión más reciente cargada por uno anterior,
+    así que el resultado en la base es el mismo que en el modo en memoria.
+
+    Retorna True si todos los bloques se cargaron.
+    """
+    catalogo = cargar_catalogo(desde_lote, hasta_lote)
+    if catalogo is None:
+        return False
+
+    versiones = VersionesCharges()
+    for numero, chunk in enumerate(iterar_raw_chunks(tamano_chunk, desde_lote, hasta_lote), start=1):
+        with etapa("chunk", filas_entrada=len(chunk), chunk=numero):
+            df_charges = transformar_y_limpiar(chunk, catalogo, trabajadores, versiones)
+            if load_charges(df_charges) is None:
+                return False
+
+    return True
+
+#FUNCIONES PARA LA CACHÉ COLUMNAR DE LOS DATOS LIMPIOS
+# Módulos de los que dependen los datos limpios en caché: este archivo (transformación
+# y reglas), la resolución de nombres y el formato en que se guardan
+MODULOS_CACHE = [__file__, indice_empresas.__file__, cache_columnar.__file__]
+
+
+@lru_cache(maxsize=1)
+def version_codigo():
+    # Cualquier cambio en MODULOS_CACHE invalida la caché
+    huella = hashlib.sha256()
+    for modulo in MODULOS_CACHE:
+        with open(os.path.abspath(modulo), "rb") as f:
+            huella.update(f.read())
+    return huella.hexdigest()
+
+
+def huella_raw(hasta_lote=None):
+    """
+    Huella barata de las filas crudas hasta hasta_lote: cantidad de filas,
+    último lote y último momento de carga. Si cambia cualquier cosa en
+    data_raw por carga_data.py, cambia la huella.
+    """
+    condicion, params = filtro_lotes(None, hasta_lote)
+    with conexion() as (conn, cursor):
+        cursor.execute(f"""
+            SELECT COUNT(*), MAX(lote_id), MAX(cargado_en)
+            FROM data_raw.data_prueba_tecnica_raw
+            WHERE {condicion}
+        """, params)
+        return cursor.fetchone()
+
+
+def clave_datos_limpios(huella, version_catalogo):
+    # Todo lo que cambia el resultado de limpiar_charges: los datos crudos, el
+    # código, la base, el catálogo de compañías contra el que se corrigen los
+    # company_id y el umbral de similitud de nombres
+    return cache_columnar.clave_cache(
+        huella, version_codigo(), DB_HOST, DB_PORT, DB_NAME, TIPOS_COMPACTOS,
+        UMBRAL_SIMILITUD, version_catalogo
+    )
 
-    df = traer_raw_df()
-    df = transformar(df)
 
+@instrumentar()
+def datos_limpios(hasta_lote=None, usar_cache=True, zero_copy=False):
+    """
+    Retorna (transformados, companies, charges): las salidas de transformar,
+    limpiar_nombres_empresas y limpiar_charges sobre toda la tabla cruda, o
+    None si falló la carga del catálogo.
+
+    El catálogo se carga en dbo.companies con cargar_catalogo y los
+    company_id se corrigen con el índice que retorna, igual que en el modo
+    en memoria sin caché.
+
+    La caché se indexa por la huella de data_raw, la versión del código, la
+    base de origen, el umbral de similitud y la versión de dbo.companies
+    después de cargar el catálogo. Si hay una entrada, dbo.companies sigue
+    como la dejó esa carga: se evitan la extracción, la transformación y la
+    carga del catálogo (y no se vuelven a escribir las alertas).
+    Pensada también para notebooks: con zero_copy=True las columnas quedan
+    respaldadas por el archivo Arrow mapeado en memoria.
+    """
+    if usar_cache:
+        huella = huella_raw(hasta_lote)
+        clave = clave_datos_limpios(huella, version_catalogo())
+        frames = cache_columnar.leer(clave, zero_copy=zero_copy)
+        if frames is not None:
+            print(f"Datos limpios leídos de la caché ({clave[:12]})")
+            anotar(cache="acierto")
+            return frames["transformados"], frames["companies"], frames["charges"]
+
+    anotar(cache="fallo" if usar_cache else "desactivada")
+    df = transformar(traer_raw_df(None, hasta_lote))
+    df_companies = limpiar_nombres_empresas(df)
+
+    catalogo = cargar_catalogo(None, hasta_lote, df_companies=df_companies)
+    if catalogo is None:
+        return None
+
+    df_charges = limpiar_charges(df, catalogo)
+
+    if usar_cache:
+        # La carga pudo cambiar la versión del catálogo; la entrada va con la de ahora
+        clave = clave_datos_limpios(huella, catalogo.version)
+        frames = {"transformados": df, "companies": df_companies, "charges": df_charges}
+        if cache_columnar.guardar(clave, frames):
+            print(f"Datos limpios guardados en la caché ({clave[:12]})")
+
+    return df, df_companies, df_charges
+
+
+#FUNCIONES PARA EL PIPELINE: LECTURA, TRANSFORMACIÓN Y CARGA SOLAPADAS
+_FIN = object()
+
+
+def _poner(cola, item, cancelar):
+    # Como Queue.put, pero deja de esperar si otra etapa canceló el pipeline
+    while not cancelar.is_set():
+        try:
+            cola.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _tomar(cola, cancelar):
+    # Como Queue.get; si otra etapa canceló el pipeline retorna _FIN
+    while not cancelar.is_set():
+        try:
+            return cola.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _FIN
+
+
+class ErrorCargaChunk(Exception):
+    pass
+
+
+def main_en_pipeline(tamano_chunk=100_000, desde_lote=None, hasta_lote=None,
+                     trabajadores=TRABAJADORES, profundidad=PROFUNDIDAD_COLA):
+    """
+    Mismo resultado que main_por_chunks, pero con las etapas solapadas:
+
+        hilo lector ──(cola)──> transformación ──(cola)──> hilo cargador
+         chunk N+1               chunk N                    chunk N-1
+
+    El hilo lector recorre iterar_raw_chunks, el hilo principal aplica
+    transformar_y_limpiar y el hilo cargador llama a load_charges en el
+    mismo orden de lectura, así que los id repetidos entre chunks se
+    resuelven igual que en main_por_chunks. Las colas admiten `profundidad` chunks; si una
+    etapa va más rápido que la siguiente, espera (la memoria queda acotada).
+
+    Si una etapa falla, se cancela el pipeline: las demás dejan de tomar
+    chunks nuevos, el lector libera su conexión y no se avanza la marca.
+    Un error de lectura o transformación se relanza; si falla la carga de
+    un chunk se retorna False, igual que en main_por_chunks.
+
+    Retorna True si todos los chunks se cargaron.
+    """
+    catalogo = cargar_catalogo(desde_lote, hasta_lote)
+    if catalogo is None:
+        return False
+
+    crudos = queue.Queue(maxsize=profundidad)
+    limpios = queue.Queue(maxsize=profundidad)
+    cancelar = threading.Event()
+    errores = []
+
+    def fallar(error):
+        errores.append(error)
+        cancelar.set()
+
+    def leer():
+        try:
+            with closing(iterar_raw_chunks(tamano_chunk, desde_lote, hasta_lote)) as chunks:
+                for chunk in chunks:
+                    if not _poner(crudos, chunk, cancelar):
+                        return
+            _poner(crudos, _FIN, cancelar)
+        except BaseException as e:
+            fallar(e)
+
+    def cargar():
+        try:
+            while True:
+                df_charges = _tomar(limpios, cancelar)
+                if df_charges is _FIN:
+                    return
+                if load_charges(df_charges) is None:
+                    raise ErrorCargaChunk("Falló la carga de un chunk en 'charges'")
+        except BaseException as e:
+            fallar(e)
+
+    # Los procesos de la transformación se crean antes que los hilos (ver obtener_ejecutor)
+    if trabajadores > 1:
+        obtener_ejecutor(trabajadores, arrancar=True)
+
+    lector = threading.Thread(target=leer, name="etl-lector", daemon=True)
+    cargador = threading.Thread(target=cargar, name="etl-cargador", daemon=True)
+    lector.start()
+    cargador.start()
+
+    versiones = VersionesCharges()
+    try:
+        while True:
+            chunk = _tomar(crudos, cancelar)
+            if chunk is _FIN:
+                break
+            df_charges = transformar_y_limpiar(chunk, catalogo, trabajadores, versiones)
+            if not _poner(limpios, df_charges, cancelar):
+                break
+
+        _poner(limpios, _FIN, cancelar)
+    except BaseException as e:
+        fallar(e)
+    finally:
+        lector.join()
+        cargador.join()
 
-    df_companies_clean = limpiar_nombres_empresas(df)
-    df_charges = limpiar_charges(df,df_companies_clean)
+    if errores:
+        print(f"Pipeline cancelado: {errores[0]}")
+        if isinstance(errores[0], ErrorCargaChunk):
+            return False
+        raise errores[0]
 
-    load_companies(df_companies_clean)
-    load_charges(df_charges)
+    return True
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    # motor_arrow importa este archivo como el módulo etl; así no se carga una segunda copia
+    sys.modules.setdefault("etl", sys.modules[__name__])
+    main()
\ No newline at end of file
@@ -0,0 +1,274 @@
+# fuente/motor_arrow.py
+"""
+Motor Arrow de etl.py (ver limpiar_en_memoria).
+
+Con ETL_MOTOR=arrow el modo en memoria lee, transforma y valida sobre tablas
+Arrow con pyarrow.compute, en lugar de DataFrames con un objeto de Python por
+celda. Las reglas y los criterios son los mismos y el resultado también: el
+DataFrame final tiene los valores del motor pandas, con los dtypes del modo
+de tipos compactos (ver tabla_a_pandas). Los casos raros (fechas en formatos
+a inferir, nombres con acentos, montos que Arrow no convierte igual que
+pandas) se resuelven con las mismas funciones de pandas, una vez por valor
+distinto.
+"""
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from etl import (MAX_DECIMAL_16_2, QUERY_RAW, REGLAS_CHARGES, STATUS_VALIDOS, catalogo_desde_conteos,
+                 filtro_lotes, finalizar_charges, indexar_catalogo, limpiar_fechas, normalizar_nombres,
+                 partir_charges)
+from utils import indice_empresas
+from utils.db_config import conexion
+from utils.metricas import anotar, depurar, instrumentar
+
+# Columnas de QUERY_RAW, ya con los nombres que les da transformar
+COLUMNAS_RAW_ARROW = ["id", "company_name", "company_id", "amount", "status", "created_at", "updated_at"]
+
+# Montos que Arrow convierte igual que pd.to_numeric: decimales simples de hasta
+# 15 dígitos, que ambos redondean correctamente. Los demás (enteros, exponentes,
+# espacios, más dígitos, texto) se convierten con pandas
+PATRON_MONTO_SIMPLE = r"^-?[0-9]+\.[0-9]+$"
+DIGITOS_MONTO_SIMPLE = 15
+
+# Columnas que tabla_a_pandas deja como categóricas, igual que compactar_raw
+COLUMNAS_CATEGORICAS_ARROW = ["company_name", "company_id", "status"]
+
+
+class MotorArrowNoAplica(Exception):
+    """Los datos tienen algo que una tabla Arrow no representa igual que pandas."""
+
+
+@instrumentar()
+def traer_raw_arrow(desde_lote=None, hasta_lote=None):
+    """
+    Lee las filas crudas como una tabla Arrow. PostgreSQL las envía con
+    COPY ... TO STDOUT en CSV y pyarrow.csv las parsea, en varios hilos,
+    directo a los buffers de Arrow: no se crea un objeto de Python por
+    celda. Todas las columnas quedan como texto; en el CSV de COPY un NULL
+    es un campo vacío sin comillas y una cadena vacía va entre comillas,
+    así que se distinguen igual que al leer con psycopg2.
+    """
+    condicion, params = filtro_lotes(desde_lote, hasta_lote)
+    buffer = io.BytesIO()
+    with conexion() as (conn, cursor):
+        consulta = cursor.mogrify(f"{QUERY_RAW} WHERE {condicion}", params).decode()
+        cursor.copy_expert(f"COPY ({consulta}) TO STDOUT WITH (FORMAT CSV)", buffer)
+
+    if not buffer.tell():
+        tabla = pa.table({col: pa.array([], pa.string()) for col in COLUMNAS_RAW_ARROW})
+    else:
+        buffer.seek(0)
+        tabla = pa_csv.read_csv(
+            buffer,
+            read_options=pa_csv.ReadOptions(column_names=COLUMNAS_RAW_ARROW),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={col: pa.string() for col in COLUMNAS_RAW_ARROW},
+                null_values=[""],
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+
+    depurar(f"Número de filas devueltas: {tabla.num_rows}")
+    return tabla
+
+
+def _reemplazar_columna(tabla, nombre, columna):
+    return tabla.set_column(tabla.schema.get_field_index(nombre), nombre, columna)
+
+
+def _montos_arrow(columna):
+    # Mismo resultado que pd.to_numeric(errors="coerce") sobre la columna de texto.
+    # Un monto simple es signo, dígitos y un punto: sin el signo, sus dígitos son el largo - 1
+    simples = pc.fill_null(pc.and_(
+        pc.match_substring_regex(columna, PATRON_MONTO_SIMPLE),
+        pc.less_equal(pc.utf8_length(pc.utf8_ltrim(columna, "-")), DIGITOS_MONTO_SIMPLE + 1),
+    ), False)
+
+    if not pc.any(simples).as_py():
+        # Sin ningún decimal pandas puede devolver enteros: se le deja la columna entera
+        return pa.array(pd.to_numeric(columna.to_pandas(), errors="coerce"))
+
+    montos = pc.cast(pc.if_else(simples, columna, None), pa.float64())
+    resto = pc.and_(pc.invert(simples), pc.is_valid(columna))
+    if not pc.any(resto).as_py():
+        return montos
+
+    # Con algún decimal en la columna pandas devuelve float64, valor por valor;
+    # el "0.5" del principio fuerza ese mismo camino al convertir solo el resto
+    codificados = pc.dictionary_encode(pc.filter(columna, resto)).combine_chunks()
+    unicos = pd.Series(["0.5"] + codificados.dictionary.to_pylist(), dtype=object)
+    convertidos = pd.to_numeric(unicos, errors="coerce").to_numpy(dtype=np.float64)[1:]
+    valores = pa.array(convertidos.take(codificados.indices.to_numpy()), pa.float64())
+    return pc.replace_with_mask(montos.combine_chunks(), resto.combine_chunks(), valores)
+
+
+def _fechas_arrow(columna):
+    # limpiar_fechas sobre los valores distintos (el diccionario) y expansión con take
+    codificados = pc.dictionary_encode(columna).combine_chunks()
+    unicos = codificados.dictionary.to_pylist()
+    if codificados.null_count:
+        unicos.append(None)
+
+    fechas = limpiar_fechas(pd.Series(unicos, dtype=object))
+    if not pd.api.types.is_datetime64_any_dtype(fechas.dtype):
+        raise MotorArrowNoAplica("una columna de fechas que pandas deja como objetos")
+
+    # Los nulos de indices apuntan a NaT, que en Arrow es nulo
+    return pa.array(fechas, from_pandas=True).take(codificados.indices)
+
+
+@instrumentar()
+def transformar_arrow(tabla):
+    """
+    transformar sobre una tabla Arrow (ya con las columnas renombradas):
+    amount pasa a float64 y las fechas a timestamp, con los mismos valores
+    que en pandas. Lanza MotorArrowNoAplica si pandas dejaría alguna
+    columna de fechas como objetos.
+    """
+    tabla = _reemplazar_columna(tabla, "amount", _montos_arrow(tabla["amount"]))
+    for col in ("created_at", "updated_at"):
+        tabla = _reemplazar_columna(tabla, col, _fechas_arrow(tabla[col]))
+    return tabla
+
+
+@instrumentar()
+def limpiar_nombres_empresas_arrow(tabla):
+    """
+    limpiar_nombres_empresas sobre una tabla Arrow: el filtro por longitud
+    y el conteo de cada par (company_id, company_name) se hacen con
+    pyarrow.compute y group_by; a pandas solo pasan los pares contados.
+    """
+    tabla = tabla.select(["company_id", "company_name"])
+    tabla = tabla.filter(company_id_valido_arrow(tabla["company_id"]))
+
+    conteos = (
+        tabla.filter(pc.is_valid(tabla["company_name"]))
+        .group_by(["company_id", "company_name"])
+        .aggregate([("company_id", "count")])
+        .to_pandas()
+        .rename(columns={"company_id_count": "n"})
+    )
+
+    company_ids = pc.unique(tabla["company_id"]).to_numpy(zero_copy_only=False)
+    return catalogo_desde_conteos(conteos, company_ids)
+
+
+def company_id_valido_arrow(columna):
+    # Como company_id_valido: no nulo y de 40 caracteres (no bytes)
+    return pc.fill_null(pc.equal(pc.utf8_length(columna), 40), False)
+
+
+# Condición de cada regla de REGLAS_CHARGES con pyarrow.compute, por código de
+# regla. Una regla sin entrada aquí se evalúa con su condición de pandas
+CONDICIONES_ARROW = {
+    "id_nulo": lambda t: pc.is_null(t["id"]),
+    "company_id_invalido": lambda t: pc.invert(company_id_valido_arrow(t["company_id"])),
+    "amount_invalido": lambda t: pc.or_(
+        pc.is_null(t["amount"], nan_is_null=True),
+        pc.fill_null(pc.greater(pc.abs(t["amount"]), MAX_DECIMAL_16_2), False),
+    ),
+    "status_invalido": lambda t: pc.invert(pc.is_in(t["status"], value_set=pa.array(sorted(STATUS_VALIDOS)))),
+    "created_at_nulo": lambda t: pc.is_null(t["created_at"]),
+}
+
+
+@instrumentar()
+def reparar_company_id_arrow(tabla, df_companies):
+    """
+    reparar_company_id sobre una tabla Arrow. Las filas dudosas se eligen
+    con pyarrow.compute; solo sus nombres pasan a pandas para buscarlos en
+    el índice, y los company_id encontrados se escriben con replace_with_mask.
+    """
+    dudosos = pc.and_(pc.is_valid(tabla["id"]), pc.invert(company_id_valido_arrow(tabla["company_id"])))
+    posiciones = np.flatnonzero(dudosos.to_numpy())
+    if not len(posiciones):
+        return tabla
+
+    indice = df_companies
+    if not isinstance(indice, indice_empresas.IndiceEmpresas):
+        indice = indexar_catalogo(df_companies)
+
+    codigos, nombres = pd.factorize(normalizar_nombres(tabla["company_name"].take(posiciones).to_pandas()))
+    resueltos = np.array(indice.resolver(nombres) + [None], dtype=object)
+    encontrados = resueltos.take(codigos)
+    mask_encontrado = pd.notna(encontrados)
+    anotar(dudosos=len(posiciones), corregidos=int(mask_encontrado.sum()))
+    if not mask_encontrado.any():
+        return tabla
+
+    reemplazar = np.zeros(tabla.num_rows, dtype=bool)
+    reemplazar[posiciones[mask_encontrado]] = True
+    company_id = pc.replace_with_mask(
+        tabla["company_id"].combine_chunks(), pa.array(reemplazar),
+        pa.array(encontrados[mask_encontrado], pa.string())
+    )
+    return _reemplazar_columna(tabla, "company_id", company_id)
+
+
+def tabla_a_pandas(tabla):
+    """
+    DataFrame de una tabla Arrow transformada, con los dtypes del modo de
+    tipos compactos (ver compactar_raw): id como texto respaldado por Arrow,
+    sin copiarlo; nombre, company_id y status como categóricas; amount y
+    fechas como los deja transformar.
+    """
+    for col in COLUMNAS_CATEGORICAS_ARROW:
+        tabla = _reemplazar_columna(tabla, col, pc.dictionary_encode(tabla[col]))
+    return tabla.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+@instrumentar()
+def clasificar_charges_arrow(tabla):
+    """
+    clasificar_charges sobre una tabla Arrow: las reglas se evalúan con
+    CONDICIONES_ARROW y la tabla pasa a pandas solo para partirla en
+    válidos y alertas (ver partir_charges).
+    """
+    df = None
+    mascaras = []
+    for codigo, condicion, _ in REGLAS_CHARGES:
+        if codigo in CONDICIONES_ARROW:
+            mascaras.append(CONDICIONES_ARROW[codigo](tabla).to_numpy())
+        else:
+            df = tabla_a_pandas(tabla) if df is None else df
+            mascaras.append(condicion(df).to_numpy(dtype=bool))
+
+    return partir_charges(tabla_a_pandas(tabla) if df is None else df, mascaras)
+
+
+def transformar_y_limpiar_arrow(tabla, df_companies, versiones=None):
+    """transformar_y_limpiar con el motor Arrow, sobre la tabla ya transformada."""
+    return finalizar_charges(*clasificar_charges_arrow(reparar_company_id_arrow(tabla, df_companies)), versiones)
+
+
+#FUNCION QUE ARMA EL CSV DE COPY CON pyarrow.csv
+def csv_arrow(df):
+    """
+    CSV de df para COPY, sin encabezado, escrito por pyarrow.csv. Las
+    columnas respaldadas por Arrow (texto, categóricas) pasan sin copiarse
+    celda por celda. Las fechas con zona horaria van con su hora local,
+    como las escribe to_csv (en una columna TIMESTAMP la zona no cuenta).
+
+    Retorna el buffer, o None si alguna columna no tiene tipo en Arrow
+    (objetos de tipos mezclados); en ese caso se usa to_csv.
+    """
+    df = df.copy(deep=False)
+    for col, tipo in df.dtypes.items():
+        if getattr(tipo, "tz", None) is not None:
+            df[col] = df[col].dt.tz_localize(None)
+
+    try:
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return None
+
+    buffer = io.BytesIO()
+    pa_csv.write_csv(tabla, buffer, pa_csv.WriteOptions(include_header=False))
+    return buffer
@@ -0,0 +1,91 @@
+# fuente/tests/test_carga.py
+# LectorCSVLineas debe entregar a COPY las mismas filas que pandas.read_csv
+# leía del CSV: con normalizar_nulos=True los valores nulos de pandas quedan
+# vacíos (NULL) y con False llegan como texto. No usa la base: la salida del
+# lector se lee como la leería COPY (campo vacío, con o sin comillas = NULL).
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import io
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import carga_data
+
+# Líneas terminadas en \r\r\n como el CSV de origen, nulos de pandas con y sin
+# comillas, al inicio y al final de la línea, comas y saltos de línea dentro de
+# comillas, comillas escapadas y valores que solo contienen un nulo
+CSV = (
+    b"id,name,company_id,amount,status,created_at,paid_at\r\r\n"
+    b"a1,MiPasajefy,c1,12.50,paid,2019-03-19,2019-03-20\r\r\n"
+    b"NA,MiPasajefy,c1,null,paid,2019-03-19,NaN\r\r\n"
+    b'"a3","Muebles, chidos","NULL","7","voided","",""\r\r\n'
+    b'a4,"Tecno\r\nma",c2,"N/A",paid,2019-01-01,n/a\r\r\n'
+    b'a5,"dice ""NA""",c2,NAN,"paid\n",-nan,\r\r\n'
+    b"\r\r\n"
+    b"a6,NA NA,c3,NAs,paid,2019-02-01,None\r\r\n"
+    b'a7,"",c3,1.5,"refunded",#N/A,null\r\r\n'
+)
+
+
+def leer_como_copy(datos):
+    # COPY con NULL '' y FORCE_NULL: un campo vacío, con o sin comillas, es NULL
+    df = pd.read_csv(io.BytesIO(datos), dtype=str, keep_default_na=False)
+    return df.where(df != "", None)
+
+
+def leer_con_pandas(datos, normalizar_nulos):
+    # Como la antigua carga con pandas.read_csv
+    df = pd.read_csv(io.BytesIO(datos), dtype=str, keep_default_na=normalizar_nulos)
+    df = df.astype(object).where(df.notna(), None)
+    return df.where(df != "", None)
+
+
+def entregado(datos, normalizar_nulos, tamano):
+    # Lo que recibe COPY al pedir bloques de tamano bytes
+    lector = carga_data.LectorCSVLineas(io.BytesIO(datos), normalizar_nulos)
+    return b"".join(iter(lambda: lector.read(tamano), b""))
+
+
+class LectorCSVLineasTest(unittest.TestCase):
+
+    def assert_mismas_filas(self, datos, normalizar_nulos):
+        esperado = leer_con_pandas(datos, normalizar_nulos)
+        # Bloques que cortan líneas, saltos \r\r\n y campos entre comillas en cualquier punto
+        for tamano in list(range(1, 40)) + [len(datos), carga_data.TAMANO_BLOQUE_COPY]:
+            with self.subTest(normalizar_nulos=normalizar_nulos, tamano=tamano):
+                salida = entregado(datos, normalizar_nulos, tamano)
+                self.assertNotIn(b"\r", salida.replace(b"Tecno\r\nma", b""))
+                self.assertNotIn(b"\n\n", salida)
+                pd.testing.assert_frame_equal(leer_como_copy(salida), esperado)
+        return esperado
+
+    def test_nulos_como_null(self):
+        esperado = self.assert_mismas_filas(CSV, normalizar_nulos=True)
+        self.assertIsNone(esperado.loc[1, "id"])
+        self.assertIsNone(esperado.loc[2, "company_id"])
+        self.assertEqual(esperado.loc[4, "name"], 'dice "NA"')
+        self.assertEqual(esperado.loc[5, "name"], "NA NA")
+
+    def test_nulos_como_texto(self):
+        esperado = self.assert_mismas_filas(CSV, normalizar_nulos=False)
+        self.assertEqual(esperado.loc[1, "id"], "NA")
+        self.assertEqual(esperado.loc[2, "company_id"], "NULL")
+        self.assertIsNone(esperado.loc[2, "created_at"])
+
+    def test_saltos_dentro_de_comillas(self):
+        # Los saltos de línea dentro de un campo entre comillas se conservan tal cual
+        esperado = self.assert_mismas_filas(CSV, normalizar_nulos=True)
+        self.assertEqual(esperado.loc[3, "name"], "Tecno\r\nma")
+        self.assertEqual(esperado.loc[4, "status"], "paid\n")
+
+    def test_sin_salto_final(self):
+        self.assert_mismas_filas(CSV.rstrip(b"\r\n"), normalizar_nulos=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# fuente/tests/test_chunks.py
+# Transformar la tabla cruda por chunks (ETL_TAMANO_CHUNK) debe dar los mismos
+# valores que transformarla completa. No usa la base: los chunks se arman aquí,
+# igual que los entrega iterar_raw_chunks.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+
+COMPANY_A = "cbf1c8b09cd5b549416d49d220a40cbd317f952e"
+COMPANY_B = "d" * 40
+
+# Columnas de QUERY_RAW
+COLUMNAS_QUERY = ["id", "name", "company_id", "amount", "status", "created_at", "paid_at"]
+
+# Fechas en cada formato de limpiar_fechas repartidas entre chunks, montos
+# enteros y decimales, y filas que terminan en alertas
+FILAS_CRUDAS = [
+    ("a1", "MiPasajefy", COMPANY_A, "12.50", "paid", "2019-03-19", "2019-03-20"),
+    ("a2", "MiPasajefy", COMPANY_A, "7", "voided", "20190121.0", None),
+    (None, "MiPasajefy", COMPANY_A, "3.0", "paid", "2019-01-01 10:00:00", None),
+    ("a4", "MiPas", "corto", "abc", "paid", "Jan 5 2019", ""),
+    ("a5", "Muebles chidos", COMPANY_B, "1e3", "estado_raro", None, "nope"),
+    ("a6", "Muebles chidos", COMPANY_B, " 4.5", "refunded", "2019-02-30", "20190205"),
+    ("a7", "MiPasajefy", COMPANY_A, None, "paid", "2019-05-01T08:30:00.123456", "2019-05-02"),
+    ("a8", "Muebles chidos", COMPANY_B, "15", "pending_payment", "20190501", "2019-05-02 00:00:00"),
+    ("a9", "MiPasajefy", COMPANY_A, "-0.0", "paid", " 2019-06-01 ", "2019/06/02"),
+    ("a10", "MiPasajefy", "", "99.99", "paid", "2019-03-19", "2019-03-21"),
+]
+
+
+def raw(filas):
+    # Como un chunk de iterar_raw_chunks: índice desde 0 en cada uno
+    return etl.renombrar_columnas_raw(pd.DataFrame(filas, columns=COLUMNAS_QUERY))
+
+
+def valores(df):
+    # Cada chunk se carga por separado en columnas NUMERIC y TIMESTAMP, así que solo
+    # importan los valores: un chunk sin decimales deja amount como int64 y uno sin
+    # fechas deja la columna como objetos. Todo pasa a objetos, con None por nulo
+    return df.astype(object).where(df.notna(), None)
+
+
+def assert_mismos_valores(esperado, obtenido):
+    pd.testing.assert_frame_equal(valores(esperado.reset_index(drop=True)), valores(obtenido))
+
+
+class ChunksTest(unittest.TestCase):
+
+    def test_transformar_por_chunks(self):
+        esperado = etl.transformar(raw(FILAS_CRUDAS))
+
+        for tamano in [1, 2, 3, 4, len(FILAS_CRUDAS)]:
+            for inicio in range(0, len(FILAS_CRUDAS), tamano):
+                with self.subTest(tamano=tamano, inicio=inicio):
+                    obtenido = etl.transformar(raw(FILAS_CRUDAS[inicio:inicio + tamano]))
+                    assert_mismos_valores(esperado.iloc[inicio:inicio + tamano], obtenido)
+
+    def test_tipos_compactos_por_chunks(self):
+        # Cada chunk compactado por separado, como en iterar_raw_chunks con ETL_TIPOS_COMPACTOS
+        esperado = etl.transformar(etl.compactar_raw(raw(FILAS_CRUDAS)))
+
+        for inicio in range(0, len(FILAS_CRUDAS), 3):
+            with self.subTest(inicio=inicio):
+                obtenido = etl.transformar(etl.compactar_raw(raw(FILAS_CRUDAS[inicio:inicio + 3])))
+                assert_mismos_valores(esperado.iloc[inicio:inicio + 3], obtenido)
+
+    def test_chunk_vacio(self):
+        obtenido = etl.transformar(raw([]))
+        self.assertTrue(obtenido.empty)
+        self.assertEqual(list(obtenido.columns), list(etl.transformar(raw(FILAS_CRUDAS[:1])).columns))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+# fuente/tests/test_deduplicar.py
+# deduplicar_charges debe dejar una fila por id, la versión más reciente, y con
+# VersionesCharges el modo por chunks debe dejar en la base lo mismo que el
+# modo en memoria, aunque un id aparezca en chunks distintos. No usa la base:
+# la carga se simula como el upsert por id de load_charges.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+
+# (id, created_at, updated_at, amount): versiones de un mismo id que ganan por
+# updated_at, luego por created_at y, si empatan, por orden de llegada; un
+# updated_at nulo cuenta como el más antiguo
+VERSIONES = [
+    ("a", "2019-01-01", "2019-01-05", 1.0),
+    ("b", "2019-01-02", None, 2.0),
+    ("a", "2019-01-01", "2019-01-03", 3.0),
+    ("c", "2019-01-03", "2019-01-03", 4.0),
+    ("b", "2019-01-02", "2019-01-02", 5.0),
+    ("c", "2019-01-04", "2019-01-03", 6.0),
+    ("d", "2019-01-05", None, 7.0),
+    ("a", "2019-01-01", "2019-01-05", 8.0),
+    ("d", "2019-01-04", None, 9.0),
+    ("e", "2019-01-06", "2019-01-06", 10.0),
+]
+
+# Versión que gana cada id en VERSIONES
+GANADORES = {"a": 8.0, "b": 5.0, "c": 6.0, "d": 7.0, "e": 10.0}
+
+
+def charges(filas):
+    return pd.DataFrame({
+        "id": [fila[0] for fila in filas],
+        "company_id": "c" * 40,
+        "amount": [fila[3] for fila in filas],
+        "status": "paid",
+        "created_at": pd.to_datetime([fila[1] for fila in filas]),
+        "updated_at": pd.to_datetime([fila[2] for fila in filas]),
+    })
+
+
+def deduplicar(df, versiones=None):
+    # deduplicar_charges sin su resumen en la salida estándar
+    with contextlib.redirect_stdout(io.StringIO()):
+        return etl.deduplicar_charges(df, versiones)
+
+
+def cargar_por_chunks(df, cortes, versiones):
+    # Deduplica cada chunk y simula el upsert por id: la última carga de un id gana
+    en_base = {}
+    for inicio, fin in zip([0] + cortes, cortes + [len(df)]):
+        for fila in deduplicar(df.iloc[inicio:fin].reset_index(drop=True), versiones).itertuples():
+            en_base[fila.id] = fila.amount
+    return en_base
+
+
+class DeduplicarTest(unittest.TestCase):
+
+    def test_gana_la_version_mas_reciente(self):
+        obtenido = deduplicar(charges(VERSIONES))
+
+        self.assertEqual(dict(zip(obtenido["id"], obtenido["amount"])), GANADORES)
+        # Las filas que quedan conservan su orden y su índice
+        self.assertEqual(obtenido.index.tolist(), [4, 5, 6, 7, 9])
+        self.assertEqual(obtenido["id"].tolist(), ["b", "c", "d", "a", "e"])
+
+    def test_sin_repetidos(self):
+        df = charges(VERSIONES[:2])
+        self.assertIs(deduplicar(df), df)
+
+    def test_mismo_id_en_dos_chunks(self):
+        # Un id cuya versión más reciente llegó en un chunk anterior no la reemplaza
+        versiones = etl.VersionesCharges()
+        primero = deduplicar(charges([VERSIONES[0]]), versiones)
+        segundo = deduplicar(charges([VERSIONES[2]]), versiones)
+        tercero = deduplicar(charges([VERSIONES[7]]), versiones)
+
+        self.assertEqual(len(primero), 1)
+        self.assertTrue(segundo.empty)
+        # En un empate gana el chunk posterior, como en el modo en memoria
+        self.assertEqual(tercero["amount"].tolist(), [8.0])
+        self.assertEqual(len(versiones), 1)
+
+    def test_chunks_igual_que_en_memoria(self):
+        # Con cualquier corte, lo que queda en la base es lo mismo que en memoria
+        df = charges(VERSIONES)
+        for tamano in range(1, len(VERSIONES) + 1):
+            for desplazamiento in range(tamano):
+                cortes = list(range(desplazamiento or tamano, len(df), tamano))
+                with self.subTest(cortes=cortes):
+                    self.assertEqual(cargar_por_chunks(df, cortes, etl.VersionesCharges()), GANADORES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# fuente/tests/test_lectura_tipada.py
+# Leer la tabla cruda con QUERY_RAW_TIPADA (ETL_LEER_TIPADA=1) debe dar el mismo
+# DataFrame transformado que leer el texto con QUERY_RAW. No usa la base: cada
+# fila se arma como la entregaría cada consulta.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+
+COMPANY = "cbf1c8b09cd5b549416d49d220a40cbd317f952e"
+
+# Columnas de QUERY_RAW y las que QUERY_RAW_TIPADA agrega
+COLUMNAS_QUERY = ["id", "name", "company_id", "amount", "status", "created_at", "paid_at"]
+COLUMNAS_TIPADAS = ["amount_tipado", "created_at_tipado", "paid_at_tipado"]
+
+
+def microsegundos(fecha):
+    # Como extract(epoch FROM ...) * 1000000 en QUERY_RAW_TIPADA
+    return pd.Timestamp(fecha).value // 1000
+
+
+# (fila de texto, monto tipado, created_at tipado, paid_at tipado): None donde
+# la base no entrega el valor tipado y viaja el texto (enteros, cero, más de
+# 15 dígitos, estado_parseo marcado, formatos que solo convierte pandas)
+FILAS = [
+    (("a1", "MiPasajefy", COMPANY, "12.50", "paid", "2019-03-19", "2019-03-20"),
+     12.5, "2019-03-19", "2019-03-20"),
+    (("a2", "MiPasajefy", COMPANY, "7", "voided", "20190121.0", None), None, None, None),
+    ((None, "MiPasajefy", COMPANY, "3.0", "paid", "2019-01-01 10:00:00", None),
+     3.0, "2019-01-01 10:00:00", None),
+    (("a4", "MiPas", "corto", "abc", "paid", "Jan 5 2019", ""), None, None, None),
+    (("a5", "MiPasajefy", COMPANY, "-0.0", "paid", "2019-02-30", "20190205"), None, None, None),
+    (("a6", "MiPasajefy", COMPANY, "1234567890123.4567", "refunded",
+      "2019-05-01T08:30:00.123456", "2019-05-02"),
+     None, "2019-05-01T08:30:00.123456", "2019-05-02"),
+    (("a7", "MiPasajefy", COMPANY, None, "paid", None, "2019/06/02"), None, None, None),
+]
+
+
+def raw_texto(filas):
+    # Como traer_raw_df con QUERY_RAW
+    return etl.renombrar_columnas_raw(pd.DataFrame([fila for fila, *_ in filas], columns=COLUMNAS_QUERY))
+
+
+def raw_tipada(filas):
+    # Como traer_raw_df con QUERY_RAW_TIPADA: el texto es nulo donde viaja el valor tipado
+    registros = []
+    for fila, monto, creada, pagada in filas:
+        texto = list(fila)
+        for posicion, tipado in [(3, monto), (5, creada), (6, pagada)]:
+            if tipado is not None:
+                texto[posicion] = None
+        registros.append(texto + [
+            monto,
+            None if creada is None else microsegundos(creada),
+            None if pagada is None else microsegundos(pagada),
+        ])
+    return etl.renombrar_columnas_raw(pd.DataFrame(registros, columns=COLUMNAS_QUERY + COLUMNAS_TIPADAS))
+
+
+class LecturaTipadaTest(unittest.TestCase):
+
+    def assert_mismo_resultado(self, filas, compactos=False):
+        texto, tipada = raw_texto(filas), raw_tipada(filas)
+        if compactos:
+            texto, tipada = etl.compactar_raw(texto), etl.compactar_raw(tipada)
+
+        esperado = etl.transformar(texto)
+        obtenido = etl.transformar(tipada)
+        pd.testing.assert_frame_equal(esperado, obtenido, check_dtype=True, check_categorical=False)
+        return obtenido
+
+    def test_mismo_frame(self):
+        obtenido = self.assert_mismo_resultado(FILAS)
+        self.assertEqual(obtenido["created_at"].dtype, "datetime64[ns]")
+        self.assertTrue(np.signbit(obtenido["amount"][4]))
+
+    def test_mismo_frame_tipos_compactos(self):
+        self.assert_mismo_resultado(FILAS, compactos=True)
+
+    def test_todo_tipado(self):
+        # Sin texto por convertir en ninguna columna
+        self.assert_mismo_resultado([FILAS[0], FILAS[2]])
+
+    def test_fechas_como_objetos(self):
+        # Una fecha con zona horaria en el texto deja la columna como objetos, como con QUERY_RAW
+        con_zona = ((("a8",) + FILAS[0][0][1:5] + ("2019-01-01T10:00:00+02:00",) + FILAS[0][0][6:]),
+                    12.5, None, "2019-03-20")
+        obtenido = self.assert_mismo_resultado([FILAS[0], con_zona])
+        self.assertEqual(obtenido["created_at"].dtype, object)
+
+
+if __name__ == "__main__":
+    unittest.main()
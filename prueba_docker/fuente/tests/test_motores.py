@@ -0,0 +1,111 @@
+# fuente/tests/test_motores.py
+# El motor Arrow y el motor pandas deben dar exactamente el mismo resultado.
+# No usa la base: las filas crudas se arman aquí, igual que las entregan
+# traer_raw_df (con tipos compactos) y traer_raw_arrow.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+import motor_arrow
+
+COMPANY_A = "cbf1c8b09cd5b549416d49d220a40cbd317f952e"
+COMPANY_B = "d" * 40
+
+# Columnas de QUERY_RAW
+COLUMNAS_QUERY = ["id", "name", "company_id", "amount", "status", "created_at", "paid_at"]
+
+# Una fila por caso: montos que Arrow convierte (decimales simples) y los que
+# quedan para pandas (enteros, exponentes, espacios, texto, nulos, -0.0, fuera
+# de rango); fechas en cada formato de limpiar_fechas, imposibles, vacías y
+# nulas; y cada regla de REGLAS_CHARGES
+FILAS_CRUDAS = [
+    ("a1", "MiPasajefy", COMPANY_A, "12.50", "paid", "2019-03-19", "2019-03-20"),
+    ("a2", "MiPasajefy", COMPANY_A, "7", "voided", "20190121.0", None),
+    (None, "MiPasajefy", COMPANY_A, "3.0", "paid", "2019-01-01 10:00:00", None),
+    ("a4", "MiPas", "corto", "abc", "paid", "Jan 5 2019", ""),
+    ("a5", "Muebles chidos", COMPANY_B, "1e3", "estado_raro", None, "nope"),
+    ("a6", "Muebles chidos", COMPANY_B, " 4.5", "refunded", "2019-02-30", "20190205"),
+    ("a7", "MiPasajefy", COMPANY_A, None, "paid", "2019-05-01T08:30:00.123456", "2019-05-02"),
+    ("a8", "MiPasajefy", COMPANY_A, "1e20", "paid", "2019-05-01", "2019-05-02"),
+    ("a9", "Muebles chidos", COMPANY_B, "-0.0", "pending_payment", "20190501", "2019-05-02 00:00:00"),
+    ("a10", "MiPasajefy", COMPANY_A, "1234567890123.4567", "paid", " 2019-06-01 ", "2019/06/02"),
+    ("a1", "MiPasajefy", COMPANY_A, "99.99", "paid", "2019-03-19", "2019-03-21"),
+]
+
+
+def raw_pandas(filas):
+    # Como traer_raw_df con tipos compactos
+    df = pd.DataFrame(filas, columns=COLUMNAS_QUERY)
+    return etl.compactar_raw(etl.renombrar_columnas_raw(df))
+
+
+def raw_arrow(filas):
+    # Como traer_raw_arrow: todas las columnas como texto
+    return pa.table({
+        nombre: pa.array(valores, pa.string())
+        for nombre, valores in zip(motor_arrow.COLUMNAS_RAW_ARROW, zip(*filas))
+    })
+
+
+def assert_frames_iguales(esperado, obtenido):
+    # Mismos valores, NaN/NaT, índice y dtypes. Las categorías de Arrow quedan en
+    # orden de aparición y las de pandas ordenadas; un CategoricalDtype sin orden
+    # es igual con las mismas categorías en cualquier orden
+    pd.testing.assert_frame_equal(esperado, obtenido, check_dtype=True, check_categorical=False)
+
+
+class MotoresIgualesTest(unittest.TestCase):
+
+    def test_transformar(self):
+        esperado = etl.transformar(raw_pandas(FILAS_CRUDAS))
+        obtenido = motor_arrow.tabla_a_pandas(motor_arrow.transformar_arrow(raw_arrow(FILAS_CRUDAS)))
+
+        assert_frames_iguales(esperado, obtenido)
+        pd.testing.assert_series_equal(obtenido["amount"], pd.Series(
+            [12.5, 7.0, 3.0, np.nan, 1000.0, 4.5, np.nan, 1e20, -0.0, 1234567890123.4567, 99.99], name="amount"
+        ))
+        self.assertTrue(np.signbit(obtenido["amount"][8]))
+        self.assertEqual(obtenido["created_at"].dtype, "datetime64[ns]")
+        self.assertEqual(obtenido["created_at"].isna().tolist(), [False] * 4 + [True, True] + [False] * 5)
+        self.assertEqual(obtenido["updated_at"].isna().tolist(), [False] + [True] * 4 + [False] * 6)
+
+    def test_clasificar_charges(self):
+        validos, alertas = etl.clasificar_charges(etl.transformar(raw_pandas(FILAS_CRUDAS)))
+        validos_arrow, alertas_arrow = motor_arrow.clasificar_charges_arrow(
+            motor_arrow.transformar_arrow(raw_arrow(FILAS_CRUDAS)))
+
+        assert_frames_iguales(validos, validos_arrow)
+        assert_frames_iguales(alertas, alertas_arrow)
+        self.assertEqual(
+            set(alertas_arrow["regla"]),
+            {"id_nulo", "company_id_invalido", "amount_invalido", "status_invalido", "created_at_nulo"}
+        )
+
+    def test_montos_enteros(self):
+        # Sin ningún decimal pandas deja amount como int64, y Arrow también
+        filas = [fila[:3] + ("15",) + fila[4:] for fila in FILAS_CRUDAS[:2]]
+        esperado = etl.transformar(raw_pandas(filas))
+        obtenido = motor_arrow.tabla_a_pandas(motor_arrow.transformar_arrow(raw_arrow(filas)))
+
+        assert_frames_iguales(esperado, obtenido)
+        self.assertEqual(obtenido["amount"].dtype, "int64")
+
+    def test_fechas_como_objetos(self):
+        # pandas deja como objetos una columna con fechas con y sin zona horaria
+        filas = [FILAS_CRUDAS[0][:5] + ("2019-01-01T10:00:00+02:00",) + FILAS_CRUDAS[0][6:]] + FILAS_CRUDAS[1:2]
+        self.assertEqual(etl.transformar(raw_pandas(filas))["created_at"].dtype, object)
+        with self.assertRaises(motor_arrow.MotorArrowNoAplica):
+            motor_arrow.transformar_arrow(raw_arrow(filas))
+
+
+if __name__ == "__main__":
+    unittest.main()
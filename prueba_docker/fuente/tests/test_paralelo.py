@@ -0,0 +1,115 @@
+# fuente/tests/test_paralelo.py
+# validar_charges_en_paralelo (ETL_TRABAJADORES > 1) debe dar exactamente lo
+# mismo que validar_charges(transformar(df)). No usa la base: las filas crudas
+# y el catálogo se arman aquí.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+
+# Columnas de QUERY_RAW
+COLUMNAS_QUERY = ["id", "name", "company_id", "amount", "status", "created_at", "paid_at"]
+
+NOMBRES = ["MiPasajefy", "Muebles chidos", "Tecno ma", "Luca ri", "Pasa je", "Chidos tec"]
+# Con estos company_id, 2 y 3 trabajadores reciben cada uno al menos una compañía
+COMPANIAS = [hashlib.sha1(nombre.encode()).hexdigest() for nombre in NOMBRES]
+STATUS = ["paid", "voided", "pending_payment", "refunded", "estado_raro"]
+FECHAS = ["2019-03-19", "20190121.0", "2019-01-01 10:00:00", "Jan 5 2019", None, "2019-02-30"]
+MONTOS = ["12.50", "7", "3.0", "abc", None, "1e3", "-0.0", "1e20"]
+
+
+def filas_crudas(n=120):
+    # Varias compañías, para que cada trabajador reciba una partición, con
+    # company_id por reparar, ids nulos y repetidos y cada regla de REGLAS_CHARGES
+    filas = []
+    for i in range(n):
+        compania = i % len(COMPANIAS)
+        company_id = COMPANIAS[compania]
+        if i % 11 == 0:
+            company_id = "corto" if i % 2 else None
+        filas.append((
+            None if i % 17 == 0 else f"id{i % 100}",
+            NOMBRES[compania],
+            company_id,
+            MONTOS[i % len(MONTOS)],
+            STATUS[i % len(STATUS)],
+            FECHAS[i % len(FECHAS)],
+            FECHAS[(i + 1) % len(FECHAS)],
+        ))
+    filas.append(("sin_compania", "Desconocida", "corto", "1.5", "paid", "2019-03-19", None))
+    return filas
+
+
+def raw(filas):
+    return etl.renombrar_columnas_raw(pd.DataFrame(filas, columns=COLUMNAS_QUERY))
+
+
+def catalogo():
+    return pd.DataFrame({"company_id": COMPANIAS, "company_name": NOMBRES})
+
+
+class ParaleloTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        etl.cerrar_ejecutor()
+
+    def assert_mismo_resultado(self, df, trabajadores, en_serie=False):
+        esperado = etl.validar_charges(etl.transformar(df.copy()), catalogo())
+        salida = io.StringIO()
+        with contextlib.redirect_stdout(salida):
+            obtenido = etl.validar_charges_en_paralelo(df, catalogo(), trabajadores)
+        self.assertEqual("se valida en serie" in salida.getvalue(), en_serie)
+
+        for nombre, e, o in zip(["válidos", "alertas"], esperado, obtenido):
+            with self.subTest(trabajadores=trabajadores, resultado=nombre):
+                pd.testing.assert_frame_equal(e, o, check_dtype=True)
+        return obtenido
+
+    def test_mismo_resultado(self):
+        df = raw(filas_crudas())
+        for trabajadores in [2, 3]:
+            validos, alertas = self.assert_mismo_resultado(df, trabajadores)
+        self.assertGreater(len(validos), 0)
+        self.assertEqual(set(alertas["regla"]), {"id_nulo", "company_id_invalido", "amount_invalido",
+                                                 "status_invalido", "created_at_nulo"})
+
+    def test_indice_original(self):
+        # Las filas conservan el índice de entrada, como en el camino serial
+        df = raw(filas_crudas())
+        df = df.set_axis(pd.RangeIndex(1000, 1000 + len(df)))
+        self.assert_mismo_resultado(df, 2)
+
+    def test_tipos_compactos(self):
+        # Con ETL_TIPOS_COMPACTOS las categóricas y el texto Arrow pasan igual por los trabajadores
+        validos, _ = self.assert_mismo_resultado(etl.compactar_raw(raw(filas_crudas())), 3)
+        self.assertIsInstance(validos["status"].dtype, pd.CategoricalDtype)
+
+    def test_dtypes_distintos_entre_particiones(self):
+        # Una partición con montos enteros y otra con decimales se unen como float64
+        filas = [fila[:3] + ("15",) + fila[4:] if fila[2] == COMPANIAS[0] else fila[:3] + ("2.5",) + fila[4:]
+                 for fila in filas_crudas()]
+        validos, _ = self.assert_mismo_resultado(raw(filas), 3)
+        self.assertEqual(validos["amount"].dtype, "float64")
+
+    def test_fechas_con_zona_en_una_particion(self):
+        # pandas deja como objetos una columna con fechas con y sin zona; el
+        # resultado no se puede unificar por partición y se valida en serie
+        filas = [fila[:5] + ("2019-01-01T10:00:00+02:00" if fila[1] == NOMBRES[0] else "2019-03-19",) + fila[6:]
+                 for fila in filas_crudas()]
+        validos, _ = self.assert_mismo_resultado(raw(filas), 2, en_serie=True)
+        self.assertEqual(validos["created_at"].dtype, object)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+# fuente/tests/test_pipeline.py
+# main_en_pipeline (ETL_PIPELINE=1) debe cargar los mismos charges, en el mismo
+# orden, que main_por_chunks, y detenerse si falla una etapa. No usa la base: la
+# lectura de chunks, el catálogo y las cargas se reemplazan por versiones en memoria.
+#
+#   python -m unittest discover -s prueba_docker/fuente/tests
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etl
+
+# Columnas de QUERY_RAW
+COLUMNAS_QUERY = ["id", "name", "company_id", "amount", "status", "created_at", "paid_at"]
+
+NOMBRES = ["MiPasajefy", "Muebles chidos", "Tecno ma"]
+COMPANIAS = [hashlib.sha1(nombre.encode()).hexdigest() for nombre in NOMBRES]
+FECHAS = ["2019-03-19", "20190121.0", "2019-01-01 10:00:00", None]
+
+TAMANO_CHUNK = 7
+
+
+def filas_crudas(n=40):
+    # Ids que se repiten en chunks distintos, company_id por reparar y filas con alerta
+    return [(
+        f"id{i % 25}",
+        NOMBRES[i % len(NOMBRES)],
+        "corto" if i % 9 == 0 else COMPANIAS[i % len(COMPANIAS)],
+        f"{i}.5" if i % 13 else "abc",
+        "paid" if i % 11 else "estado_raro",
+        FECHAS[i % len(FECHAS)],
+        FECHAS[(i + 1) % len(FECHAS)],
+    ) for i in range(n)]
+
+
+class CargaEnMemoria:
+    """Reemplaza la lectura, el catálogo y las cargas de etl mientras dura el bloque."""
+
+    def __init__(self, filas, fallar_lectura_en=None, fallar_carga_en=None):
+        self.filas = filas
+        self.fallar_lectura_en = fallar_lectura_en
+        self.fallar_carga_en = fallar_carga_en
+        self.cargados = []
+
+    def iterar_raw_chunks(self, tamano_chunk, *args, **kwargs):
+        for numero, inicio in enumerate(range(0, len(self.filas), tamano_chunk), start=1):
+            if numero == self.fallar_lectura_en:
+                raise RuntimeError("falló la lectura")
+            chunk = pd.DataFrame(self.filas[inicio:inicio + tamano_chunk], columns=COLUMNAS_QUERY)
+            yield etl.renombrar_columnas_raw(chunk)
+
+    def cargar_catalogo(self, *args, **kwargs):
+        return pd.DataFrame({"company_id": COMPANIAS, "company_name": NOMBRES})
+
+    def load_charges(self, df, *args, **kwargs):
+        if len(self.cargados) + 1 == self.fallar_carga_en:
+            return None
+        self.cargados.append(df)
+        return len(df), 0
+
+    @contextlib.contextmanager
+    def activa(self):
+        with contextlib.ExitStack() as pila:
+            for nombre in ["iterar_raw_chunks", "cargar_catalogo", "load_charges"]:
+                pila.enter_context(mock.patch.object(etl, nombre, getattr(self, nombre)))
+            pila.enter_context(mock.patch.object(etl, "guardar_alertas", lambda *args, **kwargs: None))
+            pila.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            yield self
+
+
+class PipelineTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        etl.cerrar_ejecutor()
+
+    def test_mismo_resultado_que_por_chunks(self):
+        for trabajadores in [1, 2]:
+            with self.subTest(trabajadores=trabajadores):
+                with CargaEnMemoria(filas_crudas()).activa() as por_chunks:
+                    self.assertTrue(etl.main_por_chunks(TAMANO_CHUNK, trabajadores=trabajadores))
+                with CargaEnMemoria(filas_crudas()).activa() as en_pipeline:
+                    self.assertTrue(etl.main_en_pipeline(TAMANO_CHUNK, trabajadores=trabajadores, profundidad=1))
+
+                self.assertEqual(len(en_pipeline.cargados), len(por_chunks.cargados))
+                for esperado, obtenido in zip(por_chunks.cargados, en_pipeline.cargados):
+                    pd.testing.assert_frame_equal(esperado, obtenido)
+
+    def test_falla_una_carga(self):
+        # Se cancela el pipeline: no se cargan más chunks y no se avanza la marca
+        with CargaEnMemoria(filas_crudas(), fallar_carga_en=2).activa() as carga:
+            self.assertFalse(etl.main_en_pipeline(TAMANO_CHUNK, profundidad=1))
+        self.assertEqual(len(carga.cargados), 1)
+
+    def test_falla_la_lectura(self):
+        with CargaEnMemoria(filas_crudas(), fallar_lectura_en=3).activa():
+            with self.assertRaisesRegex(RuntimeError, "falló la lectura"):
+                etl.main_en_pipeline(TAMANO_CHUNK, profundidad=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
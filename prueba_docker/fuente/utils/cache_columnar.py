@@ -0,0 +1,110 @@
+# fuente/utils/cache_columnar.py
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import pandas as pd
+import pyarrow as pa
+
+# ────────────────────────────────────────────────
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CACHE_DIR = os.getenv("ETL_CACHE_DIR", os.path.join(BASE_DIR, "data", "cache"))
+
+# Tamaño máximo del directorio de caché; al superarlo se borran las entradas menos usadas
+CACHE_MAX_BYTES = int(float(os.getenv("ETL_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+
+EXTENSION = ".arrow"
+
+
+# ────────────────────────────────────────────────
+
+def clave_cache(*partes) -> str:
+    """Clave de una entrada: hash SHA-256 de las partes (huella de los datos, versión, ...)."""
+    texto = json.dumps(partes, default=str, sort_keys=True)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def guardar(clave: str, frames: Dict[str, pd.DataFrame], directorio: str = CACHE_DIR,
+            max_bytes: int = CACHE_MAX_BYTES) -> bool:
+    """
+    Guarda cada DataFrame como un archivo Arrow IPC sin comprimir, para
+    poder leerlo después con memory-map. La entrada se escribe en un
+    directorio temporal y se renombra al final, así nunca queda una entrada
+    a medias. Retorna False si algún DataFrame no se puede convertir a Arrow.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, clave)
+    temporal = tempfile.mkdtemp(prefix=f".{clave[:12]}_", dir=directorio)
+
+    try:
+        for nombre, df in frames.items():
+            tabla = pa.Table.from_pandas(df, preserve_index=True)
+            with pa.OSFile(os.path.join(temporal, nombre + EXTENSION), "wb") as archivo:
+                with pa.ipc.new_file(archivo, tabla.schema) as escritor:
+                    escritor.write_table(tabla)
+
+        shutil.rmtree(destino, ignore_errors=True)
+        os.replace(temporal, destino)
+
+    except (pa.ArrowException, OSError) as e:
+        shutil.rmtree(temporal, ignore_errors=True)
+        print(f"No se pudo guardar en caché: {e}")
+        return False
+
+    desalojar(directorio, max_bytes, conservar=clave)
+    return True
+
+
+def leer(clave: str, directorio: str = CACHE_DIR,
+         zero_copy: bool = False) -> Optional[Dict[str, pd.DataFrame]]:
+    """
+    Retorna {nombre: DataFrame} de la entrada, o None si no existe.
+
+    Los archivos se abren con memory-map. Con zero_copy=True las columnas
+    quedan respaldadas por Arrow (pd.ArrowDtype) sin copiar los datos del
+    archivo; si no, se reconstruyen los mismos dtypes de pandas guardados.
+    """
+    ruta = os.path.join(directorio, clave)
+    if not os.path.isdir(ruta):
+        return None
+
+    frames = {}
+    for archivo in sorted(os.listdir(ruta)):
+        if not archivo.endswith(EXTENSION):
+            continue
+        with pa.memory_map(os.path.join(ruta, archivo), "r") as origen:
+            tabla = pa.ipc.open_file(origen).read_all()
+        if zero_copy:
+            frames[archivo[:-len(EXTENSION)]] = tabla.to_pandas(types_mapper=pd.ArrowDtype)
+        else:
+            frames[archivo[:-len(EXTENSION)]] = tabla.to_pandas()
+
+    # La fecha de modificación marca el último uso, para el desalojo
+    os.utime(ruta)
+    return frames
+
+
+def desalojar(directorio: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES,
+              conservar: Optional[str] = None) -> None:
+    """Borra las entradas usadas hace más tiempo hasta que el total quepa en max_bytes."""
+    entradas = []
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        if nombre.startswith(".") or not os.path.isdir(ruta):
+            continue
+        tamano = sum(entrada.stat().st_size for entrada in os.scandir(ruta))
+        entradas.append((os.path.getmtime(ruta), nombre, ruta, tamano))
+
+    total = sum(tamano for *_, tamano in entradas)
+    for _, nombre, ruta, tamano in sorted(entradas):
+        if total <= max_bytes:
+            break
+        if nombre == conservar:
+            continue
+        shutil.rmtree(ruta, ignore_errors=True)
+        total -= tamano
+        print(f"Entrada de caché desalojada: {nombre[:12]}")
@@ -1,8 +1,15 @@
 # fuente/utils/db_config.py
 import os
+import threading
+import time
+from contextlib import contextmanager
 from typing import Optional, Tuple
 import psycopg2
 from psycopg2 import DatabaseError, OperationalError
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import STATUS_READY
+
+from utils import metricas
 
 # ────────────────────────────────────────────────
 
@@ -12,12 +19,239 @@ DB_NAME = os.getenv("DB_NAME", "charges_db")
 DB_USER = os.getenv("DB_USER", "admin")
 DB_PASS = os.getenv("DB_PASSWORD", "admin1234")
 
+# Pool de conexiones compartido por todo el proceso
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "8"))
+# Segundos que vive una conexión antes de reemplazarla por una nueva
+DB_POOL_VIDA_MAXIMA = float(os.getenv("DB_POOL_VIDA_MAXIMA", "1800"))
+# Segundos sin uso tras los cuales una conexión se verifica (SELECT 1) antes de entregarla
+DB_POOL_INACTIVIDAD = float(os.getenv("DB_POOL_INACTIVIDAD", "60"))
+
+
+# ────────────────────────────────────────────────
+
+class PoolConexiones:
+    """
+    Pool de conexiones seguro entre hilos.
+
+    - Mantiene entre `minimo` y `maximo` conexiones abiertas; si están todas
+      en uso, obtener() espera a que se libere una en vez de fallar.
+    - Al entregar una conexión la reemplaza si superó `vida_maxima`
+      segundos. Solo verifica que siga viva (SELECT 1) si volvió con la
+      transacción en un estado inesperado o si pasó más de `inactividad`
+      segundos sin usarse; las que vuelven cerradas se descartan en devolver().
+    - Las conexiones se devuelven sin transacción abierta.
+    """
+
+    def __init__(self, minimo: int = DB_POOL_MIN, maximo: int = DB_POOL_MAX,
+                 vida_maxima: float = DB_POOL_VIDA_MAXIMA,
+                 inactividad: float = DB_POOL_INACTIVIDAD):
+        self.vida_maxima = vida_maxima
+        self.inactividad = inactividad
+        self._pool = pg_pool.ThreadedConnectionPool(
+            minimo,
+            maximo,
+            host=DB_HOST,
+            port=DB_PORT,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASS,
+        )
+        self._libres = threading.BoundedSemaphore(maximo)
+        self._creadas = {}
+        self._usadas = {}
+        self._lock = threading.Lock()
+
+    def obtener(self) -> psycopg2.extensions.connection:
+        self._libres.acquire()
+        try:
+            while True:
+                conn = self._pool.getconn()
+                ahora = time.monotonic()
+                with self._lock:
+                    creada = self._creadas.setdefault(conn, ahora)
+                    usada = self._usadas.get(conn, ahora)
+
+                verificar = ahora - usada > self.inactividad
+                if ahora - creada < self.vida_maxima and self._sana(conn, verificar):
+                    return conn
+
+                self._descartar(conn)
+
+        except Exception:
+            self._libres.release()
+            raise
+
+    def devolver(self, conn: psycopg2.extensions.connection, cerrar: bool = False) -> None:
+        try:
+            if not conn.closed and conn.status != STATUS_READY:
+                conn.rollback()
+        except Exception:
+            cerrar = True
+
+        try:
+            if cerrar or conn.closed:
+                self._descartar(conn)
+            else:
+                with self._lock:
+                    self._usadas[conn] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._libres.release()
+
+    def cerrar(self) -> None:
+        self._pool.closeall()
+        with self._lock:
+            self._creadas.clear()
+            self._usadas.clear()
+
+    @staticmethod
+    def _sana(conn, verificar: bool) -> bool:
+        if conn.closed:
+            return False
+        if not verificar and conn.status == STATUS_READY:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, conn) -> None:
+        with self._lock:
+            self._creadas.pop(conn, None)
+            self._usadas.pop(conn, None)
+        self._pool.putconn(conn, close=True)
+
+
+_pool: Optional[PoolConexiones] = None
+_pool_lock = threading.Lock()
+
+# Conexión fijada por transaccion_unica(); mientras exista, todas las etapas la usan
+_conexion_fija: Optional[psycopg2.extensions.connection] = None
+_transaccion_fallida = False
+
+
+def obtener_pool() -> PoolConexiones:
+    """Retorna el pool del proceso, creándolo en el primer uso."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PoolConexiones()
+            print("Conexión establecida con éxito.")
+        return _pool
+
+
+def cerrar_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.cerrar()
+            _pool = None
+            print("Conexión cerrada.")
+
+
+@contextmanager
+def conexion():
+    """
+    Entrega (conn, cursor) tomados del pool:
+
+        with conexion() as (conn, cur):
+            cur.execute(...)
+
+    Al salir sin errores hace commit; si hay una excepción hace rollback y
+    la relanza. La conexión siempre vuelve al pool.
+
+    Dentro de transaccion_unica() entrega la conexión fijada y no hace
+    commit: el commit (o rollback) lo hace transaccion_unica al terminar.
+    """
+    global _transaccion_fallida
+
+    fija = _conexion_fija
+    if fija is not None:
+        inicio = time.perf_counter()
+        cursor = fija.cursor()
+        try:
+            yield fija, cursor
+        except Exception:
+            _transaccion_fallida = True
+            raise
+        finally:
+            cursor.close()
+            metricas.evento("db", segundos=round(time.perf_counter() - inicio, 6), fija=True)
+        return
+
+    pool = obtener_pool()
+    inicio = time.perf_counter()
+    conn = pool.obtener()
+    espera = time.perf_counter() - inicio
+    cursor = conn.cursor()
+    try:
+        yield conn, cursor
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if not conn.closed:
+            cursor.close()
+        pool.devolver(conn)
+        # Tiempo con la conexión tomada (consultas + commit) y espera por el pool
+        metricas.evento("db", segundos=round(time.perf_counter() - inicio - espera, 6),
+                        espera_pool=round(espera, 6))
+
+
+def transaccion_unica_activa() -> bool:
+    """True dentro de transaccion_unica(): todas las etapas comparten una conexión."""
+    return _conexion_fija is not None
+
+
+@contextmanager
+def transaccion_unica():
+    """
+    Ejecuta todo lo que ocurra dentro del bloque en una sola transacción.
+
+    Fija una conexión del pool para todo el proceso (también para otros
+    hilos): conexion() la entrega a cada etapa sin hacer commit. Una misma
+    conexión no admite dos COPY a la vez, así que las etapas que copian en
+    paralelo deben consultar transaccion_unica_activa(). Al salir se
+    hace un único commit; si alguna etapa falló, aunque haya atrapado el
+    error, se hace rollback de todo.
+    """
+    global _conexion_fija, _transaccion_fallida
+
+    if _conexion_fija is not None:
+        raise RuntimeError("Ya hay una transacción única en curso")
+
+    pool = obtener_pool()
+    conn = pool.obtener()
+    _conexion_fija, _transaccion_fallida = conn, False
+    try:
+        yield conn
+        if _transaccion_fallida:
+            conn.rollback()
+            print("Una etapa falló: se revirtió la transacción completa.")
+        else:
+            conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        _conexion_fija = None
+        pool.devolver(conn)
+
 
 # ────────────────────────────────────────────────
 
 class DatabaseConnection:
     """
     Clase para manejar conexión a PostgreSQL de forma similar al estilo anterior.
+    La conexión se toma del pool del proceso y close() la devuelve al pool.
+    Para código nuevo es preferible el context manager conexion().
     Uso recomendado:
 
         db = DatabaseConnection()
@@ -47,15 +281,8 @@ class DatabaseConnection:
             return self.conn, self.cursor
 
         try:
-            self.conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASS,
-            )
+            self.conn = obtener_pool().obtener()
             self.cursor = self.conn.cursor()
-            print("Conexión establecida con éxito.")
             return self.conn, self.cursor
 
         except OperationalError as e:
@@ -66,7 +293,7 @@ class DatabaseConnection:
             return None, None
 
     def close(self) -> None:
-        """Cierra cursor y conexión de forma segura."""
+        """Cierra el cursor y devuelve la conexión al pool."""
         if self.cursor:
             try:
                 self.cursor.close()
@@ -74,10 +301,9 @@ class DatabaseConnection:
                 pass
             self.cursor = None
 
-        if self.conn and not self.conn.closed:
+        if self.conn:
             try:
-                self.conn.close()
-                print("Conexión cerrada.")
+                obtener_pool().devolver(self.conn)
             except Exception:
                 pass
             self.conn = None
@@ -0,0 +1,293 @@
+# fuente/utils/indice_empresas.py
+"""
+Índice en memoria de nombres de compañía (ya normalizados) → company_id,
+para corregir los company_id dudosos a partir del nombre.
+
+- Búsqueda exacta con un dict.
+- Búsqueda aproximada por trigramas, como pg_trgm: la similitud entre dos
+  nombres es la de Jaccard entre sus conjuntos de trigramas. Un índice
+  invertido trigrama → entradas entrega los candidatos y, con filtrado por
+  prefijo, solo se recorren las listas de los trigramas menos frecuentes de
+  la consulta: un nombre con similitud ≥ umbral comparte por fuerza alguno
+  de ellos. Así una búsqueda no recorre todo el catálogo.
+
+Lo construido en bloque vive en arreglos de numpy (formato CSR); las altas y
+cambios posteriores van a un índice delta en dicts, que se funde con la
+base al compactar.
+"""
+import math
+import os
+import pickle
+import tempfile
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# ────────────────────────────────────────────────
+
+# Cambia si cambia la estructura guardada en disco
+FORMATO = 1
+
+# Al guardar, si el delta supera esta fracción de la base se reconstruye todo junto
+FRACCION_COMPACTAR = 0.25
+
+
+def trigramas(nombre: str) -> set:
+    # Igual que pg_trgm: cada palabra con dos espacios delante y uno detrás
+    resultado = set()
+    for palabra in nombre.split():
+        relleno = f"  {palabra} "
+        resultado.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return resultado
+
+
+class IndiceEmpresas:
+    """
+    Cada entrada es un nombre normalizado distinto. Si varias compañías
+    comparten nombre se resuelve a la de menor company_id. version es la
+    versión de dbo.companies con la que está sincronizado (la fija quien lo
+    construye).
+    """
+
+    def __init__(self, umbral: float = 0.8):
+        self.umbral = umbral
+        self.version = None
+
+        self._nombres: List[str] = []            # entrada → nombre
+        self._ids: List[Optional[str]] = []      # entrada → company_id (None si quedó vacía)
+        self._exacto = {}                        # nombre → entrada
+        self._entrada_de = {}                    # company_id → entrada
+        self._compartidas = {}                   # entrada → set de company_id, solo si hay más de uno
+        self._vocabulario = {}                   # trigrama → número
+
+        # Base en CSR: trigramas de cada entrada y entradas de cada trigrama
+        self._base = 0
+        self._tri_offsets = np.zeros(1, dtype=np.int64)
+        self._tri_valores = np.zeros(0, dtype=np.int32)
+        self._post_offsets = np.zeros(1, dtype=np.int64)
+        self._post_valores = np.zeros(0, dtype=np.int32)
+
+        # Delta: entradas agregadas después de construir la base
+        self._delta_trigramas = {}               # entrada → frozenset de trigramas
+        self._delta_postings = {}                # trigrama → lista de entradas
+
+    # ────────────────────────────────────────────────
+    # Construcción y actualización
+
+    @classmethod
+    def construir(cls, company_ids: Iterable, nombres: Iterable, umbral: float = 0.8) -> "IndiceEmpresas":
+        """Índice de los pares (company_id, nombre normalizado); gana el último de cada company_id."""
+        indice = cls(umbral)
+
+        pares = pd.DataFrame({"company_id": np.asarray(company_ids, dtype=object),
+                              "nombre": np.asarray(nombres, dtype=object)})
+        pares = pares.drop_duplicates("company_id", keep="last")
+
+        codigos, unicos = pd.factorize(pares["nombre"])
+        elegidos = pares["company_id"].groupby(codigos).min()
+
+        indice._nombres = list(unicos)
+        indice._ids = elegidos.reindex(range(len(unicos))).tolist()
+        indice._exacto = {nombre: entrada for entrada, nombre in enumerate(indice._nombres)}
+        indice._entrada_de = dict(zip(pares["company_id"], codigos.tolist()))
+
+        repetidos = pd.Series(codigos).duplicated(keep=False).to_numpy()
+        if repetidos.any():
+            grupos = pares["company_id"][repetidos].groupby(codigos[repetidos])
+            indice._compartidas = {int(entrada): set(ids) for entrada, ids in grupos}
+
+        # Trigramas de cada entrada, numerados en el vocabulario
+        vocabulario = indice._vocabulario
+        largos = np.zeros(len(unicos), dtype=np.int64)
+        valores = []
+        for entrada, nombre in enumerate(indice._nombres):
+            tris = [vocabulario.setdefault(t, len(vocabulario)) for t in trigramas(nombre)]
+            largos[entrada] = len(tris)
+            valores.extend(sorted(tris))
+
+        indice._base = len(unicos)
+        indice._tri_offsets = np.concatenate([[0], np.cumsum(largos)])
+        indice._tri_valores = np.asarray(valores, dtype=np.int32)
+
+        # Índice invertido: entradas de cada trigrama, ordenadas
+        entradas = np.repeat(np.arange(len(unicos), dtype=np.int32), largos)
+        orden = np.argsort(indice._tri_valores, kind="stable")
+        indice._post_valores = entradas[orden]
+        conteos = np.bincount(indice._tri_valores, minlength=len(vocabulario))
+        indice._post_offsets = np.concatenate([[0], np.cumsum(conteos)])
+
+        return indice
+
+    def actualizar(self, company_ids: Iterable, nombres: Iterable) -> None:
+        """Altas y cambios de nombre, en orden (gana el último de cada company_id)."""
+        for company_id, nombre in zip(company_ids, nombres):
+            anterior = self._entrada_de.get(company_id)
+            if anterior is not None:
+                if self._nombres[anterior] == nombre:
+                    continue
+                self._quitar(company_id, anterior)
+
+            entrada = self._exacto.get(nombre)
+            if entrada is None:
+                entrada = self._agregar_entrada(nombre)
+            self._poner(company_id, entrada)
+
+    def compactar(self) -> "IndiceEmpresas":
+        """Índice equivalente con todo en la base y sin entradas vacías."""
+        company_ids = list(self._entrada_de)
+        nombres = [self._nombres[self._entrada_de[c]] for c in company_ids]
+        compacto = IndiceEmpresas.construir(company_ids, nombres, self.umbral)
+        compacto.version = self.version
+        return compacto
+
+    def necesita_compactar(self) -> bool:
+        return len(self._delta_trigramas) > FRACCION_COMPACTAR * max(self._base, 1)
+
+    def _agregar_entrada(self, nombre: str) -> int:
+        entrada = len(self._nombres)
+        self._nombres.append(nombre)
+        self._ids.append(None)
+        self._exacto[nombre] = entrada
+
+        tris = frozenset(self._vocabulario.setdefault(t, len(self._vocabulario)) for t in trigramas(nombre))
+        self._delta_trigramas[entrada] = tris
+        for t in tris:
+            self._delta_postings.setdefault(t, []).append(entrada)
+        return entrada
+
+    def _poner(self, company_id: str, entrada: int) -> None:
+        self._entrada_de[company_id] = entrada
+        actual = self._ids[entrada]
+        if actual is None:
+            self._ids[entrada] = company_id
+            return
+        compartida = self._compartidas.setdefault(entrada, {actual})
+        compartida.add(company_id)
+        self._ids[entrada] = min(compartida)
+
+    def _quitar(self, company_id: str, entrada: int) -> None:
+        del self._entrada_de[company_id]
+        compartida = self._compartidas.get(entrada)
+        if compartida is None:
+            self._ids[entrada] = None
+            return
+        compartida.discard(company_id)
+        self._ids[entrada] = min(compartida)
+        if len(compartida) == 1:
+            del self._compartidas[entrada]
+
+    # ────────────────────────────────────────────────
+    # Búsqueda
+
+    def resolver(self, nombres: Iterable[str]) -> List[Optional[str]]:
+        """company_id de cada nombre normalizado; None si no hay uno o es ambiguo."""
+        return [self.buscar(nombre) for nombre in nombres]
+
+    def buscar(self, nombre: str) -> Optional[str]:
+        entrada = self._exacto.get(nombre)
+        if entrada is not None and self._ids[entrada] is not None:
+            return self._ids[entrada]
+        if self.umbral >= 1:
+            return None
+        return self._buscar_aproximado(nombre)
+
+    def _buscar_aproximado(self, nombre: str) -> Optional[str]:
+        tris = trigramas(nombre)
+        total = len(tris)
+        conocidos = [self._vocabulario[t] for t in tris if t in self._vocabulario]
+
+        # Con |A ∩ B| / |A ∪ B| ≥ umbral, B comparte al menos ceil(umbral·|A|) trigramas
+        # con A: basta con buscar candidatos en los total - minimo + 1 más raros. Los
+        # trigramas que no están en el vocabulario son los más raros y no aportan ninguno
+        minimo = math.ceil(self.umbral * total - 1e-9)
+        prefijo = total - minimo + 1 - (total - len(conocidos))
+        if total == 0 or prefijo <= 0:
+            return None
+
+        conocidos.sort(key=self._frecuencia)
+        candidatos = set()
+        for t in conocidos[:prefijo]:
+            candidatos.update(self._entradas_con(t))
+
+        consulta = set(conocidos)
+        mejor, mejor_id, empate = 0.0, None, False
+        for entrada in candidatos:
+            company_id = self._ids[entrada]
+            if company_id is None:
+                continue
+            tris_entrada = self._trigramas_de(entrada)
+            largo = len(tris_entrada)
+            # Filtro por largo: ningún par con largos muy distintos alcanza el umbral
+            if largo < self.umbral * total or self.umbral * largo > total:
+                continue
+            comunes = len(consulta.intersection(tris_entrada))
+            similitud = comunes / (total + largo - comunes)
+            if similitud > mejor:
+                mejor, mejor_id, empate = similitud, company_id, False
+            elif similitud == mejor and company_id != mejor_id:
+                empate = True
+
+        if mejor_id is None or mejor < self.umbral or empate:
+            return None
+        return mejor_id
+
+    def _frecuencia(self, trigrama: int) -> int:
+        base = 0
+        if trigrama + 1 < len(self._post_offsets):
+            base = int(self._post_offsets[trigrama + 1] - self._post_offsets[trigrama])
+        return base + len(self._delta_postings.get(trigrama, ()))
+
+    def _entradas_con(self, trigrama: int):
+        if trigrama + 1 < len(self._post_offsets):
+            yield from self._post_valores[self._post_offsets[trigrama]:self._post_offsets[trigrama + 1]].tolist()
+        yield from self._delta_postings.get(trigrama, ())
+
+    def _trigramas_de(self, entrada: int):
+        if entrada < self._base:
+            return self._tri_valores[self._tri_offsets[entrada]:self._tri_offsets[entrada + 1]].tolist()
+        return self._delta_trigramas[entrada]
+
+    def __len__(self) -> int:
+        return len(self._entrada_de)
+
+
+# ────────────────────────────────────────────────
+
+def guardar(indice: IndiceEmpresas, ruta: str, firma: str = "") -> IndiceEmpresas:
+    """
+    Guarda el índice con pickle (escritura atómica). Si el delta creció
+    demasiado se compacta antes. Retorna el índice guardado, que es el que
+    conviene seguir usando. `firma` identifica el código que normalizó los
+    nombres; cargar descarta el archivo si no coincide.
+    """
+    if indice.necesita_compactar():
+        indice = indice.compactar()
+
+    try:
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(prefix=".indice_", dir=os.path.dirname(ruta))
+        with os.fdopen(descriptor, "wb") as f:
+            pickle.dump({"formato": FORMATO, "firma": firma, "indice": indice}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        print(f"No se pudo guardar el índice de compañías: {e}")
+
+    return indice
+
+
+def cargar(ruta: str, firma: str = "") -> Optional[IndiceEmpresas]:
+    """Índice guardado en ruta, o None si no existe, es de otro formato u otra firma."""
+    try:
+        with open(ruta, "rb") as f:
+            contenido = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        print(f"Índice de compañías ilegible, se reconstruye: {e}")
+        return None
+
+    if contenido.get("formato") != FORMATO or contenido.get("firma") != firma:
+        return None
+    return contenido["indice"]
@@ -0,0 +1,238 @@
+# fuente/utils/metricas.py
+"""
+Instrumentación del ETL: tiempos, filas, bytes y memoria por etapa.
+
+Cada etapa envuelta con `etapa(...)` o `@instrumentar(...)` produce una línea
+JSON en ETL_METRICAS (una ruta de archivo, o "-" para la salida estándar):
+
+    {"ejecucion": "...", "etapa": "transformar", "ruta": "etl/transformar",
+     "segundos": 0.41, "filas_entrada": 10000, "filas_salida": 10000,
+     "memoria_pico_mb": 12.3, ...}
+
+Sin ETL_METRICAS no se mide nada y los envoltorios solo llaman a la función.
+La memoria pico se mide con tracemalloc, que es de todo el proceso: con
+etapas corriendo a la vez en varios hilos (pipeline, COPY en paralelo) el
+pico de cada una incluye lo asignado por las otras.
+
+ETL_NIVEL_LOG=DEBUG habilita los diagnósticos de depuración (conteos de nulos,
+filas por chunk, ...), que en el nivel por defecto (INFO) no se calculan.
+
+ETL_PERFILAR=<etapa> guarda un perfil de cProfile de esa etapa en
+ETL_PERFIL_ARCHIVO (perfil_<etapa>.prof por defecto), legible con pstats.
+"""
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+# ────────────────────────────────────────────────
+
+ARCHIVO_METRICAS = os.getenv("ETL_METRICAS", "")
+NIVEL_LOG = os.getenv("ETL_NIVEL_LOG", "INFO").upper()
+ETAPA_PERFIL = os.getenv("ETL_PERFILAR", "")
+ARCHIVO_PERFIL = os.getenv("ETL_PERFIL_ARCHIVO", f"perfil_{ETAPA_PERFIL}.prof")
+
+EJECUCION = uuid.uuid4().hex[:12]
+
+_local = threading.local()
+_lock = threading.Lock()
+_salida = {"pid": None, "fd": None}
+_perfil = {"perfil": None, "profundidad": 0}
+
+
+# ────────────────────────────────────────────────
+
+def activas() -> bool:
+    return bool(ARCHIVO_METRICAS)
+
+
+def depurando() -> bool:
+    return NIVEL_LOG == "DEBUG"
+
+
+def depurar(*args) -> None:
+    """print() que solo escribe en el nivel DEBUG."""
+    if depurando():
+        print(*args)
+
+
+def _pila():
+    if not hasattr(_local, "pila"):
+        _local.pila = []
+    return _local.pila
+
+
+def emitir(registro: dict) -> None:
+    """Escribe un registro como una línea JSON en ARCHIVO_METRICAS."""
+    if not activas():
+        return
+
+    linea = json.dumps({"ejecucion": EJECUCION, "ts": round(time.time(), 3), **registro},
+                       ensure_ascii=False, default=str) + "\n"
+
+    if ARCHIVO_METRICAS == "-":
+        print(linea, end="")
+        return
+
+    with _lock:
+        # Cada proceso (también los trabajadores creados con fork) abre su propio descriptor
+        if _salida["pid"] != os.getpid():
+            _salida["fd"] = os.open(ARCHIVO_METRICAS, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            _salida["pid"] = os.getpid()
+        os.write(_salida["fd"], linea.encode("utf-8"))
+
+
+def evento(nombre: str, **campos) -> None:
+    """Registro suelto (p. ej. una llamada a la base), asociado a la etapa en curso."""
+    if not activas():
+        return
+    pila = _pila()
+    emitir({"evento": nombre, "ruta": pila[-1].ruta if pila else None, **campos})
+
+
+def anotar(**campos) -> None:
+    """Agrega (o reemplaza) campos en el registro de la etapa en curso."""
+    pila = _pila() if activas() else None
+    if pila:
+        pila[-1].campos.update(campos)
+
+
+def sumar(**campos) -> None:
+    """Acumula valores numéricos en el registro de la etapa en curso."""
+    pila = _pila() if activas() else None
+    if pila:
+        for clave, valor in campos.items():
+            pila[-1].campos[clave] = pila[-1].campos.get(clave, 0) + valor
+
+
+class Medicion:
+    def __init__(self, nombre: str, ruta: str, campos: dict):
+        self.nombre = nombre
+        self.ruta = ruta
+        self.campos = campos
+        self.pico = 0
+
+
+def _pico_actual() -> int:
+    return tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+
+
+@contextmanager
+def _perfilar(nombre: str):
+    # Solo se perfila la etapa pedida, y solo su aparición más externa
+    if nombre != ETAPA_PERFIL or _perfil["profundidad"]:
+        yield
+        return
+
+    if _perfil["perfil"] is None:
+        _perfil["perfil"] = cProfile.Profile()
+
+    _perfil["profundidad"] += 1
+    _perfil["perfil"].enable()
+    try:
+        yield
+    finally:
+        _perfil["perfil"].disable()
+        _perfil["profundidad"] -= 1
+        # Se acumulan todas las apariciones (p. ej. todos los chunks) en el mismo archivo
+        _perfil["perfil"].dump_stats(ARCHIVO_PERFIL)
+
+
+@contextmanager
+def etapa(nombre: str, filas_entrada: Optional[int] = None, **campos):
+    """
+    Mide una etapa:
+
+        with etapa("transformar", filas_entrada=len(df)) as m:
+            df = transformar(df)
+            m.campos["filas_salida"] = len(df)
+
+    Registra segundos, memoria pico (tracemalloc, incluyendo las etapas
+    anidadas) y los campos anotados durante la etapa.
+    """
+    if not activas():
+        with _perfilar(nombre):
+            yield Medicion(nombre, nombre, {})
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    pila = _pila()
+    padre = pila[-1] if pila else None
+    medicion = Medicion(nombre, f"{padre.ruta}/{nombre}" if padre else nombre, dict(campos))
+    if filas_entrada is not None:
+        medicion.campos["filas_entrada"] = filas_entrada
+
+    # El pico del padre hasta ahora se guarda antes de reiniciarlo para esta etapa
+    if padre is not None:
+        padre.pico = max(padre.pico, _pico_actual())
+    tracemalloc.reset_peak()
+
+    pila.append(medicion)
+    inicio = time.perf_counter()
+    error = None
+    try:
+        with _perfilar(nombre):
+            yield medicion
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        segundos = time.perf_counter() - inicio
+        medicion.pico = max(medicion.pico, _pico_actual())
+        pila.remove(medicion)
+        if padre is not None:
+            padre.pico = max(padre.pico, medicion.pico)
+
+        registro = {
+            "etapa": nombre,
+            "ruta": medicion.ruta,
+            "hilo": threading.current_thread().name,
+            "pid": os.getpid(),
+            "segundos": round(segundos, 6),
+            "memoria_pico_mb": round(medicion.pico / 1024 / 1024, 3),
+            **medicion.campos,
+        }
+        if error:
+            registro["error"] = error
+        emitir(registro)
+
+
+def _filas(valor) -> Optional[int]:
+    # Filas de un DataFrame, o del primero de una tupla de DataFrames
+    if isinstance(valor, tuple) and valor:
+        valor = valor[0]
+    return len(valor) if hasattr(valor, "columns") else None
+
+
+def instrumentar(nombre: Optional[str] = None):
+    """
+    Decorador que envuelve la función en etapa(...). Si el primer argumento
+    o el resultado son DataFrames, registra sus filas como filas_entrada y
+    filas_salida.
+    """
+    def decorador(funcion):
+        etiqueta = nombre or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltorio(*args, **kwargs):
+            if not activas() and etiqueta != ETAPA_PERFIL:
+                return funcion(*args, **kwargs)
+
+            with etapa(etiqueta, filas_entrada=_filas(args[0]) if args else None) as medicion:
+                resultado = funcion(*args, **kwargs)
+                filas = _filas(resultado)
+                if filas is not None:
+                    medicion.campos["filas_salida"] = filas
+                return resultado
+
+        return envoltorio
+
+    return decorador
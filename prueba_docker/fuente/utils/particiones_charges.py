@@ -0,0 +1,292 @@
+# fuente/utils/particiones_charges.py
+"""
+Particiones mensuales de dbo.charges y merge de un lote de charges en ellas.
+
+dbo.charges está particionada por mes de created_at (ver init/01_init.sql).
+load_charges de etl.py crea las particiones que falten, copia el lote a
+staging y lo fusiona con fusionar_charges; preparar_esquema convierte con
+particionar_charges una dbo.charges creada antes de particionarla.
+"""
+import numpy as np
+import pandas as pd
+
+# ────────────────────────────────────────────────
+
+#FUNCIONES PARA LAS PARTICIONES MENSUALES DE dbo.charges
+SQL_PARTICIONES_CHARGES = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'dbo.charges'::regclass
+"""
+
+SQL_CREAR_PARTICION = """
+    CREATE TABLE IF NOT EXISTS dbo.{nombre} PARTITION OF dbo.charges
+        FOR VALUES FROM (%(desde)s) TO (%(hasta)s)
+"""
+
+
+def hora_local(serie):
+    """
+    Fechas con zona horaria como su hora local, sin zona: es lo que guarda
+    una columna TIMESTAMP al recibirlas por COPY (to_csv escribe el desfase
+    y PostgreSQL lo ignora; csv_arrow quita la zona). Una columna de objetos
+    (zonas mezcladas) se convierte valor por valor. load_charges la aplica
+    antes de calcular las particiones y de copiar, para que ambos vean la
+    misma fecha.
+    """
+    if getattr(serie.dtype, "tz", None) is not None:
+        return serie.dt.tz_localize(None)
+    if serie.dtype == object:
+        valores = [v.replace(tzinfo=None) if getattr(v, "tzinfo", None) is not None else v for v in serie]
+        return pd.Series(pd.to_datetime(valores), index=serie.index, name=serie.name)
+    return serie
+
+
+def meses_charges(created_at):
+    """Primer día de cada mes con charges, ordenados (numpy datetime64[M])."""
+    meses = np.asarray(created_at, dtype="datetime64[ns]").astype("datetime64[M]")
+    return np.unique(meses[~np.isnat(meses)])
+
+
+def nombre_particion(mes):
+    return f"charges_{str(mes).replace('-', '')}"
+
+
+def rango_particion(mes):
+    """(desde, hasta) de la partición de un mes, como datetime."""
+    return pd.Timestamp(mes).to_pydatetime(), pd.Timestamp(mes + 1).to_pydatetime()
+
+
+def asegurar_particiones(cursor, meses):
+    """
+    Crea las particiones de dbo.charges que falten para los meses dados.
+    Crear una partición bloquea dbo.charges, así que solo se hace para los
+    meses nuevos.
+    """
+    cursor.execute(SQL_PARTICIONES_CHARGES)
+    existentes = {fila[0] for fila in cursor.fetchall()}
+
+    for mes in meses:
+        nombre = nombre_particion(mes)
+        if nombre not in existentes:
+            desde, hasta = rango_particion(mes)
+            cursor.execute(SQL_CREAR_PARTICION.format(nombre=nombre), {"desde": desde, "hasta": hasta})
+            print(f"   Partición creada: dbo.{nombre}")
+
+
+#FUNCIONES PARA FUSIONAR UN LOTE DE CHARGES CON dbo.charges
+# Como la PK de dbo.charges es (id, created_at), la unicidad de id se apoya en
+# dbo.charge_ids, que guarda el created_at vigente de cada id; la FK fk_charge_ids
+# hace que cada fila de charges coincida con su registro. Por eso el orden: se borra
+# la fila vieja de un charge que cambió de fecha, se actualiza el registro y recién
+# después se inserta. El merge se hace en varios comandos dentro de la misma
+# transacción, a partir de stg_charges_nuevos: el charge más reciente de cada id del
+# lote (el mismo criterio que deduplicar_charges, que ya los dejó únicos), con el
+# created_at que tiene hoy en la base (NULL si el id es nuevo).
+# El LOCK se toma después del COPY a staging, justo antes de leer el registro, y dura
+# hasta el commit (con ETL_TRANSACCION_UNICA, hasta el final de la corrida). SHARE ROW
+# EXCLUSIVE choca consigo mismo y con las escrituras en dbo.charge_ids, pero no con
+# los SELECT ni con las verificaciones de la FK: serializa los merges concurrentes,
+# que de otro modo verían el mismo id como nuevo y el segundo fallaría por la FK.
+# {origen} es la tabla de staging o la unión de las tablas de cada tramo.
+SQL_NUEVOS_CHARGES = """
+    LOCK TABLE dbo.charge_ids IN SHARE ROW EXCLUSIVE MODE;
+
+    DROP TABLE IF EXISTS stg_charges_nuevos;
+    CREATE TEMP TABLE stg_charges_nuevos ON COMMIT DROP AS
+    SELECT n.*, r.created_at AS created_at_anterior
+    FROM (
+        SELECT DISTINCT ON (id)
+            id, company_id, amount, status, created_at, updated_at
+        FROM {origen}
+        ORDER BY id, updated_at DESC NULLS LAST, created_at DESC, orden DESC
+    ) n
+    LEFT JOIN dbo.charge_ids r ON r.id = n.id;
+
+    CREATE INDEX ON stg_charges_nuevos (created_at);
+    ANALYZE stg_charges_nuevos;
+"""
+
+# Mantiene dbo.daily_company_totals antes de escribir los charges, mientras la base
+# todavía tiene los valores anteriores: se suma lo nuevo y se resta lo anterior por
+# (compañía, día); si una actualización cambia el monto o la fecha, el día viejo
+# baja y el nuevo sube. Los días que quedan sin charges se anotan en
+# stg_totales_vacios y se eliminan después (SQL_LIMPIAR_TOTALES): el mismo comando
+# no puede borrar filas que él mismo insertó o actualizó. Los anteriores se buscan
+# por (id, created_at), así que solo se leen las particiones donde están
+SQL_TOTALES_CHARGES = """
+    DROP TABLE IF EXISTS stg_totales_vacios;
+    CREATE TEMP TABLE stg_totales_vacios (
+        company_id VARCHAR(40) NOT NULL,
+        transaction_date DATE NOT NULL
+    ) ON COMMIT DROP;
+
+    WITH totales AS (
+        INSERT INTO dbo.daily_company_totals AS t (
+            company_id, transaction_date, total_amount, charges_count
+        )
+        SELECT company_id, transaction_date, SUM(amount), SUM(n)
+        FROM (
+            SELECT company_id, created_at::date AS transaction_date, amount, 1 AS n
+            FROM stg_charges_nuevos
+            UNION ALL
+            SELECT ch.company_id, ch.created_at::date, -ch.amount, -1
+            FROM stg_charges_nuevos n
+            JOIN dbo.charges ch
+                ON ch.id = n.id AND ch.created_at = n.created_at_anterior
+        ) deltas
+        GROUP BY company_id, transaction_date
+        ON CONFLICT (company_id, transaction_date) DO UPDATE SET
+            total_amount  = t.total_amount + EXCLUDED.total_amount,
+            charges_count = t.charges_count + EXCLUDED.charges_count
+        RETURNING t.company_id, t.transaction_date, t.charges_count
+    )
+    INSERT INTO stg_totales_vacios
+    SELECT company_id, transaction_date
+    FROM totales
+    WHERE charges_count = 0
+"""
+
+# Un charge cuyo created_at cambió ya no va en la misma fila (puede que ni en la
+# misma partición): se borra la fila vieja, se actualiza su created_at en el
+# registro y el upsert de su partición lo inserta de nuevo
+SQL_MOVER_CHARGES = """
+    DELETE FROM dbo.charges ch
+    USING stg_charges_nuevos n
+    WHERE ch.id = n.id
+      AND ch.created_at = n.created_at_anterior
+      AND n.created_at <> n.created_at_anterior
+"""
+
+SQL_REGISTRAR_CHARGES = """
+    INSERT INTO dbo.charge_ids (id, created_at)
+    SELECT id, created_at
+    FROM stg_charges_nuevos
+    WHERE created_at_anterior IS DISTINCT FROM created_at
+    ON CONFLICT (id) DO UPDATE SET
+        created_at = EXCLUDED.created_at
+"""
+
+# Se escribe directo en la partición de cada mes, sin pasar por el ruteo de la tabla
+# padre; las particiones de meses sin charges en el lote no se tocan
+SQL_UPSERT_PARTICION = """
+    INSERT INTO {particion} (
+        id, company_id, amount, status, created_at, updated_at
+    )
+    SELECT id, company_id, amount, status, created_at, updated_at
+    FROM stg_charges_nuevos
+    WHERE created_at >= %(desde)s AND created_at < %(hasta)s
+    ON CONFLICT (id, created_at) DO UPDATE SET
+        company_id  = EXCLUDED.company_id,
+        amount      = EXCLUDED.amount,
+        status      = EXCLUDED.status,
+        updated_at  = EXCLUDED.updated_at
+"""
+
+# Un id que ya estaba cuenta como actualizado, aunque se haya movido de partición
+SQL_CONTEO_CHARGES = """
+    SELECT
+        COUNT(*) FILTER (WHERE created_at_anterior IS NULL),
+        COUNT(*) FILTER (WHERE created_at_anterior IS NOT NULL)
+    FROM stg_charges_nuevos
+"""
+
+# Solo las (compañía, día) que tocó este merge, por la PK
+SQL_LIMPIAR_TOTALES = """
+    DELETE FROM dbo.daily_company_totals t
+    USING stg_totales_vacios v
+    WHERE t.company_id = v.company_id
+      AND t.transaction_date = v.transaction_date
+"""
+
+
+def fusionar_charges(cursor, origen, meses):
+    """
+    Fusiona los charges de `origen` (staging con columna 'orden') con
+    dbo.charges, partición por partición, y mantiene dbo.charge_ids y
+    dbo.daily_company_totals. `meses` son los meses de los charges de
+    origen, cuyas particiones ya deben existir.
+
+    Retorna (insertados, actualizados).
+    """
+    cursor.execute(SQL_NUEVOS_CHARGES.format(origen=origen))
+    cursor.execute(SQL_TOTALES_CHARGES)
+    cursor.execute(SQL_MOVER_CHARGES)
+    cursor.execute(SQL_REGISTRAR_CHARGES)
+
+    for mes in meses:
+        desde, hasta = rango_particion(mes)
+        cursor.execute(SQL_UPSERT_PARTICION.format(particion=f"dbo.{nombre_particion(mes)}"),
+                       {"desde": desde, "hasta": hasta})
+
+    cursor.execute(SQL_LIMPIAR_TOTALES)
+    cursor.execute(SQL_CONTEO_CHARGES)
+    return cursor.fetchone()
+
+
+#FUNCION QUE MIGRA UNA dbo.charges SIN PARTICIONAR
+# dbo.charges particionada y su registro de ids, como en 01_init.sql. Solo se usa para
+# migrar una dbo.charges sin particionar (ver particionar_charges)
+SQL_TABLAS_CHARGES = """
+    CREATE TABLE IF NOT EXISTS dbo.charge_ids (
+        id          VARCHAR(40) PRIMARY KEY,
+        created_at  TIMESTAMP NOT NULL,
+        CONSTRAINT charge_ids_id_created_at_key UNIQUE (id, created_at)
+    );
+
+    CREATE TABLE IF NOT EXISTS dbo.charges (
+        id          VARCHAR(40) NOT NULL,
+        company_id  VARCHAR(40) NOT NULL,
+        amount      NUMERIC(16,2) NOT NULL,
+        status      VARCHAR(30) NOT NULL,
+        created_at  TIMESTAMP NOT NULL,
+        updated_at  TIMESTAMP,
+        CONSTRAINT charges_pkey PRIMARY KEY (id, created_at),
+        CONSTRAINT fk_company_id
+            FOREIGN KEY (company_id) REFERENCES dbo.companies (company_id),
+        CONSTRAINT fk_charge_ids
+            FOREIGN KEY (id, created_at) REFERENCES dbo.charge_ids (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE INDEX IF NOT EXISTS charges_company_id_created_at_idx
+        ON dbo.charges (company_id, created_at);
+"""
+
+# La tabla vieja conserva sus datos hasta copiarlos; su PK y su índice se renombran
+# para que la tabla particionada pueda usar los mismos nombres
+SQL_RENOMBRAR_CHARGES = """
+    ALTER TABLE dbo.charges RENAME TO charges_sin_particionar;
+    ALTER TABLE dbo.charges_sin_particionar
+        RENAME CONSTRAINT charges_pkey TO charges_sin_particionar_pkey;
+    ALTER INDEX IF EXISTS dbo.charges_company_id_created_at_idx
+        RENAME TO charges_sin_particionar_company_id_created_at_idx;
+"""
+
+SQL_COPIAR_CHARGES_SIN_PARTICIONAR = """
+    INSERT INTO dbo.charge_ids (id, created_at)
+    SELECT id, created_at FROM dbo.charges_sin_particionar;
+
+    INSERT INTO dbo.charges (id, company_id, amount, status, created_at, updated_at)
+    SELECT id, company_id, amount, status, created_at, updated_at
+    FROM dbo.charges_sin_particionar;
+
+    DROP TABLE dbo.charges_sin_particionar;
+"""
+
+
+def particionar_charges(cursor):
+    """
+    Convierte una dbo.charges sin particionar (bases creadas antes de
+    particionarla) en la tabla particionada por mes, con una partición por
+    cada mes que ya tenía charges, y llena dbo.charge_ids. Corre en la
+    transacción de preparar_esquema: si algo falla queda la tabla original.
+    """
+    cursor.execute(SQL_RENOMBRAR_CHARGES)
+    cursor.execute(SQL_TABLAS_CHARGES)
+
+    cursor.execute("SELECT DISTINCT date_trunc('month', created_at) FROM dbo.charges_sin_particionar")
+    asegurar_particiones(cursor, meses_charges([fila[0] for fila in cursor.fetchall()]))
+
+    cursor.execute(SQL_COPIAR_CHARGES_SIN_PARTICIONAR)
+    print("dbo.charges convertida en tabla particionada por mes de created_at")
@@ -11,6 +11,19 @@ CREATE TABLE dbo.companies (
     company_name VARCHAR(130) NULL
 );
 
+-- Registro de ids de charges. La PK de una tabla particionada tiene que incluir la
+-- columna de partición, así que la unicidad de id se apoya en esta tabla: un solo
+-- created_at (la partición donde está el charge) por id. La FK de dbo.charges a
+-- (id, created_at) impide que un id quede en dos filas, aunque se escriba fuera del ETL
+CREATE TABLE dbo.charge_ids (
+    id VARCHAR(40) NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    CONSTRAINT charge_ids_pkey PRIMARY KEY (id),
+    CONSTRAINT charge_ids_id_created_at_key UNIQUE (id, created_at)
+);
+
+-- Charges particionados por mes de created_at. Las particiones (dbo.charges_AAAAMM)
+-- las crea el ETL al cargar el primer charge de cada mes
 CREATE TABLE dbo.charges (
     id VARCHAR(40) NOT NULL,
     company_id VARCHAR(40) NOT NULL,
@@ -18,23 +31,93 @@ CREATE TABLE dbo.charges (
     status VARCHAR(30) NOT NULL,
     created_at TIMESTAMP NOT NULL,
     updated_at TIMESTAMP NULL,
-    CONSTRAINT charges_pkey PRIMARY KEY (id),
+    CONSTRAINT charges_pkey PRIMARY KEY (id, created_at),
     CONSTRAINT fk_company_id
+        FOREIGN KEY (company_id)
+        REFERENCES dbo.companies (company_id),
+    CONSTRAINT fk_charge_ids
+        FOREIGN KEY (id, created_at)
+        REFERENCES dbo.charge_ids (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Marca de agua del ETL: último lote de data_raw procesado
+CREATE TABLE dbo.etl_marcas (
+    proceso VARCHAR(50) NOT NULL PRIMARY KEY,
+    ultimo_lote BIGINT NOT NULL,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Alertas de charges rechazados por el ETL, para revisión manual.
+-- Una alerta por (alert_key, regla): alert_key es el id del charge o, sin id, una huella de la fila
+CREATE TABLE dbo.charge_alerts (
+    alert_key TEXT NOT NULL,
+    regla VARCHAR(30) NOT NULL,
+    charge_id TEXT NULL,
+    company_name TEXT NULL,
+    company_id TEXT NULL,
+    amount DOUBLE PRECISION NULL,
+    status TEXT NULL,
+    created_at TIMESTAMP NULL,
+    updated_at TIMESTAMP NULL,
+    motivo TEXT NOT NULL,
+    company_name_norm TEXT NULL,
+    ejecucion VARCHAR(32) NOT NULL,
+    primera_vez TIMESTAMP NOT NULL DEFAULT now(),
+    ultima_vez TIMESTAMP NOT NULL DEFAULT now(),
+    veces INTEGER NOT NULL DEFAULT 1,
+    CONSTRAINT charge_alerts_pkey PRIMARY KEY (alert_key, regla)
+);
+
+CREATE INDEX charge_alerts_regla_ultima_vez_idx
+    ON dbo.charge_alerts (regla, ultima_vez);
+
+CREATE INDEX charge_alerts_ejecucion_idx
+    ON dbo.charge_alerts (ejecucion);
+
+CREATE INDEX charges_company_id_created_at_idx
+    ON dbo.charges (company_id, created_at);
+
+-- Totales diarios por compañía materializados; el ETL los mantiene al cargar charges
+CREATE TABLE dbo.daily_company_totals (
+    company_id VARCHAR(40) NOT NULL,
+    transaction_date DATE NOT NULL,
+    total_amount NUMERIC NOT NULL,
+    charges_count BIGINT NOT NULL,
+    CONSTRAINT daily_company_totals_pkey PRIMARY KEY (company_id, transaction_date),
+    CONSTRAINT fk_daily_company_totals_company_id
         FOREIGN KEY (company_id)
         REFERENCES dbo.companies (company_id)
 );
 
+CREATE INDEX daily_company_totals_transaction_date_idx
+    ON dbo.daily_company_totals (transaction_date);
+
+-- Recalcula los totales desde cero (p. ej. tras modificar dbo.charges fuera del ETL)
+CREATE OR REPLACE FUNCTION dbo.recalcular_daily_company_totals()
+RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM dbo.daily_company_totals;
+
+    INSERT INTO dbo.daily_company_totals (
+        company_id, transaction_date, total_amount, charges_count
+    )
+    SELECT company_id, created_at::date, SUM(amount), COUNT(*)
+    FROM dbo.charges
+    GROUP BY company_id, created_at::date;
+$$;
+
 -- =========================
 -- VISTAS EN SCHEMA vistas
 -- =========================
 CREATE OR REPLACE VIEW vistas.daily_company_totals AS
 SELECT
     c.company_name,
-    DATE(ch.created_at) AS transaction_date,
-    SUM(ch.amount) AS total_amount
-FROM dbo.charges ch
+    t.transaction_date,
+    SUM(t.total_amount) AS total_amount
+FROM dbo.daily_company_totals t
 JOIN dbo.companies c 
-    ON ch.company_id = c.company_id
+    ON t.company_id = c.company_id
 GROUP BY 
     c.company_name, 
-    DATE(ch.created_at);
\ No newline at end of file
+    t.transaction_date;
\ No newline at end of file